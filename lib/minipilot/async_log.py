@@ -0,0 +1,277 @@
+"""
+Asynchronous logging: handlers handing records to one writer thread, so that a log call does not wait for file I/O.
+
+Level and filters of an AsyncHandler are checked in the calling thread (JobLogFilter depends on the caller's
+thread_context), and the message is rendered there too, as its arguments may change later. Formatting and writing
+happen in the writer thread, which writes whatever records are queued at once and flushes each target once per batch.
+flush() of a handler waits until everything queued before it is written, eg. before a log file is archived.
+At interpreter exit the writer writes what is queued and ends; records logged after that are written by the caller.
+
+Handlers are set up in loggers.ini (pilot.py registers them in logging.handlers for it):
+
+    [handler_pilotlog]
+    class=handlers.AsyncFileHandler
+    args=("pilot.log", 'w')
+"""
+import time
+import atexit
+import logging
+import threading
+from collections import deque
+
+QUEUE_SIZE = 10000  # records waiting for the writer; a log call waits when the writer is that far behind
+BATCH_SIZE = 500  # maximum records written between flushes
+
+_writer = None
+_writer_lock = threading.Lock()
+_stopped = False  # set at interpreter exit, no writer is started after it
+
+
+class LogWriter(threading.Thread):
+    """
+    Thread writing records of all AsyncHandlers to their targets.
+
+    Attributes:
+        queue                   Deque of (target handler, record), (None, threading.Event) drain markers, or
+                                (None, None) stop markers.
+                                Appending to a deque takes no lock, so the writer does not slow down log calls.
+        idle                    Whether the writer waits for wakeup, set when the queue is empty.
+        stopping                Whether the writer ends once the queue is empty, set by a stop marker.
+    """
+
+    def __init__(self):
+        threading.Thread.__init__(self, name="log-writer")
+        self.daemon = True
+        self.queue = deque()
+        self.idle = False
+        self.stopping = False
+        self.wakeup = threading.Event()
+
+    def put(self, item):
+        """
+        Queues record or drain marker. Waits while the queue is full.
+
+        :param item: (target handler, record), (None, threading.Event) or (None, None)
+        """
+        while len(self.queue) >= QUEUE_SIZE and self.is_alive():
+            time.sleep(0.001)
+        self.queue.append(item)
+        if self.idle:
+            self.wakeup.set()
+
+    def drain(self, timeout=None):
+        """
+        Waits until records queued so far are written and flushed.
+
+        :param timeout: seconds to wait, None for forever.
+        :return: whether the records are written.
+        """
+        if threading.current_thread() is self or not self.is_alive():
+            return True
+        done = threading.Event()
+        self.put((None, done))
+        done.wait(timeout)
+        return done.is_set()
+
+    def stop(self, timeout=None):
+        """
+        Ends the writer after it writes the records queued so far.
+
+        :param timeout: seconds to wait for the writer to end, None for forever.
+        """
+        if threading.current_thread() is self or not self.is_alive():
+            return
+        self.put((None, None))
+        self.join(timeout)
+
+    def take(self):
+        """
+        :return: up to BATCH_SIZE items taken from the queue.
+        """
+        batch = []
+        while len(batch) < BATCH_SIZE:
+            try:
+                batch.append(self.queue.popleft())
+            except IndexError:
+                break
+        return batch
+
+    def run(self):
+        while True:
+            batch = self.take()
+            if not batch:
+                if self.stopping:
+                    return
+                # The queue is checked again after idle is set, so a record queued meanwhile is not missed.
+                self.idle = True
+                if not self.queue:
+                    self.wakeup.wait(1)
+                self.wakeup.clear()
+                self.idle = False
+                continue
+
+            dirty = []
+            for target, record in batch:
+                if target is None:  # drain or stop marker
+                    flush(dirty)
+                    dirty = []
+                    if record is None:
+                        self.stopping = True
+                    else:
+                        record.set()
+                else:
+                    write(target, record)
+                    if target not in dirty:
+                        dirty.append(target)
+            flush(dirty)
+
+
+def write(target, record):
+    """
+    Writes record to target handler. Streams are written directly, so that they can be flushed once per batch.
+    """
+    if not isinstance(target, logging.StreamHandler) or getattr(target, 'stream', None) is None:
+        target.handle(record)
+        return
+    if record.levelno < target.level or not target.filter(record):
+        return
+    target.acquire()
+    try:
+        msg = target.format(record) + getattr(target, 'terminator', "\n")
+        try:
+            target.stream.write(msg)
+        except UnicodeError:
+            target.stream.write(msg.encode('utf-8'))
+    except Exception:
+        target.handleError(record)
+    finally:
+        target.release()
+
+
+def flush(targets):
+    for target in targets:
+        # noinspection PyBroadException
+        try:
+            target.flush()
+        except Exception:
+            pass
+
+
+def get_writer():
+    """
+    :return LogWriter: writer thread of the process, started on first use, or None after shutdown.
+    """
+    global _writer
+    writer = _writer
+    if writer is not None and writer.is_alive():
+        return writer
+    with _writer_lock:
+        if _stopped:
+            return None
+        if _writer is None or not _writer.is_alive():
+            _writer = LogWriter()
+            _writer.start()
+    return _writer
+
+
+def drain(timeout=None):
+    """
+    Waits until all records queued so far are written, see LogWriter.drain.
+    """
+    return _writer.drain(timeout) if _writer is not None else True
+
+
+def shutdown(timeout=10):
+    """
+    Stops the writer after it writes the queued records, so that they are not lost with the daemon thread at
+    interpreter exit. Registered with atexit; it runs before logging.shutdown, which closes the handlers.
+
+    :param timeout: seconds to wait for the writer.
+    """
+    global _stopped
+    with _writer_lock:
+        _stopped = True
+        writer = _writer
+    if writer is not None:
+        writer.stop(timeout)
+
+
+atexit.register(shutdown)
+
+
+class AsyncHandler(logging.Handler):
+    """
+    Handler passing records to the target handler through the writer thread.
+
+    Attributes:
+        target                  Handler writing the records. Its formatter is the formatter of this handler.
+    """
+
+    def __init__(self, target=None, level=logging.NOTSET):
+        self.target = target if target is not None else logging.NullHandler()
+        logging.Handler.__init__(self, level)
+
+    @property
+    def formatter(self):
+        return self.target.formatter
+
+    @formatter.setter
+    def formatter(self, formatter):
+        self.target.formatter = formatter
+
+    def prepare(self, record):
+        """
+        Renders the message and the exception of a record in the calling thread.
+
+        :return: copy of the record without references to arguments and traceback.
+        """
+        prepared = logging.LogRecord.__new__(record.__class__)
+        prepared.__dict__.update(record.__dict__)
+        record = prepared
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = (self.formatter or logging.Formatter()).formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def emit(self, record):
+        # noinspection PyBroadException
+        try:
+            writer = get_writer()
+            if writer is None:
+                write(self.target, record)
+            else:
+                writer.put((self.target, self.prepare(record)))
+        except Exception:
+            self.handleError(record)
+
+    def flush(self):
+        """
+        Waits until the records queued so far are written.
+        """
+        drain()
+
+    def close(self):
+        self.flush()
+        self.target.close()
+        logging.Handler.close(self)
+
+
+class AsyncFileHandler(AsyncHandler):
+    """
+    Asynchronous logging.FileHandler.
+    """
+
+    def __init__(self, filename, mode='a', encoding=None, delay=False):
+        AsyncHandler.__init__(self, logging.FileHandler(filename, mode, encoding, delay))
+
+
+class AsyncStreamHandler(AsyncHandler):
+    """
+    Asynchronous logging.StreamHandler.
+    """
+
+    def __init__(self, stream=None):
+        AsyncHandler.__init__(self, logging.StreamHandler(stream))
@@ -0,0 +1,207 @@
+"""
+Node-wide cache of job input files, shared by all pilots on the node.
+
+Entries are addressed by scope, name and checksum of the file, so a changed file never hits a stale entry. Files are
+reflinked (copy-on-write clone) in and out of the cache if the file system supports it, and copied otherwise. They are
+never hard-linked: a payload may open its inputs for update, and must neither find them read-only nor modify the
+cached copy shared with later jobs. Entries are made read-only.
+
+Concurrency: entries appear atomically by rename(2), readers clone them without locks (an entry evicted meanwhile is
+just a miss), and eviction is serialized between pilots with flock(2). Least recently used entries are evicted first,
+usage is tracked by entry mtime, which is touched on every hit. Each pilot keeps an estimate of the cache size, its own
+additions to the size found at its last scan, and scans the cache only when the estimate exceeds the budget.
+"""
+import os
+import errno
+import fcntl
+import hashlib
+import logging
+import tempfile
+from contextlib import contextmanager
+from utility import copy_file
+
+log = logging.getLogger("pilot.cache")
+
+FICLONE = 0x40049409  # linux/fs.h: _IOW(0x94, 9, int)
+
+
+def clone_file(src, dst):
+    """
+    Places an independent copy of src at dst: reflink if the file system supports it, real copy otherwise.
+
+    :param src: source path
+    :param dst: destination path, must not exist
+    :return: method used: "reflink" or "copy"
+    """
+    try:
+        with open(src, 'rb') as f_in, open(dst, 'wb') as f_out:
+            fcntl.ioctl(f_out.fileno(), FICLONE, f_in.fileno())
+        return "reflink"
+    except (IOError, OSError):
+        if os.path.exists(dst):
+            os.remove(dst)
+
+    copy_file(src, dst)
+    return "copy"
+
+
+class FileCache(object):
+    """
+    Content addressed cache with a size budget.
+
+    Attributes:
+        root                    Cache directory.
+        size_limit              Maximum total size of entries, bytes.
+        size                    Estimated total size of entries: size found at the last scan plus entries stored since,
+                                None before the first scan.
+    """
+
+    def __init__(self, root, size_limit):
+        self.root = root
+        self.size_limit = size_limit
+        self.size = None
+        if not os.path.isdir(root):
+            try:
+                os.makedirs(root)
+            except OSError:
+                pass  # created concurrently
+
+    @staticmethod
+    def key(scope, name, checksum):
+        return hashlib.sha1(("%s:%s:%s" % (scope, name, checksum)).encode('utf-8')).hexdigest()
+
+    def entry(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    @contextmanager
+    def lock(self):
+        """
+        Exclusive lock of the cache among all pilots of the node.
+        """
+        with open(os.path.join(self.root, ".lock"), 'a') as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def fetch(self, scope, name, checksum, dst):
+        """
+        Places cached file at dst if it is in cache.
+
+        :return: whether it was a hit.
+        """
+        if checksum is None:
+            return False
+        entry = self.entry(self.key(scope, name, checksum))
+        try:
+            os.utime(entry, None)
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                return False
+            # Entry of another user, fine to use it, though it is not marked as recently used.
+        try:
+            if os.path.lexists(dst):
+                os.remove(dst)
+            method = clone_file(entry, dst)
+        except (IOError, OSError) as e:
+            if e.errno != errno.ENOENT:  # ENOENT: evicted right now
+                log.warning("Failed to fetch %s:%s from cache: %s" % (scope, name, str(e)))
+            return False
+        log.info("Cache hit for %s:%s (%s)" % (scope, name, method))
+        return True
+
+    def store(self, scope, name, checksum, src):
+        """
+        Puts downloaded file into cache and evicts old entries if the cache is estimated to be over its budget.
+        Files without checksum are not cached.
+        """
+        if checksum is None:
+            return
+        entry = self.entry(self.key(scope, name, checksum))
+        if os.path.exists(entry):
+            return
+        directory = os.path.dirname(entry)
+        try:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+        except OSError:
+            pass  # created concurrently
+
+        try:
+            size = self.put(src, entry)
+        except (IOError, OSError) as e:
+            log.warning("Failed to store %s:%s in cache: %s" % (scope, name, str(e)))
+            return
+        log.info("Stored %s:%s in cache" % (scope, name))
+        if self.size is not None:
+            self.size += size
+        if self.size is None or self.size > self.size_limit:
+            self.evict()
+
+    @staticmethod
+    def put(src, entry):
+        """
+        Makes read-only copy of src appear at entry atomically.
+
+        :return: size of the entry
+        """
+        fd, tmp = tempfile.mkstemp(prefix=".tmp-", dir=os.path.dirname(entry))
+        os.close(fd)
+        os.remove(tmp)
+        try:
+            clone_file(src, tmp)
+            os.chmod(tmp, 0o444)
+            size = os.path.getsize(tmp)
+            os.rename(tmp, entry)
+        except (IOError, OSError):
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        return size
+
+    def discard(self, scope, name, checksum):
+        """
+        Removes entry, eg. if it turned out to be corrupted.
+        """
+        if checksum is None:
+            return
+        try:
+            os.remove(self.entry(self.key(scope, name, checksum)))
+        except OSError:
+            pass
+
+    def entries(self):
+        """
+        :return: list of (mtime, size, path) of all entries.
+        """
+        entries = []
+        for directory, dirs, files in os.walk(self.root):
+            for f in files:
+                if f.startswith("."):
+                    continue
+                path = os.path.join(directory, f)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue  # evicted concurrently
+                entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def evict(self):
+        """
+        Scans the cache and removes least recently used entries until it fits its budget.
+        """
+        with self.lock():
+            entries = sorted(self.entries())
+            total = sum(size for mtime, size, path in entries)
+            for mtime, size, path in entries:
+                if total <= self.size_limit:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+                log.info("Evicted %s from cache" % path)
+            self.size = total
@@ -0,0 +1,86 @@
+"""
+File checksums in the formats used by job descriptions: "ad:01234567" for adler32, "md5:0123...ef" for md5. Values
+without prefix are recognized by length.
+"""
+import os
+import zlib
+import hashlib
+
+BLOCK_SIZE = 4 * 1024 * 1024  # bytes read at once
+
+
+class Adler32(object):
+    """
+    Adler32 with hashlib-like interface.
+    """
+
+    def __init__(self):
+        self.value = 1
+
+    def update(self, data):
+        self.value = zlib.adler32(data, self.value)
+
+    def hexdigest(self):
+        return "%08x" % (self.value & 0xffffffff)
+
+
+algorithms = {
+    'ad': Adler32,
+    'adler32': Adler32,
+    'md5': hashlib.md5,
+}
+
+
+def parse_checksum(checksum):
+    """
+    Splits checksum into algorithm and value.
+
+    :param checksum: checksum string from description
+    :return: (algorithm, lowercase hex value), algorithm is None if it is not recognized.
+    """
+    algorithm, sep, value = str(checksum).rpartition(':')
+    if not sep:
+        algorithm = {8: 'ad', 32: 'md5'}.get(len(value))
+    if algorithm not in algorithms:
+        algorithm = None
+    return algorithm, value.lower()
+
+
+def file_checksum(path, algorithm):
+    """
+    Computes file checksum in one streaming pass with large block reads.
+
+    :param path: file path
+    :param algorithm: key of algorithms
+    :return: lowercase hex value
+    """
+    h = algorithms[algorithm]()
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(BLOCK_SIZE)
+            if not block:
+                break
+            h.update(block)
+    return h.hexdigest()
+
+
+def verify_file(path, checksum=None, size=None):
+    """
+    Checks file size and checksum, if they are known.
+
+    :param path: file path
+    :param checksum: checksum string from description, or None
+    :param size: expected size in bytes, or None
+    :return: None if file is fine, error message otherwise.
+    """
+    if not os.path.isfile(path):
+        return "file does not exist"
+    if size is not None and os.path.getsize(path) != int(size):
+        return "size %d does not match %d" % (os.path.getsize(path), int(size))
+    if checksum is not None:
+        algorithm, value = parse_checksum(checksum)
+        if algorithm is not None:
+            actual = file_checksum(path, algorithm)
+            if actual != value:
+                return "%s checksum %s does not match %s" % (algorithm, actual, value)
+    return None
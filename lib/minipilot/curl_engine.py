@@ -0,0 +1,274 @@
+"""
+Concurrent HTTP queries over the libcurl multi interface.
+
+All queries submitted to one CurlEngine are performed by one thread, which drives a CurlMulti with select(2) and a
+self-pipe for wake ups, as ProcessLoop does for children. Any number of queries may be in flight at once, so state
+updates and job requests of concurrent jobs do not wait for each other. Handles are taken from a CurlPool and returned
+there, so connections and TLS sessions are still reused.
+
+Usage:
+
+    engine = CurlEngine(pool)
+    handle = engine.submit(url, body, ssl=True)
+    handle.add_done_callback(...)
+    ...
+    response = handle.result()
+"""
+import os
+import select
+import logging
+import threading
+import pycurl
+
+log = logging.getLogger("pilot.curl")
+
+TICK = 1.0  # seconds between libcurl timeout checks, if libcurl does not ask for sooner
+
+
+class RequestHandle(object):
+    """
+    Future-like handle of a query running in CurlEngine.
+
+    Attributes:
+        url                     URL of the resource.
+        curl                    cURL handle performing the query, None when finished.
+        chunks                  Received response parts.
+        status                  HTTP status code of the response, None until finished.
+        headers                 Dict of response headers, names in lower case.
+        error                   pycurl.error if the query failed, or the error that stopped the engine, None otherwise.
+    """
+
+    def __init__(self, url, curl):
+        self.url = url
+        self.curl = curl
+        self.chunks = []
+        self.status = None
+        self.headers = {}
+        self.error = None
+        self.callbacks = []
+        self.__finished = False
+        self.__done = threading.Event()
+        self.__lock = threading.Lock()
+
+    def done(self):
+        """
+        :return: whether the query has finished.
+        """
+        return self.__done.is_set()
+
+    def wait(self, timeout=None):
+        """
+        Blocks until the query is finished.
+
+        :param timeout: seconds to wait, None for forever.
+        :return: whether the query is finished.
+        """
+        self.__done.wait(timeout)
+        return self.done()
+
+    def result(self, timeout=None):
+        """
+        Waits for the query. May be called from done callbacks too.
+
+        :param timeout: seconds to wait, None for forever.
+        :return str: server response.
+        :raises pycurl.error: if the query failed, or the error that stopped the engine.
+        """
+        if not self.__finished and not self.wait(timeout):
+            raise RuntimeError("query to %s is still running" % self.url)
+        if self.error is not None:
+            raise self.error
+        return "".join(self.chunks)
+
+    def header(self, line):
+        """
+        Collects response header line. Headers of an earlier response (eg. a redirect) are dropped.
+        """
+        line = line.decode('iso-8859-1').strip()
+        if line.startswith("HTTP/"):
+            self.headers = {}
+        elif ":" in line:
+            name, value = line.split(":", 1)
+            self.headers[name.strip().lower()] = value.strip()
+
+    def add_done_callback(self, fn):
+        """
+        Calls fn(handle) when query is finished. Called immediately if it already is.
+        Callbacks run in the engine thread, so they should be short.
+
+        :param fn: callback
+        """
+        with self.__lock:
+            if not self.__finished:
+                self.callbacks.append(fn)
+                return
+        fn(self)
+
+    def finish(self):
+        """
+        Fires callbacks and marks handle as finished. Called by the engine.
+        """
+        with self.__lock:
+            self.__finished = True
+            callbacks, self.callbacks = self.callbacks, []
+        for fn in callbacks:
+            try:
+                fn(self)
+            except Exception as e:
+                log.error("Query callback failed: %s" % str(e))
+        self.__done.set()
+
+
+class CurlEngine(threading.Thread):
+    """
+    Thread performing many queries at once. Started on first submit.
+
+    Attributes:
+        pool                    CurlPool handles are taken from.
+        error                   Exception that stopped the engine thread, None while it works. Queries in flight get
+                                it as their error, new ones are refused.
+    """
+
+    def __init__(self, pool):
+        threading.Thread.__init__(self, name="curl-engine")
+        self.daemon = True
+        self.pool = pool
+        self.multi = pycurl.CurlMulti()
+        self.handles = {}
+        self.pending = []
+        self.lock = threading.Lock()
+        self.wakeup_r, self.wakeup_w = os.pipe()
+        self.stopping = False
+        self.error = None
+
+    def submit(self, url, body=None, headers=None, **kwargs):
+        """
+        Starts a query, GET or POST if there is body.
+
+        :param url: URL of the resource
+        :param body: string to be sent, if any.
+        :param headers: list of request headers added to the handle's own ones (handle.headers, if it has them).
+        :param kwargs: handle kind, passed to the pool.
+        :return RequestHandle: handle of the query
+        """
+        c = self.pool.acquire(**kwargs)
+        handle = RequestHandle(url, c)
+        c.setopt(c.URL, url)
+        c.setopt(c.WRITEFUNCTION, handle.chunks.append)
+        c.setopt(c.HEADERFUNCTION, handle.header)
+        c.setopt(c.HTTPHEADER, getattr(c, 'headers', []) + list(headers or []))
+        if body is not None:
+            c.setopt(c.POSTFIELDS, body)
+        else:
+            c.setopt(c.HTTPGET, 1)
+
+        with self.lock:
+            if self.stopping or self.error is not None:
+                self.pool.release(c)
+                raise RuntimeError("curl engine is stopped" if self.error is None else
+                                   "curl engine failed: %s" % str(self.error))
+            self.pending.append(handle)
+            if not self.is_alive():
+                self.start()
+        os.write(self.wakeup_w, b'.')
+        return handle
+
+    def query(self, url, body=None, **kwargs):
+        """
+        Synchronous shim, same interface as CurlPool.query.
+
+        :return str: server response.
+        """
+        return self.submit(url, body, **kwargs).result()
+
+    def stop(self):
+        """
+        Stops the engine after queries in flight are finished.
+        """
+        with self.lock:
+            self.stopping = True
+        os.write(self.wakeup_w, b'.')
+
+    def run(self):
+        while not self.stopping or self.handles or self.pending:
+            try:
+                self.step()
+            except Exception as e:
+                self.fail(e)
+                return
+
+    def step(self):
+        """
+        Performs queries until there is something to do: a transfer is ready, a query is submitted or a timeout expires.
+        """
+        self.adopt_pending()
+        while self.multi.perform()[0] == pycurl.E_CALL_MULTI_PERFORM:
+            pass
+        self.collect()
+
+        read, write, error = self.multi.fdset()
+        timeout = self.multi.timeout()
+        timeout = TICK if timeout < 0 else min(timeout / 1000., TICK)
+        if self.pending:
+            timeout = 0
+        ready = select.select(read + [self.wakeup_r], write, error, timeout)[0]
+        if self.wakeup_r in ready:
+            os.read(self.wakeup_r, 4096)
+
+    def fail(self, error):
+        """
+        Finishes queries in flight and pending ones with the error that stopped the engine, so that their waiters do not
+        hang, and makes submit refuse new queries.
+
+        :param error: exception
+        """
+        log.error("Curl engine failed: %s" % str(error))
+        with self.lock:
+            self.error = error
+            pending, self.pending = self.pending, []
+        handles, self.handles = list(self.handles.values()), {}
+        for handle in handles + pending:
+            c, handle.curl = handle.curl, None
+            # noinspection PyBroadException
+            try:
+                if handle in handles:
+                    self.multi.remove_handle(c)
+                c.close()
+            except Exception:
+                pass
+            handle.error = error
+            handle.finish()
+
+    def adopt_pending(self):
+        with self.lock:
+            pending, self.pending = self.pending, []
+        for handle in pending:
+            self.handles[handle.curl] = handle
+            self.multi.add_handle(handle.curl)
+
+    def collect(self):
+        """
+        Finishes handles of completed queries.
+        """
+        while True:
+            queued, succeeded, failed = self.multi.info_read()
+            for c in succeeded:
+                self.complete(c, None)
+            for c, errno, message in failed:
+                self.complete(c, pycurl.error(errno, message))
+            if queued == 0:
+                break
+
+    def complete(self, c, error):
+        handle = self.handles.pop(c)
+        self.multi.remove_handle(c)
+        handle.curl = None
+        handle.error = error
+        if error is None:
+            handle.status = c.getinfo(c.RESPONSE_CODE)
+            log.debug("%s: %d new connection(s), %.3f s" % (handle.url, c.getinfo(c.NUM_CONNECTS),
+                                                            c.getinfo(c.TOTAL_TIME)))
+            self.pool.release(c)
+        else:
+            c.close()  # its connection may be broken
+        handle.finish()
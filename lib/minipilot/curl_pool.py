@@ -0,0 +1,118 @@
+"""
+Pool of cURL handles, which keeps connections to servers alive between queries.
+
+A libcurl easy handle keeps its connection cache: the next query to the same server on the same handle reuses the open
+TCP connection and TLS session instead of connecting and handshaking again. So handles are not closed after a query,
+but returned to the pool for the next one. All handles of the pool share DNS cache and TLS session cache through one
+CurlShare, so a handle opening a new connection still skips the name lookup and resumes the TLS session.
+"""
+import logging
+import threading
+from contextlib import contextmanager
+import pycurl
+
+log = logging.getLogger("pilot.curl")
+
+MAX_IDLE = 4  # idle handles kept per kind
+
+
+class CurlPool(object):
+    """
+    Thread-safe pool of configured cURL handles. Each handle is used by one query at a time.
+
+    Attributes:
+        factory                 Function creating a configured handle, takes handle kind keyword arguments.
+        share                   CurlShare of all handles of the pool.
+        idle                    Dict of handle kind -> list of idle handles.
+        max_idle                Maximum number of idle handles kept per kind.
+    """
+
+    def __init__(self, factory, max_idle=MAX_IDLE):
+        """
+        :param factory: function creating a configured handle, eg. Pilot.create_curl.
+        :param max_idle: maximum number of idle handles kept per kind.
+        """
+        self.factory = factory
+        self.max_idle = max_idle
+        self.idle = {}
+        self.lock = threading.Lock()
+        self.share = pycurl.CurlShare()
+        self.share.setopt(pycurl.SH_SHARE, pycurl.LOCK_DATA_DNS)
+        self.share.setopt(pycurl.SH_SHARE, pycurl.LOCK_DATA_SSL_SESSION)
+
+    def acquire(self, **kwargs):
+        """
+        Takes an idle handle of the kind or creates a new one.
+
+        :param kwargs: handle kind, passed to the factory.
+        :return pycurl.Curl: handle
+        """
+        kind = tuple(sorted(kwargs.items()))
+        with self.lock:
+            handles = self.idle.get(kind)
+            if handles:
+                return handles.pop()
+        c = self.factory(**kwargs)
+        c.setopt(c.SHARE, self.share)
+        c.setopt(c.TCP_KEEPALIVE, 1)
+        c.kind = kind
+        return c
+
+    def release(self, c):
+        """
+        Returns handle into the pool, or closes it if there are enough idle ones.
+        """
+        with self.lock:
+            handles = self.idle.setdefault(c.kind, [])
+            if len(handles) < self.max_idle:
+                handles.append(c)
+                return
+        c.close()
+
+    @contextmanager
+    def handle(self, **kwargs):
+        """
+        Context of a pooled handle. A handle, which failed, is closed instead of being returned, so that a broken
+        connection is not reused.
+
+        :param kwargs: handle kind, passed to the factory.
+        """
+        c = self.acquire(**kwargs)
+        try:
+            yield c
+        except Exception:
+            c.close()
+            raise
+        self.release(c)
+
+    def query(self, url, body=None, **kwargs):
+        """
+        Sends query, GET or POST if there is body.
+
+        :param url: URL of the resource
+        :param body: string to be sent, if any.
+        :param kwargs: handle kind, passed to the factory.
+        :return str: server response.
+        """
+        chunks = []
+        with self.handle(**kwargs) as c:
+            c.setopt(c.URL, url)
+            c.setopt(c.WRITEFUNCTION, chunks.append)
+            if body is not None:
+                c.setopt(c.POSTFIELDS, body)
+            else:
+                c.setopt(c.HTTPGET, 1)
+            c.perform()
+            log.debug("%s: %d new connection(s), %.3f s" % (url, c.getinfo(c.NUM_CONNECTS),
+                                                            c.getinfo(c.TOTAL_TIME)))
+        return "".join(chunks)
+
+    def close(self):
+        """
+        Closes idle handles and their connections.
+        """
+        with self.lock:
+            idle, self.idle = self.idle, {}
+        for handles in idle.values():
+            for c in handles:
+                c.close()
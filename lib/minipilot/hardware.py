@@ -0,0 +1,115 @@
+"""
+Node hardware fingerprint for job requests.
+
+Static facts (CPU model and frequency, total memory) do not change until the node reboots, but probing them is slow:
+cpuinfo may spawn subprocesses and take seconds. They are kept in a node-local file keyed by the kernel boot ID, so
+only the first pilot after a boot probes them. Dynamic facts (free disk space) are cheap and probed for every request.
+"""
+import os
+import json
+import time
+import logging
+import tempfile
+
+log = logging.getLogger("pilot.hardware")
+
+BOOT_ID = "/proc/sys/kernel/random/boot_id"
+
+
+def boot_id():
+    """
+    :return str: ID of the current boot of the node, or None if it is unknown.
+    """
+    try:
+        with open(BOOT_ID) as f:
+            return f.read().strip() or None
+    except (IOError, OSError):
+        return None
+
+
+def probe_static():
+    """
+    :return: dict of cpu (frequency, MHz), cpu_model and mem (total memory, MB).
+    """
+    import cpuinfo
+    import psutil
+    cpu_info = cpuinfo.get_cpu_info()
+    return {
+        'cpu': float(cpu_info['hz_actual_raw'][0]) / 1000000.,
+        'cpu_model': cpu_info.get('brand'),
+        'mem': float(psutil.virtual_memory().total) / 1024. / 1024.
+    }
+
+
+def probe_dynamic(path="."):
+    """
+    :param path: directory of the jobs
+    :return: dict of diskSpace (free disk space, MB) as the job server expects it.
+    """
+    import psutil
+    return {
+        'diskSpace': float(psutil.disk_usage(path).free) / 1024. / 1024.
+    }
+
+
+class HardwareCache(object):
+    """
+    Static facts of the node, probed once per boot.
+
+    Attributes:
+        path                    Cache file, or None to probe every time.
+        probe                   Function returning static facts.
+    """
+
+    def __init__(self, path, probe=probe_static):
+        self.path = path
+        self.probe = probe
+
+    def load(self, boot):
+        """
+        :param boot: current boot ID
+        :return: cached facts of the boot, or None.
+        """
+        try:
+            with open(self.path) as f:
+                entry = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        return entry.get('static') if entry.get('boot_id') == boot else None
+
+    def store(self, boot, facts):
+        """
+        Replaces cache file atomically.
+        """
+        try:
+            fd, tmp = tempfile.mkstemp(prefix=".tmp-", dir=os.path.dirname(os.path.abspath(self.path)))
+        except (IOError, OSError) as e:
+            log.warning("Failed to cache hardware facts in %s: %s" % (self.path, str(e)))
+            return
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'boot_id': boot, 'probed': time.time(), 'static': facts}, f)
+            os.chmod(tmp, 0o644)
+            os.rename(tmp, self.path)
+        except (IOError, OSError) as e:
+            log.warning("Failed to cache hardware facts in %s: %s" % (self.path, str(e)))
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def static(self):
+        """
+        :return: static facts from cache, or probed if the node has rebooted since they were cached.
+        """
+        boot = boot_id() if self.path else None
+        if boot is not None:
+            facts = self.load(boot)
+            if facts is not None:
+                log.info("Using hardware facts cached in %s" % self.path)
+                return facts
+
+        start = time.time()
+        facts = self.probe()
+        log.info("Probed hardware in %.3f s" % (time.time() - start))
+        if boot is not None:
+            self.store(boot, facts)
+        return facts
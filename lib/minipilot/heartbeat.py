@@ -0,0 +1,127 @@
+"""
+Payload monitoring: periodic heartbeats with resource usage of the payload process tree.
+
+Sampling reads /proc through psutil with psutil's oneshot caching, so it costs a few system calls per payload process.
+The payload is sampled every SAMPLE_INTERVAL seconds, more often than heartbeats are sent, so that memory maxima catch
+peaks between heartbeats. Heartbeats are handed to the job's StateReporter, so a slow server never stalls the sampling.
+"""
+import time
+import logging
+import threading
+import psutil
+from utility import thread_context
+
+log = logging.getLogger("pilot.heartbeat")
+
+SAMPLE_INTERVAL = 30  # seconds between samples of the payload, if heartbeats are not sent more often
+
+
+def sample_tree(process):
+    """
+    Sums resource usage of a process and all its live descendants.
+    CPU time includes descendants, which have already exited and were waited for.
+
+    :param process: psutil.Process of the tree root
+    :return: dict of cpu_time (s), rss, pss (kB), read_bytes, write_bytes, processes. Empty if the root is gone.
+    """
+    try:
+        processes = [process] + process.children(recursive=True)
+    except psutil.Error:
+        return {}
+    sample = {'cpu_time': 0., 'rss': 0, 'pss': 0, 'read_bytes': 0, 'write_bytes': 0, 'processes': 0}
+    for p in processes:
+        try:
+            with p.oneshot():
+                t = p.cpu_times()
+                cpu_time = t.user + t.system + t.children_user + t.children_system
+                try:
+                    memory = p.memory_full_info()
+                    pss = memory.pss
+                except (psutil.AccessDenied, AttributeError):
+                    memory = p.memory_info()
+                    pss = memory.rss
+                try:
+                    io = p.io_counters()
+                    read_bytes, write_bytes = io.read_bytes, io.write_bytes
+                except (psutil.AccessDenied, AttributeError):
+                    read_bytes, write_bytes = 0, 0
+        except psutil.Error:
+            continue  # exited meanwhile
+        sample['cpu_time'] += cpu_time
+        sample['rss'] += memory.rss // 1024
+        sample['pss'] += pss // 1024
+        sample['read_bytes'] += read_bytes
+        sample['write_bytes'] += write_bytes
+        sample['processes'] += 1
+    return sample if sample['processes'] else {}
+
+
+class Heartbeat(threading.Thread):
+    """
+    Thread sampling the payload every sample_interval seconds and sending heartbeats of the job every interval seconds
+    while the payload runs. Started by Utility.call as its started callback.
+
+    Attributes:
+        job                     Job of the payload.
+        interval                Seconds between heartbeats.
+        sample_interval         Seconds between samples, interval if it is shorter.
+        process                 psutil.Process of the payload.
+        metrics                 Last sample with maxima of memory over all samples: sample_tree fields plus max_rss and
+                                max_pss.
+    """
+
+    def __init__(self, job, interval, sample_interval=SAMPLE_INTERVAL):
+        threading.Thread.__init__(self, name="heartbeat")
+        self.daemon = True
+        self.job = job
+        self.interval = interval
+        self.sample_interval = min(sample_interval, interval)
+        self.process = None
+        self.metrics = {}
+        self.stopped = threading.Event()
+
+    def __call__(self, process):
+        """
+        Starts monitoring of the process.
+
+        :param process: psutil.Process of the payload
+        """
+        self.process = process
+        self.start()
+
+    def sample(self):
+        """
+        Samples the payload and updates metrics.
+
+        :return: metrics
+        """
+        start = time.time()
+        sample = sample_tree(self.process)
+        if sample:
+            sample['max_rss'] = max(sample['rss'], self.metrics.get('max_rss', 0))
+            sample['max_pss'] = max(sample['pss'], self.metrics.get('max_pss', 0))
+            self.metrics = sample
+            log.debug("Sampled %d process(es) in %.3f s" % (sample['processes'], time.time() - start))
+        return self.metrics
+
+    def run(self):
+        thread_context.owner = self.job
+        next_heartbeat = time.time() + self.interval
+        while not self.stopped.wait(max(0, min(self.sample_interval, next_heartbeat - time.time()))):
+            metrics = self.sample()
+            if time.time() < next_heartbeat:
+                continue
+            next_heartbeat += self.interval
+            if metrics:
+                self.job.log.info("Heartbeat: %d process(es), CPU %.1f s, RSS %d kB, PSS %d kB, read %d B, "
+                                  "written %d B" % (metrics['processes'], metrics['cpu_time'], metrics['rss'],
+                                                    metrics['pss'], metrics['read_bytes'], metrics['write_bytes']))
+                self.job.heartbeat(metrics)
+
+    def stop(self):
+        """
+        Stops heartbeats. Called when the payload has ended.
+        """
+        self.stopped.set()
+        if self.is_alive():
+            self.join()
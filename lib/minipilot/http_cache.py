@@ -0,0 +1,156 @@
+"""
+On-disk cache of HTTP documents (eg. queuedata from AGIS), shared by all pilots of the node.
+
+A document younger than its TTL is served from disk without any query. An expired one is refreshed with a conditional
+query (If-None-Match / If-Modified-Since), so an unchanged document costs the server just a 304 answer. If the server
+can not be reached or answers with garbage, the stale document is served. Entries are replaced atomically by rename(2),
+and a refresh is serialized between pilots with flock(2): pilots starting at once wait for the first one to refresh
+the entry and then use it, instead of all of them querying the server.
+"""
+import os
+import json
+import time
+import fcntl
+import hashlib
+import logging
+import tempfile
+from contextlib import contextmanager
+from email.utils import formatdate
+
+log = logging.getLogger("pilot.http_cache")
+
+
+class HTTPCache(object):
+    """
+    Cache of documents by URL.
+
+    Attributes:
+        root                    Cache directory.
+        ttl                     Seconds a document is served without asking the server.
+    """
+
+    def __init__(self, root, ttl):
+        self.root = root
+        self.ttl = ttl
+        if not os.path.isdir(root):
+            try:
+                os.makedirs(root)
+            except OSError:
+                pass  # created concurrently
+
+    def entry(self, url):
+        return os.path.join(self.root, hashlib.sha1(url.encode('utf-8')).hexdigest())
+
+    @contextmanager
+    def lock(self, url):
+        """
+        Exclusive lock of the URL entry among all pilots of the node. If the lock can not be taken (eg. the cache
+        belongs to another user), the entry is refreshed without it.
+        """
+        f = None
+        try:
+            f = open(self.entry(url) + ".lock", 'a')
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        except (IOError, OSError) as e:
+            log.warning("Failed to lock cache entry of %s, refreshing it unlocked: %s" % (url, str(e)))
+            if f is not None:
+                f.close()
+                f = None
+        try:
+            yield
+        finally:
+            if f is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+                f.close()
+
+    def load(self, url):
+        """
+        :return: cached entry: dict of url, body, fetched (time), etag and last_modified; or None.
+        """
+        try:
+            with open(self.entry(url)) as f:
+                entry = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        return entry if entry.get('url') == url else None
+
+    def store(self, entry):
+        """
+        Replaces entry atomically.
+        """
+        path = self.entry(entry['url'])
+        try:
+            fd, tmp = tempfile.mkstemp(prefix=".tmp-", dir=self.root)
+        except (IOError, OSError) as e:
+            log.warning("Failed to cache %s: %s" % (entry['url'], str(e)))
+            return
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(entry, f)
+            os.chmod(tmp, 0o644)
+            os.rename(tmp, path)
+        except (IOError, OSError) as e:
+            log.warning("Failed to cache %s: %s" % (entry['url'], str(e)))
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def fresh(self, entry):
+        return entry is not None and 0 <= time.time() - entry['fetched'] < self.ttl
+
+    def get(self, url, fetch, validate=None):
+        """
+        Gets document from cache or from server.
+
+        :param url: URL of the document
+        :param fetch: function(url, headers) -> (HTTP status, dict of lower case response headers, body), querying
+                      the server with additional request headers.
+        :param validate: function raising ValueError on a broken body, eg. json.loads. Broken bodies are not cached.
+        :return str: document body
+        :raises: fetch or validation error, if there is nothing in cache to serve instead.
+        """
+        entry = self.load(url)
+        if self.fresh(entry):
+            log.info("Serving %s from cache" % url)
+            return entry['body']
+
+        with self.lock(url):
+            entry = self.load(url)
+            if self.fresh(entry):  # refreshed by another pilot meanwhile
+                log.info("Serving %s from cache" % url)
+                return entry['body']
+            return self.refresh(url, entry, fetch, validate)
+
+    def refresh(self, url, entry, fetch, validate):
+        """
+        Queries the server, conditionally if there is an entry, and stores the answer. See get.
+
+        :param entry: cached entry, or None
+        :return str: document body, from the entry if the server fails.
+        """
+        headers = []
+        if entry is not None:
+            if entry.get('etag'):
+                headers.append("If-None-Match: " + entry['etag'])
+            headers.append("If-Modified-Since: " + (entry.get('last_modified') or
+                                                    formatdate(entry['fetched'], usegmt=True)))
+        try:
+            status, response_headers, body = fetch(url, headers)
+            if status == 304 and entry is not None:
+                log.info("%s is not modified" % url)
+                entry['fetched'] = time.time()
+                self.store(entry)
+                return entry['body']
+            if status != 200:
+                raise IOError("HTTP status %s" % status)
+            if validate is not None:
+                validate(body)
+        except Exception as e:
+            if entry is None:
+                raise
+            log.warning("Failed to refresh %s (%s), serving cached copy of %s" %
+                        (url, str(e), time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(entry['fetched']))))
+            return entry['body']
+
+        self.store({'url': url, 'body': body, 'fetched': time.time(), 'etag': response_headers.get('etag'),
+                    'last_modified': response_headers.get('last-modified')})
+        return body
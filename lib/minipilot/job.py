@@ -1,14 +1,18 @@
-import urllib
 import os
 import json
 import shlex
 import pipes
 import logging
 import copy
-from utility import Utility, touch
-
-# TODO: Switch from external Rucio calls to internal ones. (Should consult with Mario)
-# Before: fix platform dependencies in Rucio
+import time
+from multiprocessing.pool import ThreadPool
+from utility import Utility, LogStream, parallel_map, thread_context, inherit_context
+from process_loop import default_loop
+from mover import get_mover
+from cache import FileCache
+from checksum import verify_file
+from heartbeat import Heartbeat
+from async_log import AsyncHandler
 
 # TODO: Rework queuedata overriding. Current version is a complete garbage.
 
@@ -39,6 +43,20 @@ class LoggingContext(object):
             self.handler.setLevel(self.old_level)
 
 
+class JobLogFilter(logging.Filter):
+    """
+    Filter of job log handler. Lets through records from threads working for the job and from threads not working for
+    any job, so that concurrent jobs (eg. a prefetched one) do not write into each other's logs.
+    """
+    def __init__(self, job):
+        logging.Filter.__init__(self)
+        self.job = job
+
+    def filter(self, record):
+        owner = getattr(thread_context, 'owner', None)
+        return owner is None or owner is self.job
+
+
 class Job(Utility):
     """
     This class holds a job and helps with it.
@@ -69,6 +87,22 @@ class Job(Utility):
         log_formatter           Formatter used by log handlers.
                                 Acquired from ''pilot.jobmanager'' logger configuration.
                                 :Static:
+        log_async               Whether job log files are written asynchronously, see async_log.
+                                Acquired from ''pilot.jobmanager'' logger configuration: its handler is AsyncHandler.
+                                :Static:
+        payload_stdout          File for payload stdout in "files" output mode.
+        payload_stderr          File for payload stderr in "files" output mode.
+        payload_output_files    Files with payload output written by the last run, included into log archive.
+        mover                   Mover used for stage in and stage out.
+        cache                   Node-wide FileCache of input files, or None if caching is disabled.
+        stage_in_results        Dict of input file -> (exit code, stdout, stderr) of its transfer.
+        stage_out_results       Dict of output file -> (exit code, stdout, stderr) of its transfer.
+        start_time              Time the job started to prepare.
+        metrics                 Last resource usage sample of the payload, see heartbeat.Heartbeat.
+        work_dir                Directory, in which the job files are placed and the payload is run. Every relative
+                                file name of the job is relative to it.
+        queuedata               Copy of the pilot's queuedata with the job's --overwriteQueuedata modifications, so
+                                that they do not leak into other jobs.
     """
     pilot = None
     description = None
@@ -80,6 +114,18 @@ class Job(Utility):
     log_handler = None
     log_level = None
     log_formatter = None
+    log_async = False
+    payload_stdout = 'payload.stdout'
+    payload_stderr = 'payload.stderr'
+    payload_output_files = None
+    mover = None
+    cache = None
+    stage_in_results = None
+    stage_out_results = None
+    work_dir = None
+    start_time = None
+    metrics = None
+    queuedata = None
 
     __state = "sent"
     __description_aliases = {
@@ -87,21 +133,30 @@ class Job(Utility):
     }
     __acceptable_log_wrappers = ["tar", "tgz", "gz", "gzip", "tbz2", "bz2", "bzip2"]
 
-    def __init__(self, _pilot, _desc):
+    def __init__(self, _pilot, _desc, work_dir=None):
         """
         Initializer. Parses description.
         :param _pilot: Pilot class instance.
         :param _desc: Description object.
+        :param work_dir: job work directory, current directory by default.
         :return:
         """
         Utility.__init__(self)
+        thread_context.owner = self
         self.log = logging.getLogger('pilot.jobmanager')
         self.pilot = _pilot
+        self.work_dir = os.path.abspath(work_dir or os.getcwd())
+        self.queuedata = copy.deepcopy(_pilot.queuedata)
         if _pilot.args.no_job_update:
             self.no_update = True
+        if _pilot.args.process_loop:
+            self.process_loop = default_loop()
         self.description = _desc
         _pilot.logger.debug(json.dumps(self.description, indent=4, sort_keys=True))
         self.parse_description()
+        self.mover = get_mover(self)
+        if _pilot.args.cache_dir:
+            self.cache = FileCache(_pilot.args.cache_dir, _pilot.args.cache_size * 1024 * 1024)
 
     def __getattr__(self, item):
         """
@@ -137,6 +192,13 @@ class Job(Utility):
                 return
             object.__setattr__(self, key, value)
 
+    def path(self, f):
+        """
+        :param f: job file name
+        :return: path of the file in job work directory
+        """
+        return os.path.join(self.work_dir, f)
+
     def get_key_value_for_queuedata(self, parameter):
         m = parameter.split('=', 1)
         key = m[0]
@@ -194,7 +256,7 @@ class Job(Utility):
                 else:
                     key, value = self.get_key_value_for_queuedata(param)
                     self.log.debug("Overwriting queuedata parameter \"%s\" to %s" % (key, json.dumps(value)))
-                    self.pilot.queuedata[key] = value
+                    self.queuedata[key] = value
 
             if not overwriting:
                 if param == '--overwriteQueuedata':
@@ -226,14 +288,20 @@ class Job(Utility):
             log_file = log_basename
             log_archive = ''
 
-        h = logging.FileHandler(log_file, "w")
         if Job.log_level is None:
-            Job.log_formatter = self.log.handlers.pop().formatter
+            template = self.log.handlers.pop()
+            Job.log_formatter = template.formatter
+            Job.log_async = isinstance(template, AsyncHandler)
             lvl = self.log.getEffectiveLevel()
             Job.log_level = lvl
         else:
             lvl = Job.log_level
 
+        h = logging.FileHandler(self.path(log_file), "w")
+        if Job.log_async:
+            h = AsyncHandler(h)
+        h.addFilter(JobLogFilter(self))
+
         h.formatter = Job.log_formatter
 
         if lvl > logging.NOTSET:
@@ -253,6 +321,16 @@ class Job(Utility):
             self.pilot.print_initial_information()
             self.log.info("Using effective log level " + logging.getLevelName(lvl))
 
+    def close_logging(self):
+        """
+        Detaches and closes job log handler. Nothing is written to the job log after that.
+        """
+        if self.log_handler is not None:
+            root_log = logging.getLogger()
+            if self.log_handler in root_log.handlers:
+                root_log.removeHandler(self.log_handler)
+            self.log_handler.close()
+
     def parse_description(self):
         """
         Initializes description induced configurations: log handlers, queuedata modifications, etc.
@@ -267,9 +345,11 @@ class Job(Utility):
         """
         return self.__state
 
-    def send_state(self):
+    def send_state(self, durable=True):
         """
-        Sends job state to the dedicated panda server.
+        Queues job state for sending to the dedicated panda server by the pilot's StateReporter. Returns at once.
+
+        :param durable: whether the update is recorded in the state journal.
         """
         if not self.no_update:
             self.log.info("Updating server job status...")
@@ -279,18 +359,53 @@ class Job(Utility):
                 'jobId': self.id,
                 # 'pilotID': self.pilot_id,
                 'timestamp': self.pilot.time_iso8601(),
-                'workdir': os.getcwd()
+                'workdir': self.work_dir
             }
 
             if self.error_code is not None:
                 data["exeErrorCode"] = self.error_code
 
-            _str = self.pilot.curl_query("https://%s:%d/server/panda/updateJob" % (self.pilot.args.jobserver,
-                                                                                   self.pilot.args.jobserver_port),
-                                         ssl=True, body=urllib.urlencode(data))
-            self.log.debug("Got from server: " + _str)
-            # jobDesc = json.loads(_str)
-            # self.logger.info("Got from server: " % json.dumps(jobDesc, indent=4))
+            if self.metrics:
+                data.update({
+                    'cpuConsumptionTime': int(self.metrics['cpu_time']),
+                    'cpuConsumptionUnit': 's',
+                    'maxRSS': self.metrics['max_rss'],
+                    'maxPSS': self.metrics['max_pss'],
+                    'totRBYTES': self.metrics['read_bytes'],
+                    'totWBYTES': self.metrics['write_bytes'],
+                    'nProcesses': self.metrics['processes']
+                })
+
+            self.pilot.state_reporter.report(self, data, durable=durable)
+
+    def heartbeat(self, metrics):
+        """
+        Sends heartbeat: current state with fresh payload metrics. Heartbeats are not journaled.
+
+        :param metrics: payload metrics
+        """
+        self.metrics = metrics
+        self.send_state(durable=False)
+
+    def post_state(self, data):
+        """
+        Sends job state update to the dedicated panda server and waits for the answer. Called by StateReporter.
+
+        :param data: update, prepared by send_state.
+        """
+        _str = self.pilot.update_job(data)
+        self.log.debug("Got from server: " + _str)
+        # jobDesc = json.loads(_str)
+        # self.logger.info("Got from server: " % json.dumps(jobDesc, indent=4))
+
+    def wait_state(self):
+        """
+        Waits until the last state update is delivered to the server, up to state_timeout.
+        """
+        if not self.no_update:
+            timeout = self.pilot.args.state_timeout or None
+            if not self.pilot.state_reporter.flush(self, timeout):
+                self.log.error("State %s of job %s is not delivered in %d s." % (self.state, self.id, timeout))
 
     @state.setter
     def state(self, value):
@@ -304,7 +419,7 @@ class Job(Utility):
             self.__state = value
             self.send_state()
 
-    def prepare_log(self, include_files=None):
+    def prepare_log(self, include_files=None, before_log=lambda: None):
         """
         Prepares log file for stage out.
          May be called several times. The prime log file is not removed, so it will append new information (may be
@@ -312,14 +427,17 @@ class Job(Utility):
          Automatically detects tarball and zipping based on previously extracted log archive extension.
 
         :param include_files: array of files to be included if tarball is used to aggregate log.
+        :param before_log: function called right before the log file itself is archived, after include_files are, eg.
+                           to wait for transfers whose messages belong to the log.
         """
         with LoggingContext(self.log_handler, logging.NOTSET):
             import shutil
-            full_log_name = self.log_file + self.log_archive
+            log_file = self.path(self.log_file)
+            full_log_name = log_file + self.log_archive
 
             self.log.info("Preparing log file to send.")
 
-            if os.path.isfile(full_log_name) and self.log_file != full_log_name:
+            if os.path.isfile(full_log_name) and log_file != full_log_name:
                 os.remove(full_log_name)
 
             mode = "w"
@@ -339,80 +457,202 @@ class Job(Utility):
                 with tarfile.open(full_log_name, mode) as tar:
                     if include_files is not None:
                         for f in include_files:
-                            if os.path.exists(f):
+                            if os.path.exists(self.path(f)):
                                 self.log.info("Adding file %s" % f)
-                                tar.add(f)
+                                tar.add(self.path(f), f)
+                    before_log()
                     self.log.info("Adding log file... (must be end of log)")
-                    tar.add(self.log_file)
+                    self.log_handler.flush()
+                    tar.add(log_file, self.log_file)
 
                 self.log.info("Finalizing log file.")
                 tar.close()
 
             elif mode != "w":  # compressor
+                before_log()
                 self.log.info("Compressing log file... (must be end of log)")
-                with open(self.log_file, 'rb') as f_in, compressor(full_log_name, 'wb') as f_out:
+                self.log_handler.flush()
+                with open(log_file, 'rb') as f_in, compressor(full_log_name, 'wb') as f_out:
                     shutil.copyfileobj(f_in, f_out)
 
-            elif self.log_file != full_log_name:
+            elif log_file != full_log_name:
                 self.log.warn("Compression is not known, assuming no compression.")
+                before_log()
                 self.log.info("Copying log file... (must be end of log)")
+                self.log_handler.flush()
 
-                shutil.copyfile(self.log_file, full_log_name)
+                shutil.copyfile(log_file, full_log_name)
 
         self.log.info("Log file prepared for stageout.")
 
-    def rucio_info(self):
+    def batches(self, files, keys):
         """
-        Logs basic Rucio information (basically whoami response)
+        Splits files into batches, which can be transferred by one Rucio command: files in a batch share the values of
+        specified keys in their descriptions. Batch size is limited by transfer_batch.
+
+        :param files: input_files or output_files
+        :param keys: description keys, eg. ['scope']
+        :return: list of tuples of file names
         """
-        if self.pilot.args.simulate_rucio:
-            c, o, e = (0, "simulated", "")
-        else:
-            c, o, e = self.call(['rucio', 'whoami'])
-        self.log.info("Rucio whoami responce: \n" + o)
-        if e != '':
-            self.log.warn("Rucio returned error(s): \n" + e)
+        groups = {}
+        for f in sorted(files):
+            groups.setdefault(tuple(files[f][k] for k in keys), []).append(f)
+        size = max(1, self.pilot.args.transfer_batch)
+        return [tuple(group[i:i + size]) for group in groups.values() for i in range(0, len(group), size)]
+
+    def stage_in_batch(self, batch):
+        """
+        Downloads a batch of input files with the mover.
+
+        :param batch: tuple of file names
+        :return: dict file -> (exit code, stdout, stderr)
+        """
+        return self.mover.download(batch)
+
+    def download_inputs(self, files):
+        """
+        Downloads input files with the mover, running up to transfer_threads batched downloads at once.
+        Results are stored in stage_in_results.
+
+        :param files: list of file names
+        """
+        inputs = dict((f, self.input_files[f]) for f in files)
+        for results in parallel_map(self.stage_in_batch, self.batches(inputs, ['scope']),
+                                    self.pilot.args.transfer_threads).values():
+            self.stage_in_results.update(results)
+
+    def verify_input(self, f):
+        """
+        Checks size and checksum of staged in file against description.
+
+        :param f: file name
+        :return: None if file is fine, error message otherwise.
+        """
+        return verify_file(self.path(f), self.input_files[f]['checksum'], self.input_files[f]['size'])
+
+    def verify_inputs(self):
+        """
+        Verifies all staged in files on up to transfer_threads workers. Corrupted files are removed (from cache too)
+        and downloaded again, up to verify_retries times. Files still corrupted after that are marked as failed.
+        Files of a mover without real data (simulated one) are not verified.
+        """
+        if not self.mover.real_data:
+            return
+        files = [f for f, (c, o, e) in self.stage_in_results.items() if c == 0]
+        for attempt in range(self.pilot.args.verify_retries + 1):
+            errors = dict((f, error) for f, error in parallel_map(self.verify_input, files,
+                                                                  self.pilot.args.transfer_threads).items()
+                          if error is not None)
+            if not errors:
+                return
+            for f, error in errors.items():
+                self.log.warn("Verification of %s failed: %s" % (f, error))
+                if os.path.isfile(self.path(f)):
+                    os.remove(self.path(f))
+                if self.cache is not None:
+                    self.cache.discard(self.input_files[f]['scope'], f, self.input_files[f]['checksum'])
+                self.stage_in_results[f] = (1, "", error)
+
+            if attempt < self.pilot.args.verify_retries:
+                self.log.info("Downloading %d corrupted file(s) again." % len(errors))
+                self.download_inputs(list(errors))
+                files = [f for f in errors if self.stage_in_results[f][0] == 0]
 
     def stage_in(self):
         """
-        Stages in files using Rucio.
+        Stages in files with the mover, running up to transfer_threads batched downloads at once, and verifies them.
+        Files found in the node cache are taken from there, downloaded files are put there after verification.
         """
         self.state = 'stagein'
-        self.rucio_info()
-        for f in self.input_files:
-            if self.pilot.args.simulate_rucio:
-                touch(f)
-                self.log.info("Simulated downloading " + f + " from " + self.input_files[f]['scope'])
+        self.mover.info()
+        self.stage_in_results = {}
+        if self.cache is not None:
+            for f, d in self.input_files.items():
+                if self.cache.fetch(d['scope'], f, d['checksum'], self.path(f)):
+                    self.stage_in_results[f] = (0, "cache hit", "")
+
+        self.download_inputs([f for f in self.input_files if f not in self.stage_in_results])
+        self.verify_inputs()
+
+        for f, (c, o, e) in self.stage_in_results.items():
+            if c != 0:
+                self.log.warn("Failed to download %s (exit code %s):\n%s" % (f, c, e))
+            elif self.cache is not None and o != "cache hit":
+                self.cache.store(self.input_files[f]['scope'], f, self.input_files[f]['checksum'], self.path(f))
+
+    def stage_out_file(self, f):
+        """
+        Uploads one output file.
+
+        :param f: file name
+        :return: (exit code, stdout, stderr), exit code is None if there is no such file.
+        """
+        return self.stage_out_batch((f,))[f]
+
+    def stage_out_batch(self, batch):
+        """
+        Uploads a batch of output files with the mover. Missing files are reported and skipped.
+
+        :param batch: tuple of file names
+        :return: dict file -> (exit code, stdout, stderr), exit code is None if there is no such file.
+        """
+        results = {}
+        existing = []
+        for f in batch:
+            if os.path.isfile(self.path(f)):
+                existing.append(f)
             else:
-                c, o, e = self.call(['rucio', 'download', '--no-subdir', self.input_files[f]['scope'] + ":" + f])
+                self.log.warn("Can not upload " + f + ", file does not exist.")
+                results[f] = (None, "", "file does not exist")
+        if existing:
+            results.update(self.mover.upload(tuple(existing)))
+        return results
 
     def stage_out(self):
         """
-        Stages out files using Rucio.
+        Stages out files with the mover.
+        Output files are uploaded in batches by up to transfer_threads workers. Meanwhile, payload output files (in
+        'files' payload_output mode) are added to the log archive; the job log itself is archived once the uploads end,
+        so that their results are in it. The log is uploaded right after its archive is ready.
         """
         self.state = 'stageout'
-        self.rucio_info()
-        for f in self.output_files:
-            if os.path.isfile(f) and self.description['log_file'] != f:
-                if self.pilot.args.simulate_rucio:
-                    self.log.info("Simulated uploading " + f + " to scope " + self.output_files[f]['scope'] +
-                                  " and SE " + self.output_files[f]['storage_element'])
-                else:
-                    c, o, e = self.call(['rucio', 'upload', '--rse', self.output_files[f]['storage_element'], '--scope',
-                                         self.output_files[f]['scope'], f])
-            else:
-                self.log.warn("Can not upload " + f + ", file does not exist.")
-        self.prepare_log()
-        with self.description['log_file'] as f:
-            if os.path.isfile(f):
-                if self.pilot.args.simulate_rucio:
-                    self.log.info("Simulated uploading " + f + " to scope " + self.output_files[f]['scope'] +
-                                  " and SE " + self.output_files[f]['storage_element'])
-                else:
-                    c, o, e = self.call(['rucio', 'upload', '--rse', self.output_files[f]['storage_element'], '--scope',
-                                         self.output_files[f]['scope'], f])
-            else:
-                self.log.warn("Can not upload " + f + ", file does not exist.")
+        self.mover.info()
+        log_file = self.description['log_file']
+        files = dict((f, d) for f, d in self.output_files.items() if f != log_file)
+        batches = self.batches(files, ['scope', 'storage_element'])
+        self.stage_out_results = {}
+        reported = []
+
+        def uploaded():
+            if not reported:
+                reported.append(True)
+                for results in uploads.get():
+                    self.stage_out_results.update(results)
+                self.report_uploads(self.stage_out_results)
+
+        pool = ThreadPool(max(1, min(self.pilot.args.transfer_threads, len(batches))), inherit_context())
+        try:
+            uploads = pool.map_async(self.stage_out_batch, batches)
+            pool.close()
+            self.prepare_log(self.payload_output_files, uploaded)
+            uploaded()  # if the log needs no archive
+        finally:
+            pool.close()
+            pool.join()
+
+        log_result = self.stage_out_file(log_file)
+        self.stage_out_results[log_file] = log_result
+        self.report_uploads({log_file: log_result})
+
+    def report_uploads(self, results):
+        """
+        Logs failed uploads.
+
+        :param results: dict file -> (exit code, stdout, stderr)
+        """
+        for f, (c, o, e) in sorted(results.items()):
+            if c is not None and c != 0:
+                self.log.warn("Failed to upload %s (exit code %s):\n%s" % (f, c, e))
 
     def payload_run(self):
         """
@@ -423,26 +663,92 @@ class Job(Utility):
         args.insert(0, self.command)
 
         self.log.info("Starting job cmd: %s" % " ".join(pipes.quote(x) for x in args))
-
-        c, o, e = self.call(args)
-
-        self.log.info("Job ended with status: %s" % c)
-        self.log.info("Job stdout:\n%s" % o)
-        self.log.info("Job stderr:\n%s" % e)
+        heartbeat = Heartbeat(self, self.pilot.args.heartbeat_interval) if self.pilot.args.heartbeat_interval > 0 \
+            else None
+        try:
+            c = self.run_payload_command(args, heartbeat)
+        finally:
+            if heartbeat is not None:
+                heartbeat.stop()
+                self.metrics = heartbeat.metrics or None
         self.error_code = c
 
         self.state = "holding"
 
-    def run(self):
+    def run_payload_command(self, args, started=None):
         """
-        Main code of job manager.
+        Runs payload command according to payload_output mode.
 
-        Stages in, executes and stages out the job.
+        :param args: command line
+        :param started: function called with the payload process when it is started.
+        :return: payload exit code
         """
-        self.state = 'starting'
+        # Payload output is kept only in the job log in 'log' and 'stream' modes, so it passes the job log level.
+        level = max(logging.INFO, Job.log_level or logging.NOTSET)
+        if self.pilot.args.payload_output == 'stream':
+            c, o, e = self.call(args, stdout=LogStream(self.log, level, "Job stdout: "),
+                                stderr=LogStream(self.log, level, "Job stderr: "), cwd=self.work_dir,
+                                started=started)
+            self.log.info("Job ended with status: %s" % c)
+        elif self.pilot.args.payload_output == 'files':
+            with open(self.path(self.payload_stdout), 'wb') as out, open(self.path(self.payload_stderr), 'wb') as err:
+                c, o, e = self.call(args, stdout=out, stderr=err, cwd=self.work_dir, started=started)
+            self.payload_output_files = [self.payload_stdout, self.payload_stderr]
+            self.log.info("Job ended with status: %s" % c)
+            self.log.info("Job stdout and stderr are written to %s and %s" % tuple(self.payload_output_files))
+        else:
+            c, o, e = self.call(args, cwd=self.work_dir, started=started)
+
+            self.log.info("Job ended with status: %s" % c)
+            self.log.log(level, "Job stdout:\n%s" % o.decode('utf-8', 'replace'))
+            self.log.log(level, "Job stderr:\n%s" % e.decode('utf-8', 'replace'))
+        return c
 
+    def prepare(self):
+        """
+        First phase of the job: stage in. May run while another job is finished.
+        """
+        thread_context.owner = self
+        self.start_time = time.time()
+        self.state = 'starting'
         self.stage_in()
+
+    def execute(self):
+        """
+        Second phase of the job: payload run.
+        """
+        thread_context.owner = self
         self.payload_run()
-        self.stage_out()
+
+    def finish(self):
+        """
+        Last phase of the job: stage out. May run while the next job is prepared.
+        """
+        thread_context.owner = self
+        try:
+            self.stage_out()
+        finally:
+            self.mover.close()
 
         self.state = 'finished'
+
+    def close(self):
+        """
+        Waits for delivery of the last job state and releases job resources: mover session and job log. Nothing is
+        written to the job log after that.
+        """
+        self.wait_state()
+        self.mover.close()
+        if getattr(thread_context, 'owner', None) is self:
+            thread_context.owner = None
+        self.close_logging()
+
+    def run(self):
+        """
+        Main code of job manager.
+
+        Stages in, executes and stages out the job.
+        """
+        self.prepare()
+        self.execute()
+        self.finish()
@@ -0,0 +1,139 @@
+"""
+Durable journal of job state updates, which are not delivered to the job server yet.
+
+The journal is an append-only file of JSON lines. Every update is written (and fsync'ed) before it is queued for
+sending, and a delivery mark is appended after the server has got it:
+
+    {"key": "4242", "seq": 7, "data": {"state": "running", ...}}
+    {"key": "4242", "seq": 7, "delivered": true}
+
+Only the latest update of a job matters, so a delivery mark acknowledges all earlier updates of the job too. When
+nothing is pending, the file is truncated. A pilot started in the same directory replays the updates left undelivered
+by its predecessor, eg. after a crash or a server outage longer than its state_timeout.
+"""
+import os
+import json
+import logging
+import threading
+
+log = logging.getLogger("pilot.journal")
+
+
+class StateJournal(object):
+    """
+    Journal of pending job updates.
+
+    Attributes:
+        path                    Journal file.
+        pending                 Dict of job key -> (seq, data) of its latest undelivered update.
+        seq                     Sequence number of the last record.
+    """
+
+    def __init__(self, path):
+        """
+        Opens the journal and loads updates left undelivered in it.
+
+        :param path: journal file
+        """
+        self.path = path
+        self.pending = {}
+        self.seq = 0
+        self.lock = threading.Lock()
+        self.load()
+        self.compact()
+        self.file = open(self.path, 'a')
+
+    def load(self):
+        """
+        Reads pending updates from the journal file. A torn last line (eg. of a crash in the middle of a write) is
+        ignored.
+        """
+        if not os.path.isfile(self.path):
+            return
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    key, seq = record['key'], record['seq']
+                except (ValueError, KeyError, TypeError):
+                    log.warning("Skipping broken journal record: %s" % line.strip())
+                    continue
+                self.seq = max(self.seq, seq)
+                if record.get('delivered'):
+                    if key in self.pending and self.pending[key][0] <= seq:
+                        del self.pending[key]
+                elif key not in self.pending or self.pending[key][0] < seq:
+                    self.pending[key] = (seq, record['data'])
+        if self.pending:
+            log.info("Journal %s has %d undelivered update(s)." % (self.path, len(self.pending)))
+
+    def compact(self):
+        """
+        Rewrites the journal file with pending updates only. The new file replaces the old one atomically.
+        """
+        tmp = self.path + ".tmp"
+        with open(tmp, 'w') as f:
+            for key, (seq, data) in sorted(self.pending.items(), key=lambda item: item[1][0]):
+                f.write(json.dumps({'key': key, 'seq': seq, 'data': data}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp, self.path)
+
+    def write(self, record):
+        self.file.write(json.dumps(record) + "\n")
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def append(self, key, data):
+        """
+        Records update durably.
+
+        :param key: job key
+        :param data: update
+        :return: sequence number of the update
+        """
+        with self.lock:
+            self.seq += 1
+            self.pending[key] = (self.seq, data)
+            self.write({'key': key, 'seq': self.seq, 'data': data})
+            return self.seq
+
+    def delivered(self, key, seq):
+        """
+        Marks update and all earlier updates of the job as delivered. Truncates the journal if nothing is pending.
+
+        :param key: job key
+        :param seq: sequence number of the update
+        """
+        with self.lock:
+            if key in self.pending and self.pending[key][0] <= seq:
+                del self.pending[key]
+            if self.pending:
+                self.write({'key': key, 'seq': seq, 'delivered': True})
+            else:
+                self.file.truncate(0)
+                self.file.flush()
+                os.fsync(self.file.fileno())
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+class JournaledJob(object):
+    """
+    Stand-in for a job of a previous pilot run, used to deliver its updates replayed from the journal.
+
+    Attributes:
+        id                      Job key in the journal.
+        pilot                   Pilot instance sending the updates.
+        log                     Logger.
+    """
+
+    def __init__(self, pilot, key):
+        self.id = key
+        self.pilot = pilot
+        self.log = log
+
+    def post_state(self, data):
+        self.log.debug("Got from server: " + self.pilot.update_job(data))
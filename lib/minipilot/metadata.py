@@ -0,0 +1,80 @@
+"""
+Versions of installed distributions, read from their metadata files.
+
+pkg_resources builds its working set by scanning every distribution on sys.path when it is imported, which is one of
+the slowest imports of the pilot. Only a few versions are needed for the environment report, so the metadata of just
+these distributions is looked up: <name>-<version>.dist-info/METADATA, <name>-<version>-pyX.Y.egg-info (PKG-INFO in
+it, or the file itself) and <name>-<version>-pyX.Y.egg/EGG-INFO/PKG-INFO, in sys.path order.
+"""
+import os
+import re
+import sys
+
+METADATA_FILES = {
+    '.dist-info': ['METADATA'],
+    '.egg-info': ['PKG-INFO', ''],  # '': egg-info is the metadata file itself
+    '.egg': [os.path.join('EGG-INFO', 'PKG-INFO')]
+}
+
+
+def normalize(name):
+    """
+    :return: distribution name in canonical form (PEP 503), eg. "py-cpuinfo" for "Py_CPUInfo".
+    """
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+
+def requirement_names(text):
+    """
+    Parses requirements file.
+
+    :param text: contents of requirements.txt
+    :return: list of distribution names, in file order.
+    """
+    names = []
+    for line in text.splitlines():
+        match = re.match(r"\s*([A-Za-z0-9][A-Za-z0-9._-]*)", line.split("#", 1)[0])
+        if match:
+            names.append(match.group(1))
+    return names
+
+
+def read_version(path):
+    """
+    :param path: METADATA or PKG-INFO file
+    :return: value of its Version header, None if there is no such file or header.
+    """
+    try:
+        with open(path) as f:
+            for line in f:
+                if not line.strip():
+                    break  # end of headers
+                if line.startswith("Version:"):
+                    return line.split(":", 1)[1].strip()
+    except (IOError, OSError):
+        pass
+    return None
+
+
+def installed_version(name, paths=None):
+    """
+    :param name: distribution name
+    :param paths: directories to look in, sys.path by default.
+    :return: version of the first distribution of that name found, None if it is not installed.
+    """
+    wanted = normalize(name)
+    for directory in paths if paths is not None else sys.path:
+        try:
+            entries = sorted(os.listdir(directory or "."))
+        except OSError:
+            continue
+        for entry in entries:
+            base, ext = os.path.splitext(entry)
+            if ext not in METADATA_FILES or normalize(base.split("-", 1)[0]) != wanted:
+                continue
+            for meta in METADATA_FILES[ext]:
+                version = read_version(os.path.join(directory or ".", entry, meta) if meta else
+                                       os.path.join(directory or ".", entry))
+                if version is not None:
+                    return version
+    return None
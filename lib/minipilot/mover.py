@@ -0,0 +1,271 @@
+"""
+Movers transfer job input and output files between storage and the job directory.
+
+Every mover works with batches (tuples of file names, see Job.batches) and reports the result for each file in the same
+shape Utility.call returns: (exit code, stdout, stderr). Missing output files are handled by the job, movers only get
+existing ones. File names are relative to the job work directory (Job.work_dir), movers resolve them with Job.path.
+
+Available movers:
+    rucio           Rucio command line client, one process per batch.
+    rucio_api       Rucio client API in the pilot process. One client session for the whole job.
+    local           Locally mounted storage element (or any directory as a storage stand-in). Copies with sendfile(2).
+    simulate        Does nothing, only logs. Used with --simulate_rucio.
+
+The mover is chosen by --mover argument or, if it is not set, by "copytool" field of queuedata.
+"""
+import os
+import logging
+import threading
+from utility import touch, copy_file
+
+log = logging.getLogger("pilot.mover")
+
+
+class Mover(object):
+    """
+    Base mover. Subclasses implement download and upload, and optionally open, close and info.
+
+    Attributes:
+        job                     Job the mover works for.
+        log                     Job logger.
+        real_data               Whether transferred files carry real data, which can be verified.
+    """
+    real_data = True
+
+    def __init__(self, job):
+        self.job = job
+        self.log = job.log
+
+    def open(self):
+        """
+        Prepares mover session. Called before any transfer, may be called several times.
+        """
+        pass
+
+    def close(self):
+        """
+        Releases mover session.
+        """
+        pass
+
+    def info(self):
+        """
+        Logs basic mover information.
+        """
+        pass
+
+    def download(self, batch):
+        """
+        Downloads input files into job work directory.
+
+        :param batch: tuple of input file names
+        :return: dict file -> (exit code, stdout, stderr)
+        """
+        raise NotImplementedError
+
+    def upload(self, batch):
+        """
+        Uploads output files from job work directory.
+
+        :param batch: tuple of output file names
+        :return: dict file -> (exit code, stdout, stderr)
+        """
+        raise NotImplementedError
+
+
+class SimulatedMover(Mover):
+    """
+    Mover touching empty files instead of downloads.
+    """
+    real_data = False
+
+    def info(self):
+        self.log.info("Rucio whoami responce: \nsimulated")
+
+    def download(self, batch):
+        for f in batch:
+            touch(self.job.path(f))
+            self.log.info("Simulated downloading " + f + " from " + self.job.input_files[f]['scope'])
+        return dict((f, (0, "simulated", "")) for f in batch)
+
+    def upload(self, batch):
+        for f in batch:
+            self.log.info("Simulated uploading " + f + " to scope " + self.job.output_files[f]['scope'] +
+                          " and SE " + self.job.output_files[f]['storage_element'])
+        return dict((f, (0, "simulated", "")) for f in batch)
+
+
+class RucioCLIMover(Mover):
+    """
+    Mover calling rucio command line client, one call per batch.
+    """
+
+    def info(self):
+        c, o, e = self.job.call(['rucio', 'whoami'])
+        self.log.info("Rucio whoami responce: \n" + o)
+        if e != '':
+            self.log.warn("Rucio returned error(s): \n" + e)
+
+    def download(self, batch):
+        """
+        A file is considered downloaded if Rucio succeeded or if the file is in place despite a partial failure.
+        """
+        c, o, e = self.job.call(['rucio', 'download', '--no-subdir'] +
+                                [self.job.input_files[f]['scope'] + ":" + f for f in batch], cwd=self.job.work_dir)
+        return dict((f, (0 if c == 0 or os.path.isfile(self.job.path(f)) else c, o, e)) for f in batch)
+
+    def upload(self, batch):
+        """
+        If a batch upload fails, Rucio does not tell which files are uploaded, so the files are retried one by one.
+        """
+        description = self.job.output_files[batch[0]]
+        c, o, e = self.job.call(['rucio', 'upload', '--rse', description['storage_element'], '--scope',
+                                 description['scope']] + list(batch), cwd=self.job.work_dir)
+        if c == 0 or len(batch) == 1:
+            return dict((f, (c, o, e)) for f in batch)
+
+        self.log.warn("Batch upload failed (exit code %s), uploading files one by one." % c)
+        results = {}
+        for f in batch:
+            results.update(self.upload((f,)))
+        return results
+
+
+class RucioAPIMover(Mover):
+    """
+    Mover using Rucio client API in the pilot process. The client and its authentication token are created once and
+    reused for every transfer of the job.
+    """
+    client = None
+    download_client = None
+    upload_client = None
+
+    def __init__(self, job):
+        Mover.__init__(self, job)
+        self.lock = threading.Lock()
+
+    def open(self):
+        with self.lock:
+            if self.client is None:
+                from rucio.client import Client
+                from rucio.client.downloadclient import DownloadClient
+                from rucio.client.uploadclient import UploadClient
+
+                self.client = Client()
+                self.download_client = DownloadClient(client=self.client)
+                self.upload_client = UploadClient(_client=self.client)
+
+    def close(self):
+        self.client = None
+        self.download_client = None
+        self.upload_client = None
+
+    def info(self):
+        self.open()
+        self.log.info("Rucio whoami responce: \n" + str(self.client.whoami()))
+
+    def transfer(self, fn, items):
+        """
+        Runs transfer function for each item, converting exceptions to failures.
+
+        :param fn: transfer function, takes list of items
+        :param items: dict file -> item
+        :return: dict file -> (exit code, stdout, stderr)
+        """
+        results = {}
+        for f, item in items.items():
+            try:
+                results[f] = (0, str(fn([item])), "")
+            except Exception as e:
+                results[f] = (1, "", "%s: %s" % (type(e).__name__, str(e)))
+        return results
+
+    def download(self, batch):
+        self.open()
+        return self.transfer(self.download_client.download_dids,
+                             dict((f, {'did': self.job.input_files[f]['scope'] + ":" + f,
+                                       'base_dir': self.job.work_dir,
+                                       'no_subdir': True}) for f in batch))
+
+    def upload(self, batch):
+        self.open()
+        return self.transfer(self.upload_client.upload,
+                             dict((f, {'path': self.job.path(f),
+                                       'rse': self.job.output_files[f]['storage_element'],
+                                       'did_scope': self.job.output_files[f]['scope']}) for f in batch))
+
+
+class LocalMover(Mover):
+    """
+    Mover for storage mounted locally, or any local directory used as a storage stand-in.
+    Files are stored as <storage>/<scope>/<name> and copied by the kernel without passing through the pilot.
+
+    Attributes:
+        storage                 Storage directory.
+    """
+
+    def __init__(self, job, storage):
+        Mover.__init__(self, job)
+        self.storage = storage
+
+    def info(self):
+        self.log.info("Using local storage " + self.storage)
+
+    def copy(self, src, dst):
+        """
+        Copies one file.
+
+        :return: (exit code, stdout, stderr)
+        """
+        try:
+            copy_file(src, dst)
+        except (IOError, OSError) as e:
+            return 1, "", str(e)
+        return 0, "", ""
+
+    def download(self, batch):
+        return dict((f, self.copy(os.path.join(self.storage, self.job.input_files[f]['scope'], f), self.job.path(f)))
+                    for f in batch)
+
+    def upload(self, batch):
+        results = {}
+        for f in batch:
+            directory = os.path.join(self.storage, self.job.output_files[f]['scope'])
+            if not os.path.isdir(directory):
+                try:
+                    os.makedirs(directory)
+                except OSError:
+                    pass  # created concurrently
+            results[f] = self.copy(self.job.path(f), os.path.join(directory, os.path.basename(f)))
+        return results
+
+
+movers = {
+    'rucio': RucioCLIMover,
+    'rucio_api': RucioAPIMover,
+    'local': LocalMover,
+}
+
+
+def get_mover(job):
+    """
+    Creates mover, chosen by pilot arguments or queuedata.
+    For the local mover, storage path is taken from --local_storage or "local_storage" field of queuedata.
+
+    :param job: Job instance
+    :return Mover: mover
+    """
+    args = job.pilot.args
+    queuedata = job.queuedata or {}
+    if args.simulate_rucio:
+        return SimulatedMover(job)
+
+    name = args.mover or queuedata.get('copytool') or 'rucio'
+    if name not in movers:
+        log.warning("Unknown mover %s, using rucio." % name)
+        name = 'rucio'
+    log.info("Using mover " + name)
+
+    if name == 'local':
+        return LocalMover(job, args.local_storage or queuedata.get('local_storage') or 'storage')
+    return movers[name](job)
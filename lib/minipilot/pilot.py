@@ -1,24 +1,33 @@
 #!/usr/bin/python -u
 
 import sys
+import profiler
+
+if __name__ == "__main__":  # the pilot itself, not a tool or a test importing this module
+    profiler.enable(sys.argv)  # before the other imports, to time them
+
+# Heavy dependencies (pycurl, psutil, cpuinfo) and modules importing them are imported at first use,
+# so that --help or a run from local files does not pay for them.
 import os
 import logging
 import logging.config
 import logging.handlers
 import argparse
-import pycurl
-from StringIO import StringIO
 import json
-import cpuinfo
 import urllib
-import psutil
 import socket
 import platform
-import pip
 import time
 import traceback
 import pipes
-from job_description_fixer import description_fixer
+import tempfile
+import threading
+from journal import StateJournal, JournaledJob
+from async_log import AsyncHandler, AsyncFileHandler, AsyncStreamHandler
+from http_cache import HTTPCache
+from hardware import HardwareCache, probe_dynamic
+from startup import Startup
+from metadata import requirement_names, installed_version
 
 logging.basicConfig()
 log = logging.getLogger()
@@ -38,6 +47,11 @@ except AttributeError:
     logging.NullHandler = NullHandler
     pass
 
+# Asynchronous handlers for loggers.ini, see async_log.
+logging.handlers.AsyncHandler = AsyncHandler
+logging.handlers.AsyncFileHandler = AsyncFileHandler
+logging.handlers.AsyncStreamHandler = AsyncStreamHandler
+
 
 class Pilot:
     """
@@ -54,6 +68,18 @@ class Pilot:
     argv = None
     executable = __file__
     queuedata = None
+    jobs_got = 0
+    startup = None
+    startup_timeouts = {
+        'dns': 10,
+        'hardware': 30,
+        'requirements': 30,
+        'queuedata': 180
+    }
+    _curl_engine = None
+    _state_reporter = None
+    _lazy_lock = threading.Lock()
+    _environment_report = None
 
     def __init__(self):
         """
@@ -102,6 +128,20 @@ class Pilot:
                                     type=lambda x: x if os.path.isfile(x) else testqueuedata,
                                     help="Preset queuedata file.",
                                     metavar="path/to/queuedata.json")
+        self.argParser.add_argument("--queuedata_cache", default=os.path.join(tempfile.gettempdir(),
+                                                                              "minipilot-queuedata"),
+                                    help="Queuedata cache directory, shared by pilots of the node. Empty to disable.",
+                                    metavar="path/to/cache")
+        self.argParser.add_argument("--queuedata_ttl", default=600,
+                                    type=int,
+                                    help="Seconds queuedata is used from cache without asking the server. Expired"
+                                         " queuedata is refreshed, or used as is if the server is unavailable.",
+                                    metavar="SECONDS")
+        self.argParser.add_argument("--hardware_cache", default=os.path.join(tempfile.gettempdir(),
+                                                                             "minipilot-hardware.json"),
+                                    help="File caching static node hardware facts until reboot, shared by pilots of"
+                                         " the node. Empty to disable.",
+                                    metavar="path/to/cache.json")
         self.argParser.add_argument("--queue", default='',
                                     help="Queue name",
                                     metavar="QUEUE_NAME")
@@ -116,6 +156,84 @@ class Pilot:
                                     help="Disable job server updates")
         self.argParser.add_argument("--simulate_rucio", action='store_true',
                                     help="Disable rucio, just simulate")
+        self.argParser.add_argument("--mover", default=None, choices=['rucio', 'rucio_api', 'local'],
+                                    help="File transfer tool: rucio command line client, rucio client API in the pilot"
+                                         " process or a locally mounted storage (see --local_storage). Default is"
+                                         " copytool from queuedata, or rucio")
+        self.argParser.add_argument("--local_storage", default=None,
+                                    help="Storage directory for the local mover. Default is local_storage from"
+                                         " queuedata.",
+                                    metavar="path/to/storage")
+        self.argParser.add_argument("--transfer_threads", default=4,
+                                    type=int,
+                                    help="Maximum number of parallel file transfers.",
+                                    metavar="N")
+        self.argParser.add_argument("--transfer_batch", default=20,
+                                    type=int,
+                                    help="Maximum number of files transferred by one Rucio command.",
+                                    metavar="N")
+        self.argParser.add_argument("--verify_retries", default=1,
+                                    type=int,
+                                    help="How many times to download again input files with wrong size or checksum.",
+                                    metavar="N")
+        self.argParser.add_argument("--cache_dir", default=None,
+                                    help="Node-wide input file cache directory. Caching is disabled if not set.",
+                                    metavar="path/to/cache")
+        self.argParser.add_argument("--cache_size", default=20480,
+                                    type=int,
+                                    help="Input file cache size limit, MB.",
+                                    metavar="MB")
+        self.argParser.add_argument("--process_loop", action='store_true',
+                                    help="Run job's external commands in one shared process loop instead of a pair"
+                                         " of collector threads per command")
+        self.argParser.add_argument("--payload_output", default='log', choices=['log', 'stream', 'files'],
+                                    help="How to treat payload stdout and stderr: log them at once after the payload"
+                                         " ends, stream them into the log line by line while it runs, or write them"
+                                         " directly to files, which are added to the log archive")
+        self.argParser.add_argument("--state_timeout", default=300,
+                                    type=int,
+                                    help="How long a job waits for delivery of its final state to the job server,"
+                                         " seconds. Failed updates are retried with backoff. Undelivered updates stay"
+                                         " in the state journal for the next pilot. 0 means no limit.",
+                                    metavar="SECONDS")
+        self.argParser.add_argument("--state_journal", default="state_updates.journal",
+                                    help="Journal of job state updates not delivered to the job server yet. Updates"
+                                         " left in it by a previous pilot are delivered on start. Empty to disable.",
+                                    metavar="path/to/journal")
+        self.argParser.add_argument("--heartbeat_interval", default=1800,
+                                    type=int,
+                                    help="Seconds between heartbeats with payload resource usage sent to the job"
+                                         " server while the payload runs. 0 disables heartbeats.",
+                                    metavar="SECONDS")
+        self.argParser.add_argument("--max_jobs", default=1,
+                                    type=int,
+                                    help="Maximum number of jobs to run one after another. With more than one job,"
+                                         " each job runs in its own subdirectory and the next job is fetched and"
+                                         " staged in while the previous one is staged out. 0 means no limit.",
+                                    metavar="N")
+        self.argParser.add_argument("--wall_time", default=0,
+                                    type=int,
+                                    help="Pilot wall time limit, seconds. No new job is started if the longest job so"
+                                         " far would not fit into the remaining time. 0 means no limit.",
+                                    metavar="SECONDS")
+        self.argParser.add_argument("--concurrent_jobs", default=1,
+                                    type=int,
+                                    help="Maximum number of jobs running at once. Jobs are packed onto the node by"
+                                         " their cores_number and minimum_ram. 0 means as many as fit.",
+                                    metavar="N")
+        self.argParser.add_argument("--node_cores", default=None,
+                                    type=int,
+                                    help="Number of cores for concurrent jobs. Default is all cores of the node.",
+                                    metavar="N")
+        self.argParser.add_argument("--node_memory", default=None,
+                                    type=int,
+                                    help="Memory for concurrent jobs, MB. Default is all memory of the node.",
+                                    metavar="MB")
+        self.argParser.add_argument("--startup_profile", "--startup-profile", default=None, nargs='?',
+                                    const="startup_profile.json",
+                                    help="Log how long each import and initialization phase takes, and save the"
+                                         " profile as JSON (default startup_profile.json).",
+                                    metavar="path/to/profile.json")
         self.argParser.add_argument("--jfk", action='store_true',
                                     help="Kills John F. Kennedy if he is alive.")
 
@@ -124,11 +242,35 @@ class Pilot:
                            (sys.version.split(" ")[0],
                             platform.system(), platform.machine())
 
-        self.node_name = socket.gethostbyaddr(socket.gethostname())[0]
-        if "_CONDOR_SLOT" in os.environ:
-            self.node_name = os.environ.get("_CONDOR_SLOT", '')+"@"+self.node_name
+        self.startup = Startup()
+        self.startup.start('dns', self.resolve_node_name, self.startup_timeouts['dns'])
 
-        self.pilot_id = self.node_name + (":%d" % os.getpid())
+    @property
+    def curl_engine(self):
+        """
+        :return CurlEngine: engine running the pilot's queries, created with its CurlPool on first use. An engine
+                            stopped by an error is replaced, its queries have failed with that error.
+        """
+        with self._lazy_lock:
+            if self._curl_engine is None:
+                from curl_pool import CurlPool
+                from curl_engine import CurlEngine
+                self._curl_engine = CurlEngine(CurlPool(self.create_curl))
+            elif self._curl_engine.error is not None:
+                from curl_engine import CurlEngine
+                self._curl_engine = CurlEngine(self._curl_engine.pool)
+        return self._curl_engine
+
+    @property
+    def state_reporter(self):
+        """
+        :return StateReporter: reporter of job states, created on first use.
+        """
+        with self._lazy_lock:
+            if self._state_reporter is None:
+                from reporter import StateReporter
+                self._state_reporter = StateReporter()
+        return self._state_reporter
 
     def init_after_arguments(self):
         """
@@ -147,32 +289,96 @@ class Pilot:
         self.logger = logging.getLogger("pilot")
         log = self.logger
 
-    def print_initial_information(self):
+    @staticmethod
+    def resolve_node_name():
         """
-        Pilot is initialized somehow, this initialization needs to be print out for information.
-        :return:
+        :return: fully qualified host name.
+        """
+        return socket.gethostbyaddr(socket.gethostname())[0]
+
+    @property
+    def node_name(self):
+        """
+        :return: node name, prefixed with Condor slot if there is one. Plain host name if it can not be resolved.
         """
+        name = self.startup.run('dns', self.resolve_node_name, self.startup_timeouts['dns'],
+                                default=socket.gethostname())
+        if "_CONDOR_SLOT" in os.environ:
+            name = os.environ.get("_CONDOR_SLOT", '')+"@"+name
+        return name
+
+    @property
+    def pilot_id(self):
+        return self.node_name + (":%d" % os.getpid())
+
+    def probe_hardware(self):
+        """
+        :return: dict of static node facts: CPU frequency (MHz), model and memory (MB), cached per boot in
+                 hardware_cache, see hardware module.
+        """
+        return HardwareCache(self.args.hardware_cache or None).static()
+
+    def scan_requirements(self):
+        """
+        :return: list of (name, installed version) of pilot requirements.
+        """
+        with open(os.path.join(self.dir, "requirements.txt")) as f:
+            names = requirement_names(f.read())
+        return [(name, installed_version(name)) for name in names]
+
+    def start_probes(self):
+        """
+        Starts startup probes in background, see startup module.
+        """
+        self.startup.start('requirements', self.scan_requirements, self.startup_timeouts['requirements'])
+        if not self.args.job_description:  # a local job description needs no hardware facts
+            self.startup.start('hardware', self.probe_hardware, self.startup_timeouts['hardware'])
+        self.startup.start('queuedata', self.get_queuedata, self.startup_timeouts['queuedata'])
+
+    def environment_report(self):
+        """
+        Describes the pilot and its environment. It is computed once, at the first call after arguments are parsed,
+        and re-emitted into every job log.
+
+        :return: list of (log level, message).
+        """
+        if self._environment_report is not None:
+            return self._environment_report
+
+        report = []
         if self.args is not None:
-            log.info("Pilot is running.")
-            log.info("Started with: %s" % " ".join(pipes.quote(x) for x in self.argv))
-        log.info("User-Agent: " + self.user_agent)
-        log.info("Node name: " + self.node_name)
-        log.info("Pilot ID: " + self.pilot_id)
+            report.append((logging.INFO, "Pilot is running."))
+            report.append((logging.INFO, "Started with: %s" % " ".join(pipes.quote(x) for x in self.argv)))
+        report.append((logging.INFO, "User-Agent: " + self.user_agent))
+        report.append((logging.INFO, "Node name: " + self.node_name))
+        report.append((logging.INFO, "Pilot ID: " + self.pilot_id))
+
+        report.append((logging.INFO, "Pilot is started from %s" % self.dir))
+        report.append((logging.INFO, "Current working directory is %s" % os.getcwd()))
+
+        report.append((logging.INFO, "Printing requirements versions..."))
+        requirements = self.startup.run('requirements', self.scan_requirements, self.startup_timeouts['requirements'],
+                                        default=None)
+        if requirements is not None:
+            for name, version in requirements:
+                report.append((logging.INFO, "%s (%s)" % (name, version)))
+        else:
+            report.append((logging.WARNING, "Failed to look up requirements versions. Have you set up your environment"
+                                            " properly? Skipping module info test..."))
+            report.append((logging.WARNING, "Pilot may crash at any time, be aware. And I can't provide you with module"
+                                            " information, probably the crash is caused by some outdated module."))
 
-        log.info("Pilot is started from %s" % self.dir)
-        log.info("Current working directory is %s" % os.getcwd())
+        if self.args is not None:
+            self._environment_report = report
+        return report
 
-        log.info("Printing requirements versions...")
-        try:
-            requirements = pip.req.parse_requirements(os.path.join(self.dir,
-                                                                   "requirements.txt"),
-                                                      session=False)
-            for req in requirements:
-                log.info("%s (%s)" % (req.name, req.installed_version))
-        except TypeError:
-            log.warn("Outdated version of PIP? Have you set up your environment properly? Skipping module info test...")
-            log.warn("Pilot may crash at any time, be aware. And I can't provide you with module information, probably"
-                     " the crash is caused by some outdated module.")
+    def print_initial_information(self):
+        """
+        Pilot is initialized somehow, this initialization needs to be print out for information.
+        :return:
+        """
+        for level, message in self.environment_report():
+            log.log(level, message)
 
     def run(self, argv):
         """
@@ -182,23 +388,210 @@ class Pilot:
         """
         self.executable = argv[0]
         self.argv = argv
-        self.args = self.argParser.parse_args(argv[1:])
-        self.init_after_arguments()
+        with profiler.phase("arguments"):
+            self.args = self.argParser.parse_args(argv[1:])
+        with profiler.phase("init_after_arguments"):
+            self.init_after_arguments()
+        self.start_probes()
 
         log.info("This pilot version is developed only for testing purposes, do not use it in production."
                  " You were warned.")
 
-        self.print_initial_information()
+        with profiler.phase("print_initial_information"):
+            self.print_initial_information()
 
         # noinspection PyBroadException
         try:
-            self.get_queuedata()
-            job = self.get_job()
-            job.run()
+            with profiler.phase("open_journal"):
+                self.open_journal()
+            with profiler.phase("queuedata"):
+                self.startup.result('queuedata')
+            self.startup.report()
+            if profiler.active is not None:
+                profiler.active.report(self.args.startup_profile, self.startup.timings())
+            if self.args.concurrent_jobs != 1:
+                self.run_slots()
+            else:
+                self.run_jobs()
         except:
             log.error("During the run encountered uncaught exception.")
             log.error(traceback.format_exc())
             pass
+        finally:
+            if self._state_reporter is not None:
+                self._state_reporter.stop(self.args.state_timeout or None)
+                if self._state_reporter.journal is not None:
+                    self._state_reporter.journal.close()
+            if self._curl_engine is not None:
+                self._curl_engine.stop()
+                if self._curl_engine.is_alive():
+                    self._curl_engine.join()
+                self._curl_engine.pool.close()
+
+    def open_journal(self):
+        """
+        Opens state update journal, if job updates are enabled, and replays updates left undelivered in it.
+        """
+        if self.args.no_job_update or not self.args.state_journal:
+            return
+        journal = StateJournal(self.args.state_journal)
+        self.state_reporter.journal = journal
+        for key, (seq, data) in journal.pending.items():
+            log.info("Replaying undelivered update of job %s: %s" % (key, data.get('state')))
+            self.state_reporter.report(JournaledJob(self, key), data, seq)
+
+    @property
+    def multi_job(self):
+        """
+        :return: whether pilot may run more than one job.
+        """
+        return self.args.max_jobs != 1 or self.args.wall_time > 0 or self.args.concurrent_jobs != 1
+
+    def may_start_job(self, jobs_started, start_time, longest_job):
+        """
+        :param jobs_started: number of jobs started so far
+        :param start_time: pilot start time
+        :param longest_job: duration of the longest job so far, seconds
+        :return: whether there is a room for one more job in the job and wall time limits.
+        """
+        if 0 < self.args.max_jobs <= jobs_started:
+            return False
+        if self.args.wall_time > 0 and time.time() + longest_job > start_time + self.args.wall_time:
+            log.info("Not enough wall time left for another job.")
+            return False
+        return True
+
+    def prepare_job(self):
+        """
+        Gets a job and stages it in. Exceptions are logged.
+
+        :return: (job, whether it is prepared), job is None if none was got.
+        """
+        # noinspection PyBroadException
+        try:
+            job = self.get_job()
+        except Exception:
+            log.error("Failed to get a job.")
+            log.error(traceback.format_exc())
+            return None, False
+
+        # noinspection PyBroadException
+        try:
+            job.prepare()
+        except Exception:
+            job.log.error("Job %s failed to prepare." % job.id)
+            job.log.error(traceback.format_exc())
+            job.close()
+            return job, False
+        return job, True
+
+    def run_jobs(self):
+        """
+        Runs jobs one after another, up to max_jobs and within wall_time. While a job is staged out, the next one is
+        fetched and staged in by a prefetch thread, so that the node does not idle between jobs.
+        Failure of a job is logged and does not stop the loop.
+        """
+        start_time = time.time()
+        longest_job = 0
+        jobs_started = 1
+        job, prepared = self.prepare_job()
+
+        while job is not None:
+            job_start = job.start_time or time.time()
+            # noinspection PyBroadException
+            try:
+                if prepared:
+                    job.execute()
+            except Exception:
+                job.log.error("Job %s failed to run." % job.id)
+                job.log.error(traceback.format_exc())
+                prepared = False
+
+            prefetch = None
+            prefetched = []
+            if self.may_start_job(jobs_started, start_time, max(longest_job, time.time() - job_start)):
+                jobs_started += 1
+                prefetch = threading.Thread(target=lambda: prefetched.extend(self.prepare_job()), name="prefetch")
+                prefetch.daemon = True
+                prefetch.start()
+
+            # noinspection PyBroadException
+            try:
+                if prepared:
+                    job.finish()
+            except Exception:
+                job.log.error("Job %s failed to finish." % job.id)
+                job.log.error(traceback.format_exc())
+            finally:
+                job.close()
+            longest_job = max(longest_job, time.time() - job_start)
+
+            job, prepared = None, False
+            if prefetch is not None:
+                prefetch.join()
+                job, prepared = prefetched
+
+    def run_slot_job(self, job, slots, request, durations):
+        """
+        Runs one job of run_slots and gives its resources back.
+
+        :param job: Job instance
+        :param slots: Slots of the node
+        :param request: (cores, memory) taken by the job
+        :param durations: list to append the job duration to
+        """
+        # noinspection PyBroadException
+        try:
+            job.run()
+        except Exception:
+            job.log.error("Job %s failed." % job.id)
+            job.log.error(traceback.format_exc())
+        finally:
+            job.close()
+            durations.append(time.time() - (job.start_time or time.time()))
+            slots.release(*request)
+
+    def run_slots(self):
+        """
+        Runs jobs concurrently, up to max_jobs and within wall_time. Every job runs in its own thread and work
+        directory and takes cores and memory it requires from node Slots. The next job is fetched only when at least
+        one core and a job slot are free, so that a dispatched job does not sit waiting for running ones; a job
+        requiring more than is free still waits until running jobs free enough resources for it.
+        Failure of a job is logged and does not stop the loop.
+        """
+        from utility import thread_context
+        from slots import Slots
+        slots = Slots(self.args.node_cores, self.args.node_memory, self.args.concurrent_jobs)
+        log.info("Running concurrent jobs on %d cores and %d MB." % (slots.cores, slots.memory))
+        start_time = time.time()
+        durations = []
+        jobs_started = 0
+
+        while True:
+            slots.wait_free()
+            if not self.may_start_job(jobs_started, start_time, max(durations or [0])):
+                break
+            # noinspection PyBroadException
+            try:
+                job = self.get_job()
+            except Exception:
+                log.error("Failed to get a job.")
+                log.error(traceback.format_exc())
+                break
+            thread_context.owner = None
+
+            request = slots.request(job)
+            if not slots.fits(*request):
+                log.info("Job %s waits for %d cores and %d MB to be freed." % ((job.id,) + request))
+            slots.acquire(*request)
+            jobs_started += 1
+            log.info("Starting job %s on %d cores and %d MB." % ((job.id,) + request))
+            thread = threading.Thread(target=self.run_slot_job, args=(job, slots, request, durations),
+                                      name="job_%s" % job.id)
+            thread.daemon = True
+            thread.start()
+
+        slots.wait_idle()
 
     @staticmethod
     def time_iso8601(t=time.localtime(), timezone=time.timezone):
@@ -220,6 +613,7 @@ class Pilot:
     def curl_query(self, url, body=None, **kwargs):
         """
         Send query to server using cURL library. For simpleness does not test anything.
+        The query runs in the pilot's CurlEngine, concurrently with queries of other threads.
 
         :param url: URL of the resource
         :param body: string to be sent, if any.
@@ -227,33 +621,60 @@ class Pilot:
 
         :return str: server response.
         """
-        buf = StringIO()
-        c = self.create_curl(**kwargs)
-        c.setopt(c.URL, url)
-        c.setopt(c.WRITEFUNCTION, buf.write)
-        if body is not None:
-            c.setopt(c.POSTFIELDS, body)
-        c.perform()
-        c.close()
-        _str = str(buf.getvalue())
-        buf.close()
-        return _str
+        return str(self.curl_submit(url, body, **kwargs).result())
+
+    def fetch_document(self, url, headers):
+        """
+        Gets document from server, for HTTPCache.
+
+        :param url: URL of the document
+        :param headers: additional request headers
+        :return: (HTTP status, dict of lower case response headers, body)
+        """
+        handle = self.curl_submit(url, headers=headers)
+        body = str(handle.result())
+        return handle.status, handle.headers, body
+
+    def update_job(self, data):
+        """
+        Sends job update to the job server and waits for the answer.
+
+        :param data: update fields
+        :return str: server response.
+        """
+        return self.curl_query("https://%s:%d/server/panda/updateJob" % (self.args.jobserver, self.args.jobserver_port),
+                               ssl=True, body=urllib.urlencode(data))
+
+    def curl_submit(self, url, body=None, headers=None, **kwargs):
+        """
+        Starts query to server without waiting for it. Handles are taken from the pilot's CurlPool, so connections and
+        TLS sessions are reused between queries.
+
+        :param url: URL of the resource
+        :param body: string to be sent, if any.
+        :param headers: additional request headers, if any.
+        ... params to be passed to create_curl
+
+        :return RequestHandle: future-like handle of the query, see curl_engine.
+        """
+        return self.curl_engine.submit(url, body, headers, **kwargs)
 
     def create_curl(self, ssl=False):
         """
         Creates cURL interface instance with required options and headers.
         :param Boolean(ssl): whether to set up SSL params or not. Default False.
 
-        :return pycurl.Curl: cURL interface class
+        :return pycurl.Curl: cURL interface class, its headers attribute holds the default request headers.
         """
+        import pycurl
         c = pycurl.Curl()
         if self.sslCertOrPath != "":
             c.setopt(c.CAPATH, self.sslCertOrPath)
         c.setopt(c.CONNECTTIMEOUT, 20)
         c.setopt(c.TIMEOUT, 120)
-        c.setopt(c.HTTPHEADER, ['Accept: application/json;q=0.9,'
-                                'text/html,application/xhtml+xml,application/xml;q=0.7,*/*;q=0.5',
-                                'User-Agent: ' + self.user_agent])
+        c.headers = ['Accept: application/json;q=0.9,text/html,application/xhtml+xml,application/xml;q=0.7,*/*;q=0.5',
+                     'User-Agent: ' + self.user_agent]
+        c.setopt(c.HTTPHEADER, c.headers)
         if ssl:
             if self.sslCert != "":
                 c.setopt(c.SSLCERT, self.sslCert)
@@ -299,8 +720,13 @@ class Pilot:
             #                                                                        self.args.pandaserver_port,
             #                                                                        self.args.queue))
 
-            _str = self.curl_query("http://atlas-agis-api.cern.ch/request/pandaqueue/query/list/?"
-                                   "json&preset=schedconf.all&panda_queue=%s" % self.args.queue)
+            url = "http://atlas-agis-api.cern.ch/request/pandaqueue/query/list/?json&preset=schedconf.all&" \
+                  "panda_queue=%s" % self.args.queue
+            if self.args.queuedata_cache:
+                _str = HTTPCache(self.args.queuedata_cache, self.args.queuedata_ttl).get(url, self.fetch_document,
+                                                                                         json.loads)
+            else:
+                _str = self.curl_query(url)
 
             confs = json.loads(_str)
             if self.args.queue in confs:
@@ -309,32 +735,29 @@ class Pilot:
         log.info("Queuedata obtained.")
         log.debug("queuedata: " + json.dumps(self.queuedata, indent=4, sort_keys=True))
 
-    def get_job(self):
+    def get_job_description(self):
         """
-        Gets job description from a file or from server.
+        Gets job description from a file or from server. The file is used only for the first job.
 
         :return: job description.
         """
         log.info("Trying to get job description.")
-        job_desc = self.try_get_json_file(self.args.job_description)
+        job_desc = self.try_get_json_file(self.args.job_description) if self.jobs_got == 0 else None
         if job_desc is None:
             log.info("Job description is not saved locally. Asking server.")
-            cpu_info = cpuinfo.get_cpu_info()
-            mem_info = psutil.virtual_memory()
-            disk_space = float(psutil.disk_usage(".").total) / 1024. / 1024.
+            hardware = self.startup.run('hardware', self.probe_hardware, self.startup_timeouts['hardware'])
+            data = probe_dynamic()
             # diskSpace = min(diskSpace, 14336)  # I doubt this is necessary, so RM
-
-            data = {
-                'cpu': float(cpu_info['hz_actual_raw'][0]) / 1000000.,
-                'mem': float(mem_info.total) / 1024. / 1024.,
+            data.update({
+                'cpu': hardware['cpu'],
+                'mem': hardware['mem'],
                 'node': self.node_name,
-                'diskSpace': disk_space,
                 'getProxyKey': False,  # do we need it?
                 'computingElement': self.args.queue,
                 'siteName': self.args.queue,
                 'workingGroup': '',  # do we need it?
                 'prodSourceLabel': self.args.job_tag
-            }
+            })
 
             _str = self.curl_query("https://%s:%d/server/panda/updateJob" % (self.args.jobserver,
                                                                              self.args.jobserver_port),
@@ -348,8 +771,23 @@ class Pilot:
                 raise
 
         log.info("Got job description.")
+        from job_description_fixer import description_fixer
+        return description_fixer(job_desc)
+
+    def get_job(self):
+        """
+        Gets job. With more than one job allowed, each job gets its own work directory in the current one.
+
+        :return Job: job.
+        """
+        job_desc = self.get_job_description()
+        self.jobs_got += 1
+        work_dir = None
+        if self.multi_job:
+            work_dir = tempfile.mkdtemp(prefix="job_%s." % job_desc.get('job_id'), dir=os.getcwd())
+            log.info("Job work directory is %s" % work_dir)
         from job import Job
-        job = Job(self, description_fixer(job_desc))
+        job = Job(self, job_desc, work_dir)
         return job
 
 
@@ -358,5 +796,6 @@ if __name__ == "__main__":
     """
     Main workflow is to create Pilot instance and run it with the command arguments.
     """
-    pilot = Pilot()
+    with profiler.phase("Pilot.__init__"):
+        pilot = Pilot()
     pilot.run(sys.argv)
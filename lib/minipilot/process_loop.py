@@ -0,0 +1,319 @@
+"""
+Single threaded process runner.
+
+All children started through one ProcessLoop share one thread, which reads their stdout and stderr with poll(2) and
+watches their deadlines. Python 2 has no asyncio, so the loop is a plain poll loop with a self-pipe for wake ups.
+
+Usage:
+
+    loop = default_loop()
+    handle = loop.submit(['rucio', 'download', ...], timeout=600)
+    ...
+    rc, out, err = handle.result()
+
+or synchronously, as Utility.call does:
+
+    rc, out, err = loop.call(['rucio', 'whoami'])
+"""
+import os
+import time
+import select
+import logging
+import pipes
+import threading
+import psutil
+from utility import StreamBuffer, CHUNK_SIZE, MEMORY_LIMIT, STREAM_GRACE, terminate_child, kill_child, redirection
+
+log = logging.getLogger("Utility")
+
+TICK = 0.5  # seconds between reaping checks for children that still hold their pipes
+ERROR_CODE = -1  # exit code of children failed by a loop error
+
+
+class ProcessHandle(object):
+    """
+    Future-like handle of a child running in ProcessLoop.
+
+    Attributes:
+        arguments               Command line of the child.
+        child                   psutil.Popen instance.
+        deadline                Time after which the child is terminated, or None.
+        terminate_timeout       Seconds between termination and killing.
+        returncode              Exit code, None while running.
+        eof                     Whether a pipe of the child was closed by EOF, ie. the child is about to exit.
+    """
+
+    def __init__(self, arguments, child, timeout=None, terminate_timeout=5, memory_limit=MEMORY_LIMIT):
+        self.arguments = arguments
+        self.child = child
+        self.deadline = time.time() + timeout if timeout else None
+        self.terminate_timeout = terminate_timeout
+        self.kill_deadline = None
+        self.exit_time = None
+        self.returncode = None
+        self.out = StreamBuffer(memory_limit)
+        self.err = StreamBuffer(memory_limit)
+        self.streams = {}
+        self.eof = False
+        self.callbacks = []
+        self.__finished = False
+        self.__done = threading.Event()
+        self.__lock = threading.Lock()
+
+    def done(self):
+        """
+        :return: whether the child has finished and its output is collected.
+        """
+        return self.__done.is_set()
+
+    def wait(self, timeout=None):
+        """
+        Blocks until the child is finished.
+
+        :param timeout: seconds to wait, None for forever.
+        :return: whether the child is finished.
+        """
+        self.__done.wait(timeout)
+        return self.done()
+
+    def result(self, timeout=None):
+        """
+        Waits for the child.
+
+        :param timeout: seconds to wait, None for forever.
+        :return: (exit code, stdout, stderr)
+        """
+        if not self.wait(timeout):
+            raise RuntimeError("child %d is still running" % self.child.pid)
+        return self.returncode, self.out.getvalue(), self.err.getvalue()
+
+    def add_done_callback(self, fn):
+        """
+        Calls fn(handle) when child is finished. Called immediately if it already is.
+        Callbacks run in the loop thread, so they should be short.
+
+        :param fn: callback
+        """
+        with self.__lock:
+            if not self.__finished:
+                self.callbacks.append(fn)
+                return
+        fn(self)
+
+    def finish(self):
+        """
+        Fires callbacks and marks handle as finished. Called by the loop.
+        """
+        with self.__lock:
+            self.__finished = True
+            callbacks, self.callbacks = self.callbacks, []
+        for fn in callbacks:
+            try:
+                fn(self)
+            except Exception as e:
+                log.error("Process callback failed: %s" % str(e))
+        self.__done.set()
+
+
+class ProcessLoop(threading.Thread):
+    """
+    Thread multiplexing output and deadlines of many children.
+    """
+
+    def __init__(self, chunk_size=CHUNK_SIZE, memory_limit=MEMORY_LIMIT):
+        threading.Thread.__init__(self, name="process-loop")
+        self.daemon = True
+        self.chunk_size = chunk_size
+        self.memory_limit = memory_limit
+        self.handles = []
+        self.pending = []
+        self.streams = {}
+        self.lock = threading.Lock()
+        self.poller = select.poll()
+        self.wakeup_r, self.wakeup_w = os.pipe()
+        self.poller.register(self.wakeup_r, select.POLLIN)
+        self.stopping = False
+
+    def submit(self, arguments, timeout=None, terminate_timeout=5, stdout=None, stderr=None, cwd=None):
+        """
+        Starts child and hands its pipes to the loop.
+
+        :param arguments: command line
+        :param timeout: seconds to let the child run. None or 0 means forever.
+        :param terminate_timeout: seconds between termination and killing. None or 0 means never kill.
+        :param stdout: sink to stream child's stdout into instead of collecting it. Files and file descriptors are
+                       attached to the child directly.
+        :param stderr: same as stdout, for child's stderr.
+        :param cwd: working directory of the child, current one by default.
+        :return ProcessHandle: handle of the child
+        """
+        log.info("calling " + " ".join(pipes.quote(x) for x in arguments))
+        child = psutil.Popen(arguments, stdout=redirection(stdout), stderr=redirection(stderr), cwd=cwd)
+        handle = ProcessHandle(arguments, child, timeout, terminate_timeout, self.memory_limit)
+        for stream, sink, buf in ((child.stdout, stdout, handle.out), (child.stderr, stderr, handle.err)):
+            if stream is not None:
+                handle.streams[stream.fileno()] = (stream, sink if sink is not None else buf)
+
+        with self.lock:
+            self.pending.append(handle)
+        os.write(self.wakeup_w, b'.')
+        return handle
+
+    def call(self, arguments, timeout=None, terminate_timeout=5, stdout=None, stderr=None, cwd=None):
+        """
+        Synchronous shim, same interface as Utility.call.
+
+        :return: (exit code, stdout, stderr)
+        """
+        return self.submit(arguments, timeout, terminate_timeout, stdout, stderr, cwd).result()
+
+    def stop(self):
+        """
+        Stops the loop after currently running children are finished.
+        """
+        self.stopping = True
+        os.write(self.wakeup_w, b'.')
+
+    def run(self):
+        while not self.stopping or self.handles or self.pending:
+            self.adopt_pending()
+            for fd, event in self.poller.poll(self.poll_timeout()):
+                if fd == self.wakeup_r:
+                    os.read(fd, self.chunk_size)
+                elif fd in self.streams:  # not closed by a failure meanwhile
+                    handle = self.streams[fd]
+                    try:
+                        self.read(fd)
+                    except Exception as e:
+                        self.fail(handle, e)
+            self.check_children()
+
+    def adopt_pending(self):
+        with self.lock:
+            pending, self.pending = self.pending, []
+        for handle in pending:
+            for fd in handle.streams:
+                self.streams[fd] = handle
+                self.poller.register(fd, select.POLLIN)
+            self.handles.append(handle)
+
+    def poll_timeout(self):
+        """
+        :return: milliseconds to sleep in poll(2), None for no deadlines at all.
+        """
+        if not self.handles:
+            return None
+        now = time.time()
+        timeout = TICK
+        for handle in self.handles:
+            if handle.eof and not handle.streams and handle.exit_time is None:
+                timeout = min(timeout, 0.01)  # pipes are closed, child is about to exit
+            for deadline in (handle.deadline, handle.kill_deadline):
+                if deadline is not None:
+                    timeout = min(timeout, deadline - now)
+        return max(timeout, 0) * 1000
+
+    def read(self, fd):
+        handle = self.streams[fd]
+        stream, sink = handle.streams[fd]
+        out = os.read(fd, self.chunk_size)
+        if out != b'':
+            sink.write(out)
+        else:
+            handle.eof = True
+            self.close_stream(handle, fd)
+
+    def close_stream(self, handle, fd):
+        stream, sink = handle.streams.pop(fd)
+        del self.streams[fd]
+        self.poller.unregister(fd)
+        try:
+            sink.flush()
+        finally:
+            stream.close()
+
+    def fail(self, handle, error):
+        """
+        Finishes handle after an error in the loop (eg. a failing sink), so that its waiters do not hang. The child is
+        killed if it still runs, the handle gets ERROR_CODE and the error is appended to its stderr.
+
+        :param handle: ProcessHandle
+        :param error: exception
+        """
+        log.error("Process loop failed on child %d: %s" % (handle.child.pid, str(error)))
+        for fd in list(handle.streams):
+            try:
+                self.close_stream(handle, fd)
+            except Exception as e:
+                log.warning("Failed to close stream of child %d: %s" % (handle.child.pid, str(e)))
+        if handle.returncode is None:
+            try:
+                kill_child(handle.child)
+                handle.child.wait()
+            except (psutil.Error, OSError) as e:
+                log.warning("Failed to kill child %d: %s" % (handle.child.pid, str(e)))
+        handle.returncode = ERROR_CODE
+        handle.err.write(("process loop error: %s\n" % str(error)).encode('utf-8'))
+        if handle in self.handles:
+            self.handles.remove(handle)
+        handle.finish()
+
+    def check_children(self):
+        now = time.time()
+        for handle in list(self.handles):
+            try:
+                self.check_child(handle, now)
+            except Exception as e:
+                self.fail(handle, e)
+
+    def check_child(self, handle, now):
+        """
+        Reaps the child, enforces its deadlines and finishes its handle when the child and its pipes are closed.
+        """
+        if handle.returncode is None:
+            handle.returncode = handle.child.poll()
+            if handle.returncode is not None:
+                handle.exit_time = now
+
+        if handle.returncode is None:
+            self.check_deadlines(handle, now)
+            return
+
+        if handle.streams and now - handle.exit_time > STREAM_GRACE:
+            for fd in list(handle.streams):
+                self.close_stream(handle, fd)
+        if not handle.streams:
+            self.handles.remove(handle)
+            handle.finish()
+
+    @staticmethod
+    def check_deadlines(handle, now):
+        """
+        Terminates the running child after its deadline, and kills it after terminate_timeout more.
+        """
+        if handle.deadline is not None and handle.deadline <= now and handle.kill_deadline is None:
+            log.info("child timed out, terminating")
+            terminate_child(handle.child)
+            handle.deadline = None
+            if handle.terminate_timeout:
+                handle.kill_deadline = now + handle.terminate_timeout
+        elif handle.kill_deadline is not None and handle.kill_deadline <= now:
+            log.info("child termination timed out, killing")
+            kill_child(handle.child)
+            handle.kill_deadline = None
+
+
+_default_loop = None
+_default_loop_lock = threading.Lock()
+
+
+def default_loop():
+    """
+    :return ProcessLoop: shared loop of this pilot, started on first use.
+    """
+    global _default_loop
+    with _default_loop_lock:
+        if _default_loop is None:
+            _default_loop = ProcessLoop()
+            _default_loop.start()
+    return _default_loop
@@ -0,0 +1,156 @@
+"""
+Startup profiling: time of every module import and of pilot initialization phases.
+
+Enabled by --startup_profile (or --startup-profile) on the pilot command line. It has to catch the imports of pilot.py
+itself, which happen before arguments are parsed, so pilot.py checks the command line with enable right after importing
+this module, before its other imports, and an __import__ hook is installed right away. The profile is logged and saved
+as JSON when the pilot is ready to get jobs, so cold start time can be tracked across releases.
+
+Usage:
+
+    with phase("arguments"):
+        ...
+"""
+import os
+import sys
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+try:
+    import __builtin__ as builtins
+except ImportError:
+    import builtins
+
+log = logging.getLogger("pilot.profiler")
+
+FLAGS = ('--startup_profile', '--startup-profile')
+
+active = None  # StartupProfiler of this process, if profiling is enabled
+
+
+class StartupProfiler(object):
+    """
+    Recorder of import and phase times.
+
+    Attributes:
+        start_time              Time profiling started, ie. pilot.py load.
+        imports                 List of (module name, importer, start offset, inclusive seconds, exclusive seconds,
+                                nesting depth) of first imports, in completion order.
+        phases                  List of (phase name, start offset, seconds).
+    """
+
+    def __init__(self):
+        self.start_time = time.time()
+        self.imports = []
+        self.phases = []
+        self.local = threading.local()
+        self.original_import = None
+
+    def install(self):
+        """
+        Starts recording imports.
+        """
+        self.original_import = builtins.__import__
+        builtins.__import__ = self.profiled_import
+
+    def uninstall(self):
+        """
+        Stops recording imports.
+        """
+        if self.original_import is not None:
+            builtins.__import__ = self.original_import
+            self.original_import = None
+
+    def profiled_import(self, name, *args, **kwargs):
+        original_import = self.original_import
+        if original_import is None:  # uninstalled, but still called by a reference kept meanwhile
+            return builtins.__import__(name, *args, **kwargs)
+        if name in sys.modules:
+            return original_import(name, *args, **kwargs)
+
+        stack = self.local.__dict__.setdefault('stack', [])
+        importer = ((args[0] if args else kwargs.get('globals')) or {}).get('__name__', '')
+        modules = len(sys.modules)
+        start = time.time()
+        stack.append(0.)  # time of nested imports
+        try:
+            return original_import(name, *args, **kwargs)
+        finally:
+            elapsed = time.time() - start
+            nested = stack.pop()
+            if stack:
+                stack[-1] += elapsed
+            if len(sys.modules) > modules:  # not just a relative name of a loaded module
+                if not name:  # from . import x
+                    fromlist = args[2] if len(args) > 2 else kwargs.get('fromlist')
+                    name = "." + ",".join(fromlist or ())
+                self.imports.append((name, importer, start - self.start_time, elapsed, elapsed - nested, len(stack)))
+
+    @contextmanager
+    def phase(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.phases.append((name, start - self.start_time, time.time() - start))
+
+    def report(self, path=None, steps=None):
+        """
+        Logs the profile and saves it as JSON. Stops recording imports.
+
+        :param path: JSON file, or None
+        :param steps: dict of startup step name -> (start offset, seconds or None while running), see startup.
+        """
+        self.uninstall()
+        total = time.time() - self.start_time
+        top_imports = [i for i in self.imports if i[5] == 0]
+        log.info("Startup profile: %.3f s to get ready, %.3f s in %d top level imports (%d modules in total)" %
+                 (total, sum(i[3] for i in top_imports), len(top_imports), len(self.imports)))
+        for name, offset, seconds in self.phases:
+            log.info("  phase  %-28s at +%.3f s  %8.3f s" % (name, offset, seconds))
+        for name, importer, offset, inclusive, exclusive, depth in sorted(self.imports, key=lambda i: -i[4])[:20]:
+            log.info("  import %-28s at +%.3f s  %8.3f s (%.3f s with nested, from %s)" %
+                     (name, offset, exclusive, inclusive, importer))
+
+        if path:
+            profile = {
+                'total': total,
+                'phases': [{'name': n, 'start': o, 'seconds': s} for n, o, s in self.phases],
+                'imports': [{'name': n, 'importer': i, 'start': o, 'seconds': inc, 'exclusive': exc, 'depth': d}
+                            for n, i, o, inc, exc, d in self.imports],
+                'steps': dict((n, {'start': o, 'seconds': s}) for n, (o, s) in (steps or {}).items()),
+                'python': sys.version.split(" ")[0],
+                'pid': os.getpid()
+            }
+            with open(path, 'w') as f:
+                json.dump(profile, f, indent=4, sort_keys=True)
+            log.info("Startup profile saved to %s" % path)
+
+
+def enable(argv):
+    """
+    Starts profiling if it is requested in the command line.
+
+    :param argv: command line
+    :return StartupProfiler: active profiler, or None.
+    """
+    global active
+    if active is None and any(a in FLAGS or a.split('=', 1)[0] in FLAGS for a in argv[1:]):
+        active = StartupProfiler()
+        active.install()
+    return active
+
+
+@contextmanager
+def phase(name):
+    """
+    Records initialization phase, if profiling is enabled.
+    """
+    if active is None:
+        yield
+    else:
+        with active.phase(name):
+            yield
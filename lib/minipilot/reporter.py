@@ -0,0 +1,172 @@
+"""
+Background delivery of job state updates to the job server.
+
+Jobs hand their updates to the StateReporter and go on at once. The reporter thread sends them one by one. If the
+server is slow, only the latest update of each job waits for sending: an update queued behind another one of the same
+job replaces it, since the server only needs the current state. Failed updates are retried with exponential backoff,
+unless a newer update of the job arrives meanwhile. A job waits for delivery of its last update with flush.
+With a StateJournal, updates are recorded on disk before they are queued, so they survive the pilot (see journal).
+"""
+import time
+import logging
+import threading
+from utility import thread_context
+
+log = logging.getLogger("pilot.reporter")
+
+BACKOFF = 1  # seconds before the first retry
+MAX_BACKOFF = 300  # maximum seconds between retries
+
+
+class StateReporter(threading.Thread):
+    """
+    Thread delivering job updates. Started on first report.
+    Jobs are expected to have post_state(data) method, sending an update synchronously, and log attribute.
+
+    Attributes:
+        backoff                 Seconds before the first retry, doubled on every further failure.
+        max_backoff             Maximum seconds between retries.
+        journal                 StateJournal recording updates until they are delivered, or None.
+        pending                 Dict of job -> (latest update waiting for sending, its journal sequence number).
+        retries                 Dict of job -> (time of next attempt, current backoff) of failed jobs.
+        sending                 Job, which update is being sent, or None.
+    """
+
+    def __init__(self, backoff=BACKOFF, max_backoff=MAX_BACKOFF, journal=None):
+        threading.Thread.__init__(self, name="state-reporter")
+        self.daemon = True
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.journal = journal
+        self.pending = {}
+        self.retries = {}
+        self.sending = None
+        self.stopping = False
+        self.condition = threading.Condition()
+
+    def report(self, job, data, seq=None, durable=True):
+        """
+        Records update in the journal and queues it for sending, replacing a queued update of the same job.
+
+        :param job: Job instance
+        :param data: update to be sent by job.post_state
+        :param seq: journal sequence number, if the update is already in the journal.
+        :param durable: whether to record the update in the journal. Transient updates (eg. heartbeats) are not
+                        recorded, but their delivery still acknowledges journaled updates they replace.
+        """
+        if self.journal is not None and seq is None and durable:
+            try:
+                seq = self.journal.append(str(job.id), data)
+            except (IOError, OSError) as e:
+                log.warning("Failed to record update of job %s in journal: %s" % (job.id, str(e)))
+        with self.condition:
+            if job in self.pending:
+                log.debug("Coalescing update of job %s: %s replaces %s" % (job.id, data.get('state'),
+                                                                           self.pending[job][0].get('state')))
+                if seq is None:
+                    seq = self.pending[job][1]
+            self.pending[job] = (data, seq)
+            if not self.is_alive():
+                self.start()
+            self.condition.notify_all()
+
+    def flush(self, job, timeout=None):
+        """
+        Waits until the latest update of the job is delivered.
+
+        :param job: Job instance
+        :param timeout: seconds to wait, None for forever.
+        :return: whether the update is delivered.
+        """
+        deadline = time.time() + timeout if timeout is not None else None
+        with self.condition:
+            while job in self.pending or self.sending is job:
+                if deadline is None:
+                    self.condition.wait(MAX_BACKOFF)
+                elif deadline > time.time():
+                    self.condition.wait(deadline - time.time())
+                else:
+                    return False
+        return True
+
+    def stop(self, timeout=None):
+        """
+        Stops the reporter after queued updates are delivered.
+
+        :param timeout: seconds to wait for the delivery, None for forever.
+        """
+        with self.condition:
+            self.stopping = True
+            self.condition.notify_all()
+        if self.is_alive():
+            self.join(timeout)
+            if self.is_alive():
+                log.warning("Not all job updates are delivered: %s" %
+                            ", ".join(str(job.id) for job in self.pending))
+
+    def next_job(self):
+        """
+        :return: (job which update is due, seconds until the next one is due or None if nothing is pending)
+        """
+        now = time.time()
+        due_job, wait = None, None
+        for job in self.pending:
+            due = self.retries.get(job, (now, 0))[0]
+            if wait is None or due - now < wait:
+                due_job, wait = job, due - now
+        if wait is not None and wait <= 0:
+            return due_job, 0
+        return None, wait
+
+    def run(self):
+        while True:
+            with self.condition:
+                job, wait = self.next_job()
+                while job is None:
+                    if self.stopping and not self.pending:
+                        return
+                    self.condition.wait(wait)
+                    job, wait = self.next_job()
+                data, seq = self.pending.pop(job)
+                self.sending = job
+
+            thread_context.owner = job
+            try:
+                job.post_state(data)
+                error = None
+            except Exception as e:
+                error = e
+
+            if error is None and seq is not None:
+                try:
+                    self.journal.delivered(str(job.id), seq)
+                except (IOError, OSError) as e:
+                    log.warning("Failed to record delivery of job %s update in journal: %s" % (job.id, str(e)))
+
+            with self.condition:
+                self.sending = None
+                if error is None:
+                    self.retries.pop(job, None)
+                else:
+                    self.retry(job, data, seq, error)
+                self.condition.notify_all()
+            thread_context.owner = None
+
+    def retry(self, job, data, seq, error):
+        """
+        Queues failed update again with backoff, unless a newer update of the job replaced it meanwhile. The newer
+        update then acknowledges the journal record of the failed one when it is delivered. Called with condition held.
+
+        :param job: Job instance
+        :param data: failed update
+        :param seq: its journal sequence number, or None.
+        :param error: exception of the attempt
+        """
+        backoff = min(self.retries[job][1] * 2, self.max_backoff) if job in self.retries else self.backoff
+        self.retries[job] = (time.time() + backoff, backoff)
+        if job in self.pending:
+            newer_data, newer_seq = self.pending[job]
+            self.pending[job] = (newer_data, newer_seq if newer_seq is not None else seq)
+        else:
+            self.pending[job] = (data, seq)
+        job.log.warning("Failed to update state of job %s (%s), retrying in %d s." % (job.id, str(error), backoff))
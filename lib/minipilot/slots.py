@@ -0,0 +1,95 @@
+"""
+Node resources shared by jobs running concurrently in one pilot.
+
+A job takes its share of cores and memory (cores_number and minimum_ram of its description) for the whole run, and
+gives it back when it ends. Jobs asking for more than the node has are trimmed to the whole node, so they run alone.
+"""
+import logging
+import threading
+import psutil
+
+log = logging.getLogger("pilot.slots")
+
+
+class Slots(object):
+    """
+    Pool of node cores and memory.
+
+    Attributes:
+        cores                   Total number of cores.
+        memory                  Total memory, MB.
+        jobs                    Maximum number of concurrent jobs, 0 for no limit.
+        free_cores              Cores not taken by running jobs.
+        free_memory             Memory not taken by running jobs, MB.
+        running                 Number of running jobs.
+    """
+
+    def __init__(self, cores=None, memory=None, jobs=0):
+        """
+        :param cores: number of cores, all node cores by default.
+        :param memory: memory, MB, all node memory by default.
+        :param jobs: maximum number of concurrent jobs, 0 for no limit.
+        """
+        self.cores = cores or psutil.cpu_count() or 1
+        self.memory = memory or psutil.virtual_memory().total // (1024 * 1024)
+        self.jobs = jobs
+        self.free_cores = self.cores
+        self.free_memory = self.memory
+        self.running = 0
+        self.condition = threading.Condition()
+
+    def request(self, job):
+        """
+        :param job: Job instance
+        :return: (cores, memory) the job takes, trimmed to the node size.
+        """
+        cores = int(job.description.get('cores_number') or 1)
+        memory = int(job.description.get('minimum_ram') or 0)
+        if cores > self.cores or memory > self.memory:
+            log.warning("Job %s requires %d cores and %d MB, more than the node has (%d cores, %d MB)." %
+                        (job.id, cores, memory, self.cores, self.memory))
+        return min(cores, self.cores), min(memory, self.memory)
+
+    def fits(self, cores, memory):
+        """
+        :return: whether one more job with such a request fits into free resources now.
+        """
+        return cores <= self.free_cores and memory <= self.free_memory and \
+            (self.jobs <= 0 or self.running < self.jobs)
+
+    def wait_free(self, cores=1, memory=0):
+        """
+        Waits until a job with such a request fits into free resources, without taking them.
+        """
+        with self.condition:
+            while not self.fits(cores, memory):
+                self.condition.wait()
+
+    def acquire(self, cores, memory):
+        """
+        Takes resources, waits until running jobs free enough of them.
+        """
+        with self.condition:
+            while not self.fits(cores, memory):
+                self.condition.wait()
+            self.free_cores -= cores
+            self.free_memory -= memory
+            self.running += 1
+
+    def release(self, cores, memory):
+        """
+        Gives taken resources back.
+        """
+        with self.condition:
+            self.free_cores += cores
+            self.free_memory += memory
+            self.running -= 1
+            self.condition.notify_all()
+
+    def wait_idle(self):
+        """
+        Waits until all jobs give their resources back.
+        """
+        with self.condition:
+            while self.running > 0:
+                self.condition.wait()
@@ -0,0 +1,133 @@
+"""
+Concurrent pilot startup.
+
+Startup probes (node name lookup, queuedata, hardware, requirements) do not depend on each other, so each runs in its
+own thread as soon as it is known to be needed, and the pilot waits only for the results it actually uses, each with
+its own timeout. A hung probe (eg. an unresponsive DNS server) costs its timeout, not the pilot.
+
+Usage:
+
+    startup = Startup()
+    startup.start('dns', resolve, 10)
+    ...
+    name = startup.result('dns', default=fallback)
+    startup.report()
+"""
+import time
+import logging
+import threading
+
+log = logging.getLogger("pilot.startup")
+
+_no_default = object()
+
+
+class StartupStep(threading.Thread):
+    """
+    Thread running one startup probe.
+
+    Attributes:
+        fn                      Probe function.
+        timeout                 Seconds the probe may take.
+        start_time              Time the probe started.
+        end_time                Time the probe ended, None while it runs.
+        value                   Result of the probe.
+        error                   Exception raised by the probe, or None.
+    """
+
+    def __init__(self, name, fn, timeout):
+        threading.Thread.__init__(self, name="startup-" + name)
+        self.daemon = True
+        self.fn = fn
+        self.timeout = timeout
+        self.start_time = time.time()
+        self.end_time = None
+        self.value = None
+        self.error = None
+
+    def run(self):
+        try:
+            self.value = self.fn()
+        except Exception as e:
+            self.error = e
+        self.end_time = time.time()
+
+
+class Startup(object):
+    """
+    Set of concurrently running startup steps.
+
+    Attributes:
+        steps                   Dict of step name -> StartupStep.
+        start_time              Time the startup began.
+    """
+
+    def __init__(self):
+        self.steps = {}
+        self.start_time = time.time()
+        self.lock = threading.Lock()
+
+    def start(self, name, fn, timeout):
+        """
+        Starts step, unless it is already started.
+
+        :param name: step name
+        :param fn: probe function, takes no arguments
+        :param timeout: seconds the step may take
+        """
+        with self.lock:
+            if name in self.steps:
+                return
+            step = self.steps[name] = StartupStep(name, fn, timeout)
+        step.start()
+
+    def result(self, name, default=_no_default):
+        """
+        Waits for the step up to its timeout.
+
+        :param name: step name
+        :param default: value to return if the step failed or timed out. If it is not given, the error is raised.
+        :return: result of the step
+        """
+        step = self.steps[name]
+        step.join(max(0, step.start_time + step.timeout - time.time()))
+        if step.is_alive():
+            error = RuntimeError("startup step %s timed out in %d s" % (name, step.timeout))
+        else:
+            error = step.error
+        if error is None:
+            return step.value
+        if default is _no_default:
+            raise error
+        log.warning("Startup step %s failed: %s" % (name, str(error)))
+        return default
+
+    def run(self, name, fn, timeout, default=_no_default):
+        """
+        Starts step if needed and waits for its result.
+
+        :return: result of the step, see result.
+        """
+        self.start(name, fn, timeout)
+        return self.result(name, default)
+
+    def timings(self):
+        """
+        :return: dict of step name -> (start offset, seconds it took or None if it still runs).
+        """
+        return dict((name, (step.start_time - self.start_time,
+                            step.end_time - step.start_time if step.end_time is not None else None))
+                    for name, step in self.steps.items())
+
+    def report(self):
+        """
+        Logs startup timing breakdown.
+        """
+        now = time.time()
+        log.info("Startup took %.3f s:" % (now - self.start_time))
+        for name, step in sorted(self.steps.items(), key=lambda item: item[1].start_time):
+            if step.end_time is not None:
+                state = "%.3f s" % (step.end_time - step.start_time) + (" (failed)" if step.error else "")
+            else:
+                state = "still running after %.3f s" % (now - step.start_time)
+            log.info("  %-14s started at +%.3f s, %s" % (name, step.start_time - self.start_time, state))
@@ -1,15 +1,23 @@
 import threading
 import subprocess
 import logging
-import time
 import os
 import signal
 import psutil
 import pipes
+import tempfile
+import errno
+import shutil
+import ctypes
+import ctypes.util
+from multiprocessing.pool import ThreadPool
 
 log = logging.getLogger("Utility")
 
-# TODO: Create proper stream collectors
+CHUNK_SIZE = 64 * 1024  # bytes read from a pipe at once
+MEMORY_LIMIT = 16 * 1024 * 1024  # bytes of output kept in memory before spilling to disk
+COPY_BUFFER = 1024 * 1024  # bytes per read/write in fallback file copy
+STREAM_GRACE = 5  # seconds to wait for pipes after child exit, they may be held open by its own children
 
 
 def touch(fname, times=None):
@@ -24,89 +32,391 @@ def touch(fname, times=None):
         os.utime(fname, times)
 
 
+def _libc_sendfile():
+    """
+    Finds sendfile(2) for Pythons that have no os.sendfile.
+
+    :return: sendfile(out_fd, in_fd, count) function or None
+    """
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        c_sendfile = libc.sendfile
+    except (OSError, AttributeError, TypeError):
+        return None
+    c_sendfile.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_void_p, ctypes.c_size_t]
+    c_sendfile.restype = ctypes.c_ssize_t
+
+    def sendfile(out_fd, in_fd, count):
+        sent = c_sendfile(out_fd, in_fd, None, count)
+        if sent < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        return sent
+
+    return sendfile
+
+
+if hasattr(os, 'sendfile'):
+    def _sendfile(out_fd, in_fd, count):
+        return os.sendfile(out_fd, in_fd, None, count)
+else:
+    _sendfile = _libc_sendfile()
+
+
+def copy_file(src, dst):
+    """
+    Copies file contents with sendfile(2), so the data does not pass through user space. Falls back to copying with
+    large buffers if sendfile is not available or not supported for these files.
+
+    :param src: source path
+    :param dst: destination path
+    :return: number of bytes copied
+    """
+    with open(src, 'rb') as f_in, open(dst, 'wb') as f_out:
+        size = os.fstat(f_in.fileno()).st_size
+        copied = 0
+        if _sendfile is not None:
+            try:
+                while copied < size:
+                    sent = _sendfile(f_out.fileno(), f_in.fileno(), min(size - copied, 1 << 30))
+                    if sent == 0:
+                        break
+                    copied += sent
+                return copied
+            except OSError as e:
+                if e.errno not in (errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP) or copied > 0:
+                    raise
+        shutil.copyfileobj(f_in, f_out, COPY_BUFFER)
+        return f_in.tell()
+
+
+class StreamBuffer(object):
+    """
+    Output storage for stream collectors.
+    Keeps chunks in a list until their total size reaches memory limit, then moves everything to an anonymous
+    temporary file and continues writing there. This way collecting is linear and pilot memory is bounded.
+
+    Attributes:
+        memory_limit            Maximum number of bytes held in memory. None means no limit.
+        size                    Total number of bytes written.
+        spill                   Temporary file used after the limit is reached, or None.
+    """
+
+    def __init__(self, memory_limit=MEMORY_LIMIT):
+        self.memory_limit = memory_limit
+        self.size = 0
+        self.chunks = []
+        self.spill = None
+
+    def write(self, chunk):
+        """
+        Appends chunk to the buffer, spilling to disk if memory limit is reached.
+
+        :param chunk: data to append
+        """
+        if self.spill is None and self.memory_limit is not None and self.size + len(chunk) > self.memory_limit:
+            self.spill = tempfile.TemporaryFile(prefix="pilot-stream-")
+            self.spill.writelines(self.chunks)
+            self.chunks = []
+        if self.spill is not None:
+            self.spill.write(chunk)
+        else:
+            self.chunks.append(chunk)
+        self.size += len(chunk)
+
+    def iter_chunks(self):
+        """
+        Iterates over buffered data without joining it.
+
+        :return: generator of chunks
+        """
+        if self.spill is None:
+            for chunk in self.chunks:
+                yield chunk
+        else:
+            self.spill.flush()
+            self.spill.seek(0)
+            while True:
+                chunk = self.spill.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+            self.spill.seek(0, os.SEEK_END)
+
+    def getvalue(self):
+        """
+        :return: whole buffered data as a single string.
+        """
+        return b''.join(self.iter_chunks())
+
+    def flush(self):
+        pass
+
+    def close(self):
+        """
+        Releases memory and temporary file.
+        """
+        self.chunks = []
+        if self.spill is not None:
+            self.spill.close()
+            self.spill = None
+
+
+class LogStream(object):
+    """
+    File-like sink passing child's output to a logger line by line, as soon as lines are complete. Lines are decoded
+    as UTF-8, undecodable bytes are replaced.
+    Overlong lines are split by max_line, so memory stays bounded whatever the child writes.
+    """
+
+    def __init__(self, logger, level=logging.INFO, prefix="", max_line=CHUNK_SIZE):
+        self.logger = logger
+        self.level = level
+        self.prefix = prefix
+        self.max_line = max_line
+        self.partial = b''
+
+    def emit(self, line):
+        self.logger.log(self.level, "%s%s", self.prefix, line.decode('utf-8', 'replace'))
+
+    def write(self, chunk):
+        """
+        Logs all complete lines from chunk, keeps the rest for the next write.
+
+        :param chunk: data to log
+        """
+        lines = (self.partial + chunk).split(b'\n')
+        self.partial = lines.pop()
+        for line in lines:
+            self.emit(line)
+        while len(self.partial) >= self.max_line:
+            self.emit(self.partial[:self.max_line])
+            self.partial = self.partial[self.max_line:]
+
+    def flush(self):
+        """
+        Logs incomplete last line, if any.
+        """
+        if self.partial != b'':
+            self.emit(self.partial)
+            self.partial = b''
+
+
+thread_context = threading.local()  # thread_context.owner: object (eg. Job) the current thread works for
+
+
+def inherit_context():
+    """
+    :return: thread initializer, which makes new thread work for the same owner as the calling one.
+    """
+    owner = getattr(thread_context, 'owner', None)
+
+    def initializer():
+        thread_context.owner = owner
+
+    return initializer
+
+
+def parallel_map(func, items, workers):
+    """
+    Applies func to every item on a pool of at most workers threads. Workers inherit caller's thread context.
+
+    :param func: function of one argument
+    :param items: list of arguments
+    :param workers: maximum number of concurrent calls
+    :return: dict item -> result. Exceptions raised by func are propagated.
+    """
+    workers = min(workers, len(items))
+    if workers <= 1:
+        return dict((item, func(item)) for item in items)
+
+    pool = ThreadPool(workers, inherit_context())
+    try:
+        return dict(zip(items, pool.map(func, items)))
+    finally:
+        pool.close()
+        pool.join()
+
+
+def redirection(sink):
+    """
+    Chooses what to pass to Popen for an output stream. Sinks backed by a file descriptor (real files or raw
+    descriptors) are attached to the child directly, so the kernel writes the data and Python never copies it.
+    Everything else goes through a pipe.
+
+    :param sink: output sink, file, file descriptor or None
+    :return: Popen stdout/stderr argument
+    """
+    if isinstance(sink, int) or hasattr(sink, 'fileno'):
+        return sink
+    return subprocess.PIPE
+
+
 class CollectStream(threading.Thread):
-    def __init__(self, stream, child):
+    """
+    Thread reading child's pipe in large chunks until EOF and passing them to a sink.
+    Sink is any object with write() and flush(), by default a StreamBuffer.
+    If stream is None (output is redirected elsewhere), there is nothing to collect.
+    """
+
+    def __init__(self, stream, child=None, chunk_size=CHUNK_SIZE, memory_limit=MEMORY_LIMIT, sink=None):
         threading.Thread.__init__(self)
+        self.daemon = True
         self.stream = stream
         self.child = child
-        self.buffer = ''
+        self.chunk_size = chunk_size
+        self.sink = sink if sink is not None else StreamBuffer(memory_limit)
+
+    @property
+    def buffer(self):
+        """
+        :return: collected data, empty if the sink is not a buffer.
+        """
+        if isinstance(self.sink, StreamBuffer):
+            return self.sink.getvalue()
+        return b''
 
     def run(self):
+        if self.stream is None:
+            return
+        fd = self.stream.fileno()
         while True:
-            out = self.stream.read(1)
-            if out == '' and self.child.poll() is not None:
+            out = os.read(fd, self.chunk_size)
+            if out == b'':
                 break
-            if out != '':
-                self.buffer += out
-                # print(out)
+            self.sink.write(out)
 
+        self.sink.flush()
         self.stream.close()
 
 
 terminator = signal.SIGTERM if os.name != 'nt' else signal.CTRL_BREAK_EVENT
 
 
+def terminate_child(child):
+    """
+    Asks child to terminate gracefully.
+
+    :param child: psutil.Popen instance
+    """
+    child.send_signal(terminator)
+
+
+def kill_child(child):
+    """
+    Kills child unconditionally.
+
+    :param child: psutil.Popen instance
+    """
+    child.kill()
+
+
+def wait_child(child, timeout=None, terminate_timeout=5):
+    """
+    Waits for the child to exit without spending CPU.
+    The child is reaped by a helper thread blocked in waitpid, caller sleeps on joining it. If timeout passes, child is
+    asked to terminate, and if it does not exit in terminate_timeout, it is killed.
+
+    :param child: psutil.Popen instance
+    :param timeout: seconds to let the child run. None or 0 means forever.
+    :param terminate_timeout: seconds between termination and killing. None or 0 means never kill.
+    :return: exit code
+    """
+    waiter = threading.Thread(target=child.wait, name="wait-%d" % child.pid)
+    waiter.daemon = True
+    waiter.start()
+
+    waiter.join(timeout or None)
+    if waiter.is_alive():
+        log.info("child timed out, terminating")
+        terminate_child(child)
+        waiter.join(terminate_timeout or None)
+        if waiter.is_alive():
+            log.info("child termination timed out, killing")
+            kill_child(child)
+            waiter.join()
+
+    return child.returncode
+
+
 class Popen(psutil.Popen):
 
-    def __init__(self, args, timeout=None, terminate_timeout=5):
+    def __init__(self, args, timeout=None, terminate_timeout=5, memory_limit=MEMORY_LIMIT):
         psutil.Popen.__init__(self, args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
 
-        o = CollectStream(self.stdout, self)
-        e = CollectStream(self.stderr, self)
+        o = CollectStream(self.stdout, self, memory_limit=memory_limit)
+        e = CollectStream(self.stderr, self, memory_limit=memory_limit)
+        self.collectors = (o, e)
 
         o.start()
         e.start()
 
-        if timeout:
-            end = time.time() + timeout
-        while self.is_running():
-            if timeout and end < time.time():
-                log.info("child timed out, terminating")
-                self.terminate_graceful()
-                end = time.time() + terminate_timeout
-                break
-
-        while self.is_running():
-            if terminate_timeout and end < time.time():
-                log.info("child termination timed out, killing")
-                self.kill()
-                break
+        wait_child(self, timeout, terminate_timeout)
 
     def terminate_graceful(self):
-        self.send_signal(terminator)
+        terminate_child(self)
+
+    def result(self):
+        """
+        Waits for the child and its output.
+
+        :return: (exit code, stdout, stderr)
+        """
+        rc = self.wait()
+        o, e = self.collectors
+        o.join(STREAM_GRACE)
+        e.join(STREAM_GRACE)
+        return rc, o.buffer, e.buffer
 
 
 class Utility(object):
+    """
+    Helper for running external commands.
+
+    Attributes:
+        process_loop            ProcessLoop to run children in. If None, each call collects its child with own threads.
+    """
+    process_loop = None
 
     def __init__(self):
         pass
 
-    def call(self, arguments, timeout=None, terminate_timeout=5):
+    def call(self, arguments, timeout=None, terminate_timeout=5, memory_limit=MEMORY_LIMIT, stdout=None, stderr=None,
+             cwd=None, started=None):
+        """
+        Runs external command and waits for it.
+
+        :param arguments: command line
+        :param timeout: seconds to let the child run. None or 0 means forever.
+        :param terminate_timeout: seconds between termination and killing. None or 0 means never kill.
+        :param memory_limit: bytes of each output stream kept in memory before spilling to disk.
+        :param stdout: sink to stream child's stdout into (eg. LogStream) instead of collecting it. Files and file
+                       descriptors are attached to the child directly.
+        :param stderr: same as stdout, for child's stderr.
+        :param cwd: working directory of the child, current one by default.
+        :param started: function called with psutil.Popen of the child right after it is started, eg. to monitor it.
+        :return: (exit code, stdout, stderr). Streamed and redirected outputs are returned empty.
+        """
+        if self.process_loop is not None:
+            handle = self.process_loop.submit(arguments, timeout, terminate_timeout, stdout, stderr, cwd)
+            if started is not None:
+                started(handle.child)
+            return handle.result()
+
         log.info("calling " + " ".join(pipes.quote(x) for x in arguments))
-        child = psutil.Popen(arguments, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        child = psutil.Popen(arguments, stdout=redirection(stdout), stderr=redirection(stderr), cwd=cwd)
+        if started is not None:
+            started(child)
 
-        o = CollectStream(child.stdout, child)
-        e = CollectStream(child.stderr, child)
+        o = CollectStream(child.stdout, child, memory_limit=memory_limit, sink=stdout)
+        e = CollectStream(child.stderr, child, memory_limit=memory_limit, sink=stderr)
 
         o.start()
         e.start()
 
-        if timeout:
-            end = time.time() + timeout
-        while child.is_running():
-            if timeout and end < time.time():
-                log.info("child timed out, terminating")
-                self.terminate_child(child)
-                end = time.time() + terminate_timeout
-                break
-
-        while child.is_running():
-            if terminate_timeout and end < time.time():
-                log.info("child termination timed out, killing")
-                self.kill_child(child)
-                break
-
-        rc = child.wait()
+        rc = wait_child(child, timeout, terminate_timeout)
+        o.join(STREAM_GRACE)
+        e.join(STREAM_GRACE)
 
         return rc, o.buffer, e.buffer
 
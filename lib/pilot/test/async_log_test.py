@@ -0,0 +1,116 @@
+import os
+import sys
+import shutil
+import logging
+import tempfile
+import threading
+import subprocess
+from unittest import TestCase, skipIf
+
+try:
+    from minipilot import async_log
+except ImportError:
+    async_log = None
+
+
+class ThreadFilter(logging.Filter):
+    """
+    Records threads the filter runs in and passes only records of the main thread.
+    """
+    def __init__(self):
+        logging.Filter.__init__(self)
+        self.threads = set()
+
+    def filter(self, record):
+        self.threads.add(threading.current_thread().name)
+        return record.threadName == threading.current_thread().name == "MainThread"
+
+
+@skipIf(async_log is None, "minipilot requirements are not installed")
+class TestAsyncHandler(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "test.log")
+        self.handler = async_log.AsyncFileHandler(self.path, 'w')
+        self.handler.setFormatter(logging.Formatter("%(levelname)s %(message)s"))
+        self.log = logging.getLogger("test.async_log")
+        self.log.propagate = False
+        self.log.setLevel(logging.DEBUG)
+        self.log.addHandler(self.handler)
+
+    def tearDown(self):
+        self.log.removeHandler(self.handler)
+        self.handler.close()
+        shutil.rmtree(self.dir)
+
+    def lines(self):
+        with open(self.path) as f:
+            return f.read().splitlines()
+
+    def test_order(self):
+        """ Records are written in order and are all in the file after flush """
+        for i in range(2000):
+            self.log.info("line %d", i)
+        self.handler.flush()
+        self.assertEqual(self.lines(), ["INFO line %d" % i for i in range(2000)])
+
+    def test_caller_context(self):
+        """ Filters and message arguments are evaluated in the calling thread """
+        f = ThreadFilter()
+        self.handler.addFilter(f)
+        values = [1]
+        self.log.info("values %s", values)
+        values.append(2)
+        thread = threading.Thread(target=self.log.info, args=("other thread",))
+        thread.start()
+        thread.join()
+        self.handler.flush()
+        self.assertEqual(self.lines(), ["INFO values [1]"])
+        self.assertEqual(f.threads, {"MainThread", thread.name})
+
+    def test_level(self):
+        """ Handler level applies, exceptions are formatted """
+        self.handler.setLevel(logging.WARNING)
+        self.log.info("skipped")
+        try:
+            raise ValueError("broken")
+        except ValueError:
+            self.log.exception("failed")
+        self.handler.flush()
+        lines = self.lines()
+        self.assertEqual(lines[0], "ERROR failed")
+        self.assertEqual(lines[-1], "ValueError: broken")
+
+    def test_close(self):
+        """ Closing handler writes everything queued """
+        self.log.warning("last words")
+        self.log.removeHandler(self.handler)
+        self.handler.close()
+        self.assertEqual(self.lines(), ["WARNING last words"])
+
+    def test_stop(self):
+        """ Stopped writer writes what is queued and ends """
+        writer = async_log.LogWriter()
+        writer.start()
+        for i in range(2000):
+            record = self.log.makeRecord(self.log.name, logging.INFO, "", 0, "line %d", (i,), None)
+            writer.put((self.handler.target, record))
+        writer.stop(10)
+        self.assertFalse(writer.is_alive())
+        self.assertEqual(self.lines(), ["INFO line %d" % i for i in range(2000)])
+
+    def test_exit(self):
+        """ Records queued at interpreter exit are written, without errors of the writer thread """
+        script = ("import logging\n"
+                  "from minipilot import async_log\n"
+                  "log = logging.getLogger()\n"
+                  "log.addHandler(async_log.AsyncFileHandler(%r, 'w'))\n"
+                  "for i in range(20000):\n"
+                  "    log.warning('line %%d', i)\n" % self.path)
+        env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(async_log.__file__)))
+        process = subprocess.Popen([sys.executable, "-c", script], env=env, stderr=subprocess.PIPE)
+        _, err = process.communicate()
+        self.assertEqual(process.returncode, 0)
+        self.assertEqual(err, b"")
+        self.assertEqual(self.lines(), ["line %d" % i for i in range(20000)])
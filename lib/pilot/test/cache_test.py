@@ -0,0 +1,79 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase, skipIf
+
+try:
+    from minipilot import cache
+except ImportError:
+    cache = None
+
+
+@skipIf(cache is None, "minipilot requirements are not installed")
+class TestFileCache(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.cache = cache.FileCache(os.path.join(self.dir, 'cache'), 25)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def make_file(self, name, size=10):
+        path = os.path.join(self.dir, name)
+        with open(path, 'wb') as f:
+            f.write(b'x' * size)
+        return path
+
+    def test_hit(self):
+        """ Stored file is fetched by scope, name and checksum """
+        self.cache.store('s', 'a', 'ad:1', self.make_file('a'))
+        dst = os.path.join(self.dir, 'a.copy')
+        self.assertTrue(self.cache.fetch('s', 'a', 'ad:1', dst))
+        with open(dst, 'rb') as f:
+            self.assertEqual(f.read(), b'x' * 10)
+        self.assertFalse(self.cache.fetch('s', 'a', 'ad:2', dst))
+        self.assertFalse(self.cache.fetch('t', 'a', 'ad:1', dst))
+
+    def test_no_checksum(self):
+        """ Files without checksum are not cached """
+        self.cache.store('s', 'a', None, self.make_file('a'))
+        self.assertEqual(self.cache.entries(), [])
+
+    def test_eviction(self):
+        """ Least recently used entries are evicted to fit the budget """
+        self.cache.store('s', 'a', 'ad:1', self.make_file('a'))
+        self.cache.store('s', 'b', 'ad:1', self.make_file('b'))
+        old = os.path.getmtime(self.cache.entry(self.cache.key('s', 'a', 'ad:1'))) - 100
+        for name in ('a', 'b'):
+            os.utime(self.cache.entry(self.cache.key('s', name, 'ad:1')), (old, old))
+        self.assertTrue(self.cache.fetch('s', 'a', 'ad:1', os.path.join(self.dir, 'a.copy')))
+
+        self.cache.store('s', 'c', 'ad:1', self.make_file('c'))
+        self.assertEqual(len(self.cache.entries()), 2)
+        self.assertFalse(self.cache.fetch('s', 'b', 'ad:1', os.path.join(self.dir, 'b.copy')))
+        self.assertTrue(self.cache.fetch('s', 'a', 'ad:1', os.path.join(self.dir, 'a.copy')))
+
+    def test_independent_copies(self):
+        """ Job files are writable and changing them does not change the cached entry """
+        src = self.make_file('a')
+        self.cache.store('s', 'a', 'ad:1', src)
+        dst = os.path.join(self.dir, 'a.copy')
+        self.assertTrue(self.cache.fetch('s', 'a', 'ad:1', dst))
+        for path in (src, dst):
+            with open(path, 'ab') as f:
+                f.write(b'y')
+        with open(self.cache.entry(self.cache.key('s', 'a', 'ad:1')), 'rb') as f:
+            self.assertEqual(f.read(), b'x' * 10)
+
+    def test_scans(self):
+        """ Cache is scanned on the first store and then only when it is estimated over budget """
+        scans = []
+        entries = self.cache.entries
+        self.cache.entries = lambda: scans.append(1) or entries()
+        self.cache.store('s', 'a', 'ad:1', self.make_file('a'))
+        self.cache.store('s', 'b', 'ad:1', self.make_file('b'))
+        self.assertEqual(len(scans), 1)
+        self.cache.store('s', 'c', 'ad:1', self.make_file('c'))
+        self.assertEqual(len(scans), 2)
+        self.assertEqual(self.cache.size, 20)
@@ -0,0 +1,39 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase, skipIf
+
+try:
+    from minipilot import checksum
+except ImportError:
+    checksum = None
+
+
+@skipIf(checksum is None, "minipilot requirements are not installed")
+class TestChecksum(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'file')
+        with open(self.path, 'wb') as f:
+            f.write(b'data\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_parse(self):
+        """ Algorithm is taken from prefix or guessed by length """
+        self.assertEqual(checksum.parse_checksum('ad:05A501A5'), ('ad', '05a501a5'))
+        self.assertEqual(checksum.parse_checksum('05a501a5'), ('ad', '05a501a5'))
+        self.assertEqual(checksum.parse_checksum('6137cde4893c59f76f005a8123d8e8e6'),
+                         ('md5', '6137cde4893c59f76f005a8123d8e8e6'))
+        self.assertEqual(checksum.parse_checksum('sha:1'), (None, '1'))
+
+    def test_verify(self):
+        """ Size and checksum mismatches are reported """
+        self.assertIsNone(checksum.verify_file(self.path, 'ad:05a501a5', 5))
+        self.assertIsNone(checksum.verify_file(self.path, 'md5:6137cde4893c59f76f005a8123d8e8e6'))
+        self.assertIsNone(checksum.verify_file(self.path))
+        self.assertIsNotNone(checksum.verify_file(self.path, 'ad:05a501a6'))
+        self.assertIsNotNone(checksum.verify_file(self.path, size=6))
+        self.assertIsNotNone(checksum.verify_file(self.path + '.missing'))
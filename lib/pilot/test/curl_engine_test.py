@@ -0,0 +1,95 @@
+import threading
+import time
+from unittest import TestCase, skipIf
+
+try:
+    import pycurl
+    from minipilot import curl_pool, curl_engine
+    from pilot.test.curl_pool_test import make_server
+except ImportError:
+    curl_engine = None
+
+
+class FailingMulti(object):
+    """
+    CurlMulti whose perform fails.
+    """
+    def __init__(self, multi):
+        self.multi = multi
+
+    def perform(self):
+        raise ValueError("injected failure")
+
+    def __getattr__(self, name):
+        return getattr(self.multi, name)
+
+
+@skipIf(curl_engine is None, "minipilot requirements are not installed")
+class TestCurlEngine(TestCase):
+
+    def setUp(self):
+        self.server = make_server(delay=0.5)
+        self.url = "http://127.0.0.1:%d" % self.server.server_address[1]
+        self.pool = curl_pool.CurlPool(lambda **kwargs: pycurl.Curl())
+        self.engine = curl_engine.CurlEngine(self.pool)
+
+    def tearDown(self):
+        self.engine.stop()
+        if self.engine.is_alive():
+            self.engine.join(5)
+        self.pool.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_concurrent(self):
+        """ Queries are in flight at once """
+        start = time.time()
+        handles = [self.engine.submit(self.url + "/%d" % i) for i in range(10)]
+        handles.append(self.engine.submit(self.url + "/post", body="data"))
+        self.assertEqual([h.result(5) for h in handles], ["/%d" % i for i in range(10)] + ["data"])
+        self.assertLess(time.time() - start, 1.5)
+
+    def test_response(self):
+        """ Status and headers of the response are available, request headers are sent """
+        handle = self.engine.submit(self.url + "/a", headers=["X-Test: 1"])
+        self.assertEqual(handle.result(5), "/a")
+        self.assertEqual(handle.status, 200)
+        self.assertEqual(handle.headers['content-length'], '2')
+
+    def test_reuse(self):
+        """ Connections of finished queries are reused """
+        for i in range(3):
+            self.assertEqual(self.engine.query(self.url + "/%d" % i), "/%d" % i)
+        self.assertEqual(self.server.connections, 1)
+
+    def test_callback(self):
+        """ Callbacks are called on completion, also when added after it """
+        results = []
+        finished = threading.Event()
+        handle = self.engine.submit(self.url + "/a")
+        handle.add_done_callback(lambda h: (results.append(h.result()), finished.set()))
+        self.assertTrue(finished.wait(5))
+        handle.add_done_callback(lambda h: results.append(h.result()))
+        self.assertEqual(results, ["/a", "/a"])
+
+    def test_failure(self):
+        """ Failed query raises pycurl.error from result """
+        handle = self.engine.submit("http://127.0.0.1:1/")
+        self.assertRaises(pycurl.error, handle.result, 5)
+        self.assertEqual(sum(len(h) for h in self.pool.idle.values()), 0)
+
+    def test_stop(self):
+        """ Stopped engine finishes queries in flight and refuses new ones """
+        handle = self.engine.submit(self.url + "/a")
+        self.engine.stop()
+        self.assertEqual(handle.result(5), "/a")
+        self.assertRaises(RuntimeError, self.engine.submit, self.url + "/b")
+
+    def test_engine_failure(self):
+        """ Failure of the engine thread finishes queries with its error and refuses new ones """
+        self.engine.multi = FailingMulti(self.engine.multi)
+        handle = self.engine.submit(self.url + "/a")
+        self.assertRaises(ValueError, handle.result, 5)
+        self.engine.join(5)
+        self.assertFalse(self.engine.is_alive())
+        self.assertRaises(RuntimeError, self.engine.submit, self.url + "/b")
@@ -0,0 +1,85 @@
+import threading
+import time
+from unittest import TestCase, skipIf
+
+try:
+    import BaseHTTPServer
+    import SocketServer
+    import pycurl
+    from minipilot import curl_pool
+except ImportError:
+    curl_pool = None
+
+
+def make_server(delay=0):
+    """
+    :param delay: seconds to wait before every response.
+    :return: local keep-alive HTTP server, echoing paths of GET and bodies of POST queries and counting connections.
+    """
+    class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def setup(self):
+            BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+            self.server.connections += 1
+
+        def reply(self, body):
+            time.sleep(delay)
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):  # NOQA: N802
+            self.reply(self.path)
+
+        def do_POST(self):  # NOQA: N802
+            self.reply(self.rfile.read(int(self.headers['Content-Length'])))
+
+        def log_message(self, *args):
+            pass
+
+    class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+        daemon_threads = True
+        request_queue_size = 64
+        connections = 0
+
+    server = Server(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+@skipIf(curl_pool is None, "minipilot requirements are not installed")
+class TestCurlPool(TestCase):
+
+    def setUp(self):
+        self.server = make_server()
+        self.url = "http://127.0.0.1:%d" % self.server.server_address[1]
+        self.pool = curl_pool.CurlPool(lambda **kwargs: pycurl.Curl())
+
+    def tearDown(self):
+        self.pool.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_reuse(self):
+        """ Sequential queries share one connection """
+        self.assertEqual(self.pool.query(self.url + "/a"), "/a")
+        self.assertEqual(self.pool.query(self.url + "/b", body="data"), "data")
+        self.assertEqual(self.pool.query(self.url + "/c"), "/c")
+        self.assertEqual(self.server.connections, 1)
+
+    def test_kinds(self):
+        """ Handles of different kinds are not mixed """
+        c = self.pool.acquire(ssl=True)
+        self.pool.release(c)
+        self.assertIs(self.pool.acquire(ssl=True), c)
+        self.assertIsNot(self.pool.acquire(ssl=False), c)
+
+    def test_failure(self):
+        """ Failed handle is not returned to the pool """
+        with self.assertRaises(pycurl.error):
+            self.pool.query("http://127.0.0.1:1/")
+        self.assertEqual(sum(len(h) for h in self.pool.idle.values()), 0)
@@ -0,0 +1,66 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase, skipIf
+
+try:
+    from minipilot import hardware
+except ImportError:
+    hardware = None
+
+
+@skipIf(hardware is None, "minipilot requirements are not installed")
+class TestHardwareCache(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.boot_id = os.path.join(self.dir, "boot_id")
+        self.set_boot("boot-1")
+        self.saved_boot_id, hardware.BOOT_ID = hardware.BOOT_ID, self.boot_id
+        self.probes = 0
+        self.cache = hardware.HardwareCache(os.path.join(self.dir, "hardware.json"), self.probe)
+
+    def tearDown(self):
+        hardware.BOOT_ID = self.saved_boot_id
+        shutil.rmtree(self.dir)
+
+    def set_boot(self, boot):
+        with open(self.boot_id, 'w') as f:
+            f.write(boot + "\n")
+
+    def probe(self):
+        self.probes += 1
+        return {'cpu': 2400., 'cpu_model': "Test CPU", 'mem': 16384., 'probe': self.probes}
+
+    def test_cached(self):
+        """ Facts are probed once per boot, also by another pilot """
+        self.assertEqual(self.cache.static()['probe'], 1)
+        self.assertEqual(self.cache.static()['probe'], 1)
+        other = hardware.HardwareCache(self.cache.path, self.probe)
+        self.assertEqual(other.static(), {'cpu': 2400., 'cpu_model': "Test CPU", 'mem': 16384., 'probe': 1})
+        self.assertEqual(self.probes, 1)
+
+    def test_reboot(self):
+        """ Facts are probed again after a reboot """
+        self.cache.static()
+        self.set_boot("boot-2")
+        self.assertEqual(self.cache.static()['probe'], 2)
+        self.assertEqual(self.cache.static()['probe'], 2)
+
+    def test_no_boot_id(self):
+        """ Without boot ID, facts are not cached """
+        os.remove(self.boot_id)
+        self.cache.static()
+        self.cache.static()
+        self.assertEqual(self.probes, 2)
+        self.assertFalse(os.path.exists(self.cache.path))
+
+    def test_broken_cache(self):
+        """ Broken or unwritable cache does not stop probing """
+        with open(self.cache.path, 'w') as f:
+            f.write("{broken")
+        self.assertEqual(self.cache.static()['probe'], 1)
+        self.assertEqual(self.cache.static()['probe'], 1)
+
+        cache = hardware.HardwareCache(os.path.join(self.dir, "missing", "hardware.json"), self.probe)
+        self.assertEqual(cache.static()['probe'], 2)
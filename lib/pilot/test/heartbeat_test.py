@@ -0,0 +1,79 @@
+import sys
+import logging
+import time
+from unittest import TestCase, skipIf
+
+try:
+    import psutil
+    from minipilot import heartbeat
+except ImportError:
+    heartbeat = None
+
+
+class FakeJob(object):
+    log = logging.getLogger("test.heartbeat")
+
+    def __init__(self):
+        self.heartbeats = []
+
+    def heartbeat(self, metrics):
+        self.heartbeats.append(metrics)
+
+
+@skipIf(heartbeat is None, "minipilot requirements are not installed")
+class TestHeartbeat(TestCase):
+
+    def setUp(self):
+        self.child = psutil.Popen(['sh', '-c', 'sleep 5 & sleep 5 & wait'])
+        time.sleep(0.2)
+
+    def tearDown(self):
+        for p in self.child.children(recursive=True):
+            p.kill()
+        self.child.kill()
+        self.child.wait()
+
+    def test_sample_tree(self):
+        """ Whole payload tree is sampled """
+        sample = heartbeat.sample_tree(self.child)
+        self.assertEqual(sample['processes'], 3)
+        self.assertGreater(sample['rss'], 0)
+        self.assertGreater(sample['pss'], 0)
+        self.assertGreaterEqual(sample['cpu_time'], 0)
+
+    def test_heartbeats(self):
+        """ Heartbeats are sent periodically until stopped """
+        job = FakeJob()
+        h = heartbeat.Heartbeat(job, 0.1)
+        h(self.child)
+        time.sleep(0.55)
+        h.stop()
+        count = len(job.heartbeats)
+        self.assertTrue(3 <= count <= 5, count)
+        self.assertEqual(job.heartbeats[-1]['processes'], 3)
+        self.assertGreaterEqual(h.metrics['max_rss'], h.metrics['rss'])
+        time.sleep(0.2)
+        self.assertEqual(len(job.heartbeats), count)
+
+    def test_gone(self):
+        """ Finished payload gives an empty sample """
+        child = psutil.Popen(['true'])
+        child.wait()
+        self.assertEqual(heartbeat.sample_tree(child), {})
+
+    def test_peak_between_heartbeats(self):
+        """ Memory peak between heartbeats is in the maxima """
+        child = psutil.Popen([sys.executable, '-c', "import time; x = ' ' * 100 * 2 ** 20; time.sleep(0.4); "
+                                                    "del x; time.sleep(5)"])
+        try:
+            job = FakeJob()
+            h = heartbeat.Heartbeat(job, 1, sample_interval=0.1)
+            h(child)
+            time.sleep(1.3)
+            h.stop()
+        finally:
+            child.kill()
+            child.wait()
+        self.assertEqual(len(job.heartbeats), 1)
+        self.assertGreater(job.heartbeats[0]['max_rss'], 100 * 1024)
+        self.assertLess(job.heartbeats[0]['rss'], 100 * 1024)
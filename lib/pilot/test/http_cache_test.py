@@ -0,0 +1,99 @@
+import json
+import os
+import shutil
+import tempfile
+from unittest import TestCase, skipIf
+
+try:
+    from minipilot import http_cache
+except ImportError:
+    http_cache = None
+
+URL = "http://agis.example.com/queuedata?queue=TEST"
+
+
+class FakeServer(object):
+    """
+    Fetch function answering with the queued responses and recording request headers.
+    """
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def __call__(self, url, headers):
+        self.requests.append(headers)
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+@skipIf(http_cache is None, "minipilot requirements are not installed")
+class TestHTTPCache(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.cache = http_cache.HTTPCache(os.path.join(self.dir, 'cache'), 60)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def expire(self):
+        entry = self.cache.load(URL)
+        entry['fetched'] -= 120
+        self.cache.store(entry)
+
+    def test_ttl(self):
+        """ Fresh document is served without queries """
+        server = FakeServer((200, {'etag': '"v1"'}, '{"v": 1}'))
+        self.assertEqual(self.cache.get(URL, server, json.loads), '{"v": 1}')
+        self.assertEqual(self.cache.get(URL, server, json.loads), '{"v": 1}')
+        self.assertEqual(server.requests, [[]])
+
+    def test_conditional(self):
+        """ Expired document is refreshed conditionally """
+        server = FakeServer((200, {'etag': '"v1"', 'last-modified': 'Mon, 01 Jan 2018 00:00:00 GMT'}, '{"v": 1}'),
+                            (304, {}, ''), (200, {}, '{"v": 2}'))
+        self.cache.get(URL, server)
+        self.expire()
+        self.assertEqual(self.cache.get(URL, server), '{"v": 1}')
+        self.assertEqual(server.requests[1], ['If-None-Match: "v1"',
+                                              'If-Modified-Since: Mon, 01 Jan 2018 00:00:00 GMT'])
+        self.assertTrue(self.cache.fresh(self.cache.load(URL)))
+        self.expire()
+        self.assertEqual(self.cache.get(URL, server), '{"v": 2}')
+        self.assertEqual(self.cache.get(URL, server), '{"v": 2}')
+        self.assertEqual(len(server.requests), 3)
+
+    def test_stale(self):
+        """ Stale document is served if the server fails or answers with garbage """
+        server = FakeServer((200, {}, '{"v": 1}'), IOError("unreachable"), (500, {}, ''), (200, {}, '<html>'))
+        self.cache.get(URL, server, json.loads)
+        for _ in range(3):
+            self.expire()
+            self.assertEqual(self.cache.get(URL, server, json.loads), '{"v": 1}')
+        self.assertEqual(len(server.requests), 4)
+
+    def test_no_entry(self):
+        """ Failure without cached document is raised """
+        self.assertRaises(IOError, self.cache.get, URL, FakeServer(IOError("unreachable")))
+        self.assertRaises(ValueError, self.cache.get, URL, FakeServer((200, {}, '<html>')), json.loads)
+        self.assertIsNone(self.cache.load(URL))
+
+    def test_broken_cache(self):
+        """ Cache that can not be written or locked does not stop queries """
+        path = os.path.join(self.dir, 'file')
+        open(path, 'w').close()
+        cache = http_cache.HTTPCache(path, 60)
+        server = FakeServer((200, {}, '{"v": 1}'), (200, {}, '{"v": 2}'))
+        self.assertEqual(cache.get(URL, server, json.loads), '{"v": 1}')
+        self.assertEqual(cache.get(URL, server, json.loads), '{"v": 2}')
+
+        server = FakeServer((200, {}, '{"v": 1}'), IOError("unreachable"), (200, {}, '{"v": 3}'))
+        self.cache.get(URL, server)
+        os.remove(self.cache.entry(URL) + ".lock")
+        os.mkdir(self.cache.entry(URL) + ".lock")
+        self.expire()
+        self.assertEqual(self.cache.get(URL, server), '{"v": 1}')
+        self.assertEqual(self.cache.get(URL, server), '{"v": 3}')
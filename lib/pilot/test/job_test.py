@@ -0,0 +1,317 @@
+import os
+import logging
+import shutil
+import tarfile
+import tempfile
+import time
+from unittest import TestCase, skipIf
+
+try:
+    from minipilot import pilot, job, mover
+except ImportError:
+    pilot = None
+
+FAKE_RUCIO = """#!/bin/sh
+# Fake rucio: logs its calls, "downloads" files and fails on files containing "bad" in their names. Uploads of "slow"
+# files take a second.
+echo "$@" >> "$RUCIO_CALLS"
+rc=0
+case "$1" in
+download)
+    shift 2
+    for did in "$@"; do
+        case "$did" in
+        *bad*) rc=1 ;;
+        *) echo data > "${did#*:}" ;;
+        esac
+    done ;;
+upload)
+    shift 5
+    for f in "$@"; do
+        case "$f" in
+        *bad*) rc=1 ;;
+        *slow*) sleep 1; [ -f job.log.tgz ] && echo "$f: log archive exists" >> "$RUCIO_CALLS" ;;
+        esac
+    done ;;
+esac
+exit $rc
+"""
+
+
+def file_description(scope, se="SE"):
+    return {'scope': scope, 'storage_element': se, 'checksum': None, 'size': None}
+
+
+@skipIf(pilot is None, "minipilot requirements are not installed")
+class JobTestCase(TestCase):
+    """
+    Runs each test in a temporary directory with a fake rucio in PATH.
+    """
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.path = os.environ['PATH']
+        self.dir = tempfile.mkdtemp()
+        os.chdir(self.dir)
+
+        with open('rucio', 'w') as f:
+            f.write(FAKE_RUCIO)
+        os.chmod('rucio', 0o755)
+        os.environ['PATH'] = self.dir + os.pathsep + self.path
+        os.environ['RUCIO_CALLS'] = os.path.join(self.dir, 'calls')
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        os.environ['PATH'] = self.path
+        shutil.rmtree(self.dir)
+
+    def make_job(self, args=None, queuedata=None, **description):
+        p = pilot.Pilot()
+        p.argv = ['pilot.py', '--no_job_update'] + (args or [])
+        p.args = p.argParser.parse_args(p.argv[1:])
+        p.init_after_arguments()
+        p.queuedata = queuedata
+        desc = {'job_id': 1, 'command': 'true', 'command_parameters': '', 'log_file': 'job.log.tgz',
+                'input_files': {}, 'output_files': {}}
+        desc.update(description)
+        return job.Job(p, desc)
+
+    def calls(self):
+        if not os.path.isfile('calls'):
+            return []
+        with open('calls') as f:
+            return f.read().splitlines()
+
+
+class TestBatches(JobTestCase):
+
+    def test_grouping(self):
+        """ Files are grouped by keys and split by transfer_batch """
+        j = self.make_job(['--transfer_batch', '2'], input_files={
+            'a': file_description('s1'), 'b': file_description('s1'), 'c': file_description('s1'),
+            'd': file_description('s2')
+        })
+        self.assertEqual(sorted(j.batches(j.input_files, ['scope'])), [('a', 'b'), ('c',), ('d',)])
+
+    def test_stage_in(self):
+        """ One rucio call per scope, per-file results """
+        j = self.make_job(input_files={
+            'a': file_description('s1'), 'b': file_description('s1'), 'bad': file_description('s1'),
+            'd': file_description('s2')
+        })
+        j.stage_in()
+        self.assertEqual(sorted(self.calls()), ['download --no-subdir s1:a s1:b s1:bad', 'download --no-subdir s2:d',
+                                                'whoami'])
+        self.assertEqual(dict((f, r[0]) for f, r in j.stage_in_results.items()), {'a': 0, 'b': 0, 'bad': 1, 'd': 0})
+
+    def test_stage_out_batch(self):
+        """ Failed batch upload is retried file by file """
+        j = self.make_job(output_files={
+            'a': file_description('s1'), 'b': file_description('s1'), 'bad': file_description('s1'),
+            'missing': file_description('s1')
+        })
+        for f in ('a', 'b', 'bad'):
+            open(f, 'w').close()
+        results = j.stage_out_batch(('a', 'b', 'bad', 'missing'))
+        self.assertEqual(self.calls(), ['upload --rse SE --scope s1 a b bad', 'upload --rse SE --scope s1 a',
+                                        'upload --rse SE --scope s1 b', 'upload --rse SE --scope s1 bad'])
+        self.assertEqual(dict((f, r[0]) for f, r in results.items()), {'a': 0, 'b': 0, 'bad': 1, 'missing': None})
+
+    def test_cache(self):
+        """ Second stage in of the same file is served from cache """
+        inputs = {'a': dict(file_description('s1'), checksum='ad:05a501a5')}
+        self.make_job(['--cache_dir', 'cache'], input_files=inputs).stage_in()
+        os.remove('a')
+        j = self.make_job(['--cache_dir', 'cache'], input_files=inputs)
+        j.stage_in()
+        self.assertEqual(self.calls(), ['whoami', 'download --no-subdir s1:a', 'whoami'])
+        self.assertEqual(j.stage_in_results['a'][0], 0)
+        self.assertTrue(os.path.isfile('a'))
+
+    def test_verification(self):
+        """ Corrupted files are downloaded again and fail if they stay corrupted """
+        j = self.make_job(input_files={
+            'good': dict(file_description('s1'), checksum='ad:05a501a5', size=5),
+            'md5': dict(file_description('s2'), checksum='md5:6137cde4893c59f76f005a8123d8e8e6'),
+            'corrupted': dict(file_description('s3'), checksum='ad:0123abcd')
+        })
+        j.stage_in()
+        self.assertEqual(sorted(self.calls()), ['download --no-subdir s1:good', 'download --no-subdir s2:md5',
+                                                'download --no-subdir s3:corrupted',
+                                                'download --no-subdir s3:corrupted', 'whoami'])
+        self.assertEqual(dict((f, r[0]) for f, r in j.stage_in_results.items()), {'good': 0, 'md5': 0, 'corrupted': 1})
+        self.assertFalse(os.path.exists('corrupted'))
+
+    def test_simulated(self):
+        """ Simulated files are not verified """
+        j = self.make_job(['--simulate_rucio'], input_files={
+            'a': dict(file_description('s1'), checksum='ad:0123abcd', size=1000)
+        })
+        j.stage_in()
+        self.assertEqual(j.stage_in_results['a'][0], 0)
+        self.assertTrue(os.path.isfile('a'))
+
+
+class TestStageOut(JobTestCase):
+
+    def test_stage_out(self):
+        """ Outputs are uploaded in parallel while the log is archived, failures are in the uploaded log """
+        j = self.make_job(output_files={
+            'slow1': file_description('s1'), 'slow2': file_description('s2'), 'bad': file_description('s3'),
+            'job.log.tgz': file_description('s4')
+        })
+        for f in ('slow1', 'slow2', 'bad'):
+            open(f, 'w').close()
+        start = time.time()
+        j.stage_out()
+        self.assertLess(time.time() - start, 1.9)
+
+        calls = self.calls()
+        self.assertEqual(calls[-1], 'upload --rse SE --scope s4 job.log.tgz')
+        self.assertIn('slow1: log archive exists', calls)
+        self.assertIn('slow2: log archive exists', calls)
+        self.assertEqual(dict((f, r[0]) for f, r in j.stage_out_results.items()),
+                         {'slow1': 0, 'slow2': 0, 'bad': 1, 'job.log.tgz': 0})
+        with tarfile.open('job.log.tgz') as tar:
+            log = tar.extractfile(j.log_file).read().decode()
+        self.assertIn("Failed to upload bad (exit code 1)", log)
+
+
+class TestLocalMover(JobTestCase):
+
+    def test_round_trip(self):
+        """ Local mover downloads from and uploads to storage directory """
+        os.makedirs(os.path.join('storage', 's1'))
+        with open(os.path.join('storage', 's1', 'a'), 'w') as f:
+            f.write('input')
+        j = self.make_job(['--mover', 'local', '--local_storage', 'storage'],
+                          input_files={'a': file_description('s1'), 'b': file_description('s1')},
+                          output_files={'out': file_description('s2')})
+        j.stage_in()
+        self.assertEqual(dict((f, r[0]) for f, r in j.stage_in_results.items()), {'a': 0, 'b': 1})
+        with open('a') as f:
+            self.assertEqual(f.read(), 'input')
+
+        with open('out', 'w') as f:
+            f.write('output')
+        self.assertEqual(j.stage_out_file('out')[0], 0)
+        with open(os.path.join('storage', 's2', 'out')) as f:
+            self.assertEqual(f.read(), 'output')
+
+    def test_queuedata(self):
+        """ Local mover is selected by queuedata """
+        j = self.make_job(queuedata={'copytool': 'local', 'local_storage': '/mnt/se'})
+        self.assertIsInstance(j.mover, mover.LocalMover)
+        self.assertEqual(j.mover.storage, '/mnt/se')
+        j = self.make_job(['--mover', 'rucio'], queuedata={'copytool': 'local'})
+        self.assertIsInstance(j.mover, mover.RucioCLIMover)
+
+
+class TestMultiJob(JobTestCase):
+
+    def make_pilot(self, args, descriptions):
+        p = pilot.Pilot()
+        p.argv = ['pilot.py', '--no_job_update', '--simulate_rucio'] + args
+        p.args = p.argParser.parse_args(p.argv[1:])
+        p.init_after_arguments()
+        descriptions = list(descriptions)
+
+        def get_job_description():
+            return descriptions.pop(0)
+        p.get_job_description = get_job_description
+        return p
+
+    def test_jobs(self):
+        """ Jobs run in their own directories, a failed job does not stop the loop """
+        descriptions = [{'job_id': i, 'command': command, 'command_parameters': '', 'log_file': 'job.log.tgz',
+                         'input_files': {'in%d' % i: file_description('s1')},
+                         'output_files': {'job.log.tgz': file_description('s2')}}
+                        for i, command in enumerate(['true', './missing', 'true', 'true'])]
+        p = self.make_pilot(['--max_jobs', '3'], descriptions)
+        p.run_jobs()
+        self.assertEqual(p.jobs_got, 3)
+        dirs = sorted(d for d in os.listdir('.') if d.startswith('job_'))
+        self.assertEqual([d.split('.')[0] for d in dirs], ['job_0', 'job_1', 'job_2'])
+        for i, d in enumerate(dirs):
+            self.assertTrue(os.path.isfile(os.path.join(d, 'in%d' % i)))
+            self.assertEqual(os.path.isfile(os.path.join(d, 'job.log.tgz')), i != 1)
+            with open(os.path.join(d, 'job.log')) as f:
+                self.assertEqual("Job 1 failed to run" in f.read(), i == 1)
+
+    def test_environment_report(self):
+        """ Environment report is computed once for all job logs """
+        descriptions = [{'job_id': i, 'command': 'true', 'command_parameters': '', 'log_file': 'job.log.tgz',
+                         'input_files': {}, 'output_files': {'job.log.tgz': file_description('s2')}}
+                        for i in range(2)]
+        p = self.make_pilot(['--max_jobs', '2'], descriptions)
+        scans = []
+        scan_requirements = p.scan_requirements
+        p.scan_requirements = lambda: scans.append(1) or scan_requirements()
+        p.run_jobs()
+        self.assertEqual(p.jobs_got, 2)
+        self.assertEqual(len(scans), 1)
+        report = p.environment_report()
+        self.assertIs(p.environment_report(), report)
+        self.assertIn((logging.INFO, "Pilot ID: " + p.pilot_id), report)
+        self.assertTrue(any(message.startswith("psutil (") for level, message in report))
+
+    def test_queuedata_overrides(self):
+        """ Queuedata modifications of a job do not leak into the next one """
+        descriptions = [{'job_id': i, 'command': 'true', 'command_parameters': params, 'log_file': 'job.log.tgz',
+                         'input_files': {}, 'output_files': {'job.log.tgz': file_description('s2')}}
+                        for i, params in enumerate(['--overwriteQueuedata k1=v1 --', ''])]
+        p = self.make_pilot(['--max_jobs', '2'], descriptions)
+        p.queuedata = {'k0': 'v0'}
+        jobs = []
+        get_job = p.get_job
+        p.get_job = lambda: jobs.append(get_job()) or jobs[-1]
+        p.run_jobs()
+        self.assertEqual([j.queuedata for j in jobs], [{'k0': 'v0', 'k1': 'v1'}, {'k0': 'v0'}])
+        self.assertEqual(p.queuedata, {'k0': 'v0'})
+
+    def test_wall_time(self):
+        """ No job is started after wall time is over """
+        descriptions = [{'job_id': i, 'command': 'sleep', 'command_parameters': '1', 'log_file': 'job.log.tgz',
+                         'input_files': {}, 'output_files': {'job.log.tgz': file_description('s2')}}
+                        for i in range(3)]
+        p = self.make_pilot(['--max_jobs', '0', '--wall_time', '1'], descriptions)
+        p.run_jobs()
+        self.assertEqual(p.jobs_got, 1)
+
+    def test_concurrent_jobs(self):
+        """ Jobs fitting into the node run at once, each in its own directory """
+        descriptions = [{'job_id': i, 'command': 'sleep', 'command_parameters': '1', 'log_file': 'job.log.tgz',
+                         'cores_number': 2, 'input_files': {},
+                         'output_files': {'job.log.tgz': file_description('s2')}} for i in range(3)]
+        p = self.make_pilot(['--max_jobs', '3', '--concurrent_jobs', '0', '--node_cores', '4'], descriptions)
+        fetched = []
+        get_job_description = p.get_job_description
+        p.get_job_description = lambda: fetched.append(time.time()) or get_job_description()
+        start = time.time()
+        p.run_slots()
+        self.assertGreater(time.time() - start, 2)
+        self.assertLess(time.time() - start, 3)
+        self.assertGreater(fetched[2] - start, 1)  # the third job is fetched when cores are freed
+        dirs = sorted(d for d in os.listdir('.') if d.startswith('job_'))
+        self.assertEqual([d.split('.')[0] for d in dirs], ['job_0', 'job_1', 'job_2'])
+        for d in dirs:
+            self.assertTrue(os.path.isfile(os.path.join(d, 'job.log.tgz')))
+
+
+class TestPayload(JobTestCase):
+
+    def test_heartbeat(self):
+        """ Payload metrics are sampled while it runs """
+        j = self.make_job(['--heartbeat_interval', '1'], command='sleep', command_parameters='1.5')
+        j.payload_run()
+        self.assertEqual(j.error_code, 0)
+        self.assertEqual(j.metrics['processes'], 1)
+        self.assertGreater(j.metrics['max_rss'], 0)
+
+    def test_stream(self):
+        """ Streamed payload output is in the job log, whatever the job log level """
+        j = self.make_job(['--payload_output', 'stream'], command='echo', command_parameters='hello payload')
+        j.payload_run()
+        j.log_handler.flush()
+        with open(j.path(j.log_file)) as f:
+            self.assertIn("Job stdout: hello payload\n", f.read())
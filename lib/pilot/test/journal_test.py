@@ -0,0 +1,76 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase, skipIf
+
+try:
+    from minipilot import journal, reporter
+    from pilot.test.reporter_test import FakeJob
+except ImportError:
+    journal = None
+
+
+@skipIf(journal is None, "minipilot requirements are not installed")
+class TestStateJournal(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'journal')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_replay(self):
+        """ Latest undelivered update of every job survives reopening """
+        j = journal.StateJournal(self.path)
+        j.append('1', {'state': 'starting'})
+        seq = j.append('1', {'state': 'running'})
+        j.append('2', {'state': 'starting'})
+        j.delivered('2', j.append('2', {'state': 'running'}))
+        j.append('3', {'state': 'holding'})
+        j.delivered('1', seq - 1)
+        j.close()
+        with open(self.path, 'a') as f:
+            f.write('{"key": "3", "seq": 9, "deliv')  # torn write
+
+        j = journal.StateJournal(self.path)
+        self.assertEqual(j.pending, {'1': (seq, {'state': 'running'}), '3': (5, {'state': 'holding'})})
+        with open(self.path) as f:
+            self.assertEqual(len(f.readlines()), 2)
+        self.assertEqual(j.append('4', {'state': 'starting'}), 6)
+        j.close()
+
+    def test_truncate(self):
+        """ Journal is emptied when everything is delivered """
+        j = journal.StateJournal(self.path)
+        j.delivered('1', j.append('1', {'state': 'finished'}))
+        self.assertEqual(os.path.getsize(self.path), 0)
+        j.close()
+
+    def test_reporter(self):
+        """ Reporter keeps updates in journal until they are delivered """
+        j = journal.StateJournal(self.path)
+        r = reporter.StateReporter(backoff=10, journal=j)
+        good, bad = FakeJob(1), FakeJob(2, failures=100)
+        r.report(good, {'state': 'finished'})
+        r.report(bad, {'state': 'finished'})
+        self.assertTrue(r.flush(good, 5))
+        self.assertFalse(r.flush(bad, 0.2))
+        j.close()
+        self.assertEqual(list(journal.StateJournal(self.path).pending), ['2'])
+
+    def test_heartbeat_after_failure(self):
+        """ Journaled update replaced by a heartbeat while failing is acknowledged by the heartbeat delivery """
+        j = journal.StateJournal(self.path)
+        r = reporter.StateReporter(backoff=0.1, journal=j)
+        job = FakeJob(1, failures=1)
+        job.gate.clear()
+        r.report(job, {'state': 'running'})
+        self.assertTrue(job.entered.wait(5))
+        r.report(job, {'state': 'running', 'heartbeat': True}, durable=False)
+        job.gate.set()
+        self.assertTrue(r.flush(job, 5))
+        r.stop(5)
+        self.assertEqual(job.attempts, 2)
+        j.close()
+        self.assertEqual(journal.StateJournal(self.path).pending, {})
@@ -0,0 +1,47 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase, skipIf
+
+try:
+    from minipilot import metadata
+except ImportError:
+    metadata = None
+
+
+@skipIf(metadata is None, "minipilot requirements are not installed")
+class TestMetadata(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, path, version):
+        path = os.path.join(self.dir, path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write("Metadata-Version: 2.1\nName: x\nVersion: %s\n\nDescription mentioning\nVersion: 0\n" % version)
+
+    def test_requirement_names(self):
+        """ Names are parsed from requirement lines, comments and options are skipped """
+        text = "pip>=7.1\n# comment\n\n-r other.txt\npy-cpuinfo  # inline\npsutil >= 4.1; python_version < '3'\n"
+        self.assertEqual(metadata.requirement_names(text), ['pip', 'py-cpuinfo', 'psutil'])
+
+    def test_versions(self):
+        """ Versions are read from dist-info, egg-info and egg metadata, in path order """
+        self.write(os.path.join("a", "py_cpuinfo-5.0.0.dist-info", "METADATA"), "5.0.0")
+        self.write(os.path.join("a", "psutil-4.1.0-py2.7.egg-info"), "4.1.0")
+        self.write(os.path.join("a", "pycurl-7.43.0-py2.7.egg-info", "PKG-INFO"), "7.43.0")
+        self.write(os.path.join("b", "pycurl-7.19.0-py2.7.egg", "EGG-INFO", "PKG-INFO"), "7.19.0")
+        self.write(os.path.join("b", "Pip-9.0.3.dist-info", "METADATA"), "9.0.3")
+        paths = [os.path.join(self.dir, "missing"), os.path.join(self.dir, "a"), os.path.join(self.dir, "b")]
+
+        self.assertEqual(metadata.installed_version("py-cpuinfo", paths), "5.0.0")
+        self.assertEqual(metadata.installed_version("psutil", paths), "4.1.0")
+        self.assertEqual(metadata.installed_version("pycurl", paths), "7.43.0")
+        self.assertEqual(metadata.installed_version("pycurl", paths[2:]), "7.19.0")
+        self.assertEqual(metadata.installed_version("pip", paths), "9.0.3")
+        self.assertIsNone(metadata.installed_version("argparse", paths))
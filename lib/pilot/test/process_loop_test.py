@@ -0,0 +1,82 @@
+import os
+import time
+import shutil
+import tempfile
+import threading
+from unittest import TestCase, skipIf
+
+try:
+    from minipilot import process_loop
+except ImportError:
+    process_loop = None
+
+
+class BrokenSink(object):
+    """
+    Sink failing on the first write.
+    """
+    def write(self, data):
+        raise IOError("disk full")
+
+    def flush(self):
+        pass
+
+
+@skipIf(process_loop is None, "minipilot requirements are not installed")
+class TestProcessLoop(TestCase):
+
+    def setUp(self):
+        self.loop = process_loop.ProcessLoop()
+        self.loop.start()
+
+    def tearDown(self):
+        self.loop.stop()
+        self.loop.join(5)
+
+    def test_many_children(self):
+        """ Children run concurrently in one thread and each one gets its own output """
+        threads = threading.active_count()
+        start = time.time()
+        handles = [self.loop.submit(['sh', '-c', 'sleep 1; echo %d; echo e%d >&2' % (i, i)]) for i in range(10)]
+        self.assertEqual(threading.active_count(), threads)
+        for i, h in enumerate(handles):
+            self.assertEqual(h.result(5), (0, b'%d\n' % i, b'e%d\n' % i))
+        self.assertLess(time.time() - start, 3)
+
+    def test_deadline(self):
+        """ Each child has its own deadline """
+        slow = self.loop.submit(['sleep', '10'], timeout=0.5)
+        fast = self.loop.submit(['sleep', '0.1'], timeout=5)
+        self.assertEqual(fast.result(5)[0], 0)
+        self.assertEqual(slow.result(5)[0], -15)
+
+    def test_callback(self):
+        """ Done callbacks are fired with the handle """
+        done = []
+        h = self.loop.submit(['true'])
+        h.add_done_callback(done.append)
+        h.wait(5)
+        self.assertEqual(done, [h])
+
+    def test_redirected(self):
+        """ Child writing into files is not polled faster than TICK """
+        d = tempfile.mkdtemp()
+        try:
+            with open(os.path.join(d, 'out'), 'w') as out:
+                h = self.loop.submit(['sh', '-c', 'echo out; sleep 1'], stdout=out, stderr=out)
+                time.sleep(0.3)
+                self.assertEqual(self.loop.poll_timeout(), process_loop.TICK * 1000)
+                self.assertEqual(h.result(5)[0], 0)
+            with open(os.path.join(d, 'out')) as f:
+                self.assertEqual(f.read(), 'out\n')
+        finally:
+            shutil.rmtree(d)
+
+    def test_failure(self):
+        """ Error of one child fails only its handle, the loop goes on """
+        broken = self.loop.submit(['sh', '-c', 'echo out; sleep 10'], stdout=BrokenSink())
+        rc, out, err = broken.result(5)
+        self.assertEqual(rc, process_loop.ERROR_CODE)
+        self.assertIn(b"disk full", err)
+        self.assertTrue(self.loop.is_alive())
+        self.assertEqual(self.loop.submit(['echo', 'ok']).result(5), (0, b'ok\n', b''))
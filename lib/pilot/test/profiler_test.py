@@ -0,0 +1,60 @@
+import os
+import sys
+import shutil
+import tempfile
+import subprocess
+from unittest import TestCase, skipIf
+
+try:
+    import minipilot
+    from minipilot import profiler
+except ImportError:
+    profiler = None
+
+try:
+    from minipilot import pilot
+except ImportError:
+    pilot = None
+
+
+@skipIf(profiler is None, "minipilot requirements are not installed")
+class TestProfiler(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.profiler = profiler.StartupProfiler()
+
+    def tearDown(self):
+        self.profiler.uninstall()
+        shutil.rmtree(self.dir)
+
+    def test_enable(self):
+        """ Profiling is enabled only by the command line flag """
+        self.assertIsNone(profiler.enable(["pilot.py", "--queue", "startup_profile"]))
+        self.assertIsNone(profiler.active)
+
+    def test_imports(self):
+        """ First imports and phases are recorded, and saved as JSON """
+        sys.modules.pop('colorsys', None)
+        self.profiler.install()
+        with self.profiler.phase("test"):
+            import colorsys  # NOQA: F401
+            import json
+        path = os.path.join(self.dir, "profile.json")
+        self.profiler.report(path, {'dns': (0., 0.5)})
+
+        self.assertEqual([i[0] for i in self.profiler.imports], ['colorsys'])
+        self.assertEqual([p[0] for p in self.profiler.phases], ['test'])
+        with open(path) as f:
+            profile = json.load(f)
+        self.assertEqual(profile['imports'][0]['name'], 'colorsys')
+        self.assertEqual(profile['steps']['dns']['seconds'], 0.5)
+
+    @skipIf(pilot is None, "minipilot requirements are not installed")
+    def test_lazy_imports(self):
+        """ Loading the pilot does not load its heavy dependencies """
+        loaded = subprocess.check_output([sys.executable, "-c",
+                                          "import sys; from minipilot import pilot; print(' '.join(m for m in "
+                                          "('pycurl', 'psutil', 'cpuinfo', 'pip') if m in sys.modules))"],
+                                         cwd=os.path.dirname(os.path.dirname(os.path.abspath(minipilot.__file__))))
+        self.assertEqual(loaded.strip(), b"")
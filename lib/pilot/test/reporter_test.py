@@ -0,0 +1,79 @@
+import logging
+import threading
+import time
+from unittest import TestCase, skipIf
+
+try:
+    from minipilot import reporter
+except ImportError:
+    reporter = None
+
+
+class FakeJob(object):
+    """
+    Job recording its updates. Sending blocks while gate is closed and fails while failures are left.
+    """
+    log = logging.getLogger("test.reporter")
+
+    def __init__(self, job_id=1, failures=0):
+        self.id = job_id
+        self.failures = failures
+        self.sent = []
+        self.attempts = 0
+        self.gate = threading.Event()
+        self.gate.set()
+        self.entered = threading.Event()
+
+    def post_state(self, data):
+        self.attempts += 1
+        self.entered.set()
+        self.gate.wait(5)
+        if self.failures > 0:
+            self.failures -= 1
+            raise IOError("server is down")
+        self.sent.append(data['state'])
+
+
+@skipIf(reporter is None, "minipilot requirements are not installed")
+class TestStateReporter(TestCase):
+
+    def setUp(self):
+        self.reporter = reporter.StateReporter(backoff=0.1, max_backoff=0.2)
+
+    def tearDown(self):
+        self.reporter.stop(5)
+
+    def test_coalescing(self):
+        """ Updates queued behind a slow one are coalesced to the latest """
+        job = FakeJob()
+        job.gate.clear()
+        start = time.time()
+        self.reporter.report(job, {'state': 'starting'})
+        self.assertTrue(job.entered.wait(5))
+        for state in ('stagein', 'running', 'holding'):
+            self.reporter.report(job, {'state': state})
+        self.assertLess(time.time() - start, 1)
+        job.gate.set()
+        self.assertTrue(self.reporter.flush(job, 5))
+        self.assertEqual(job.sent, ['starting', 'holding'])
+
+    def test_backoff(self):
+        """ Failed updates are retried with growing delays """
+        job = FakeJob(failures=3)
+        start = time.time()
+        self.reporter.report(job, {'state': 'finished'})
+        self.assertTrue(self.reporter.flush(job, 5))
+        self.assertEqual(job.sent, ['finished'])
+        self.assertEqual(job.attempts, 4)
+        self.assertGreater(time.time() - start, 0.45)  # 0.1 + 0.2 + 0.2 s of backoff
+
+    def test_flush_timeout(self):
+        """ Flush gives up after timeout, other jobs are not blocked by a failing one """
+        failing, other = FakeJob(1, failures=100), FakeJob(2)
+        self.reporter.report(failing, {'state': 'finished'})
+        self.reporter.report(other, {'state': 'running'})
+        self.assertFalse(self.reporter.flush(failing, 0.3))
+        self.assertTrue(self.reporter.flush(other, 1))
+        self.assertEqual(other.sent, ['running'])
+        failing.failures = 0
+        self.assertTrue(self.reporter.flush(failing, 1))
@@ -0,0 +1,70 @@
+import threading
+import time
+from unittest import TestCase, skipIf
+
+try:
+    from minipilot import slots
+except ImportError:
+    slots = None
+
+
+class FakeJob(object):
+    id = 1
+
+    def __init__(self, **description):
+        self.description = description
+
+
+@skipIf(slots is None, "minipilot requirements are not installed")
+class TestSlots(TestCase):
+
+    def test_defaults(self):
+        """ Node totals are taken from psutil """
+        s = slots.Slots()
+        self.assertGreater(s.cores, 0)
+        self.assertGreater(s.memory, 0)
+
+    def test_request(self):
+        """ Requests default to one core and are trimmed to the node size """
+        s = slots.Slots(4, 1000)
+        self.assertEqual(s.request(FakeJob()), (1, 0))
+        self.assertEqual(s.request(FakeJob(cores_number=2, minimum_ram=500)), (2, 500))
+        self.assertEqual(s.request(FakeJob(cores_number=8, minimum_ram=2000)), (4, 1000))
+
+    def test_packing(self):
+        """ Jobs wait until running ones free enough resources """
+        s = slots.Slots(4, 1000, jobs=3)
+        s.acquire(2, 100)
+        s.acquire(1, 800)
+        self.assertFalse(s.fits(2, 0))
+        self.assertFalse(s.fits(1, 200))
+        self.assertTrue(s.fits(1, 100))
+        s.acquire(1, 100)
+        self.assertFalse(s.fits(0, 0))
+
+        acquired = threading.Event()
+        t = threading.Thread(target=lambda: (s.acquire(2, 500), acquired.set()))
+        t.start()
+        time.sleep(0.1)
+        self.assertFalse(acquired.is_set())
+        s.release(1, 800)
+        time.sleep(0.1)
+        self.assertFalse(acquired.is_set())
+        s.release(2, 100)
+        t.join(5)
+        self.assertTrue(acquired.is_set())
+        self.assertEqual((s.free_cores, s.free_memory, s.running), (1, 400, 2))
+
+    def test_wait_free(self):
+        """ Waiting for free resources does not take them """
+        s = slots.Slots(2, 1000, jobs=2)
+        s.acquire(2, 100)
+        freed = threading.Event()
+        t = threading.Thread(target=lambda: (s.wait_free(), freed.set()))
+        t.start()
+        time.sleep(0.1)
+        self.assertFalse(freed.is_set())
+        s.release(2, 100)
+        t.join(5)
+        self.assertTrue(freed.is_set())
+        self.assertEqual((s.free_cores, s.free_memory, s.running), (2, 1000, 0))
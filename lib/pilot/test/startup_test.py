@@ -0,0 +1,52 @@
+import time
+from unittest import TestCase, skipIf
+
+try:
+    from minipilot import startup
+except ImportError:
+    startup = None
+
+
+def sleeper(seconds, value=None):
+    def fn():
+        time.sleep(seconds)
+        return value
+    return fn
+
+
+def failure():
+    raise IOError("unreachable")
+
+
+@skipIf(startup is None, "minipilot requirements are not installed")
+class TestStartup(TestCase):
+
+    def setUp(self):
+        self.startup = startup.Startup()
+
+    def test_concurrent(self):
+        """ Steps run at once """
+        start = time.time()
+        for i in range(5):
+            self.startup.start('step%d' % i, sleeper(0.3, i), 5)
+        self.assertEqual([self.startup.result('step%d' % i) for i in range(5)], list(range(5)))
+        self.assertLess(time.time() - start, 1)
+
+    def test_start_once(self):
+        """ Started step is not started again """
+        self.startup.start('step', sleeper(0, 1), 5)
+        self.assertEqual(self.startup.run('step', sleeper(0, 2), 5), 1)
+
+    def test_timeout(self):
+        """ Timed out step gives default or raises """
+        start = time.time()
+        self.startup.start('hung', sleeper(5), 0.2)
+        self.assertEqual(self.startup.result('hung', default='fallback'), 'fallback')
+        self.assertRaises(RuntimeError, self.startup.result, 'hung')
+        self.assertLess(time.time() - start, 1)
+
+    def test_failure(self):
+        """ Failed step gives default or raises its error """
+        self.startup.start('failing', failure, 5)
+        self.assertIsNone(self.startup.result('failing', default=None))
+        self.assertRaises(IOError, self.startup.result, 'failing')
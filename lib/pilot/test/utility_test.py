@@ -0,0 +1,162 @@
+import os
+import shutil
+import tempfile
+import time
+from unittest import TestCase, skipIf
+
+try:
+    from minipilot import utility
+except ImportError:
+    utility = None
+
+
+@skipIf(utility is None, "minipilot requirements are not installed")
+class TestStreamBuffer(TestCase):
+
+    def test_memory(self):
+        """ Data below the limit stays in memory """
+        b = utility.StreamBuffer(memory_limit=10)
+        b.write(b'abc')
+        b.write(b'def')
+        self.assertIsNone(b.spill)
+        self.assertEqual(b.getvalue(), b'abcdef')
+
+    def test_spill(self):
+        """ Data over the limit is moved to a temporary file and still returned whole """
+        b = utility.StreamBuffer(memory_limit=4)
+        b.write(b'abc')
+        b.write(b'def')
+        self.assertIsNotNone(b.spill)
+        self.assertEqual(b.chunks, [])
+        b.write(b'ghi')
+        self.assertEqual(b.getvalue(), b'abcdefghi')
+        self.assertEqual(b.size, 9)
+        b.close()
+
+
+class ListLogger(object):
+
+    def __init__(self):
+        self.records = []
+
+    def log(self, level, msg, *args):
+        self.records.append(msg % args)
+
+
+@skipIf(utility is None, "minipilot requirements are not installed")
+class TestLogStream(TestCase):
+
+    def test_lines(self):
+        """ Lines are logged as soon as they are complete, the rest on flush """
+        logger = ListLogger()
+        s = utility.LogStream(logger, prefix="> ")
+        s.write(b'a\nb')
+        self.assertEqual(logger.records, ['> a'])
+        s.write(b'c\nd')
+        s.flush()
+        self.assertEqual(logger.records, ['> a', '> bc', '> d'])
+
+    def test_long_line(self):
+        """ Overlong lines are split """
+        logger = ListLogger()
+        s = utility.LogStream(logger, max_line=4)
+        s.write(b'0123456789')
+        self.assertEqual(logger.records, ['0123', '4567'])
+
+    def test_call(self):
+        """ Streamed output goes to the sink and is not returned """
+        logger = ListLogger()
+        c, o, e = utility.Utility().call(['sh', '-c', 'echo 1; echo 2; echo 3 >&2'], stdout=utility.LogStream(logger))
+        self.assertEqual((c, o, e), (0, b'', b'3\n'))
+        self.assertEqual(logger.records, ['1', '2'])
+
+
+@skipIf(utility is None, "minipilot requirements are not installed")
+class TestCall(TestCase):
+
+    def test_output(self):
+        """ Utility.call returns exit code, stdout and stderr """
+        c, o, e = utility.Utility().call(['sh', '-c', 'echo out; echo err >&2; exit 3'])
+        self.assertEqual(c, 3)
+        self.assertEqual(o, b'out\n')
+        self.assertEqual(e, b'err\n')
+
+    def test_large_output(self):
+        """ Large output is collected completely, even when spilled """
+        c, o, e = utility.Utility().call(['sh', '-c', 'head -c 3000000 /dev/zero'], memory_limit=1024 * 1024)
+        self.assertEqual(c, 0)
+        self.assertEqual(len(o), 3000000)
+
+    def test_redirect(self):
+        """ Files are attached to the child directly """
+        with tempfile.TemporaryFile() as f:
+            c, o, e = utility.Utility().call(['sh', '-c', 'echo out; echo err >&2'], stdout=f)
+            f.seek(0)
+            self.assertEqual((c, o, e), (0, b'', b'err\n'))
+            self.assertEqual(f.read(), b'out\n')
+
+    def test_timeout(self):
+        """ Child running over timeout is terminated """
+        c, o, e = utility.Utility().call(['sleep', '10'], timeout=0.5, terminate_timeout=1)
+        self.assertEqual(c, -15)
+
+    def test_kill(self):
+        """ Child ignoring termination is killed after terminate_timeout """
+        c, o, e = utility.Utility().call(['sh', '-c', 'trap "" TERM; while :; do sleep 0.1; done'],
+                                         timeout=0.5, terminate_timeout=0.5)
+        self.assertEqual(c, -9)
+
+    def test_idle_wait(self):
+        """ Waiting for a long payload takes almost no pilot CPU """
+        before = os.times()
+        c, o, e = utility.Utility().call(['sleep', '2'])
+        after = os.times()
+        self.assertEqual(c, 0)
+        self.assertLess(after[0] - before[0] + after[1] - before[1], 0.2)
+
+
+@skipIf(utility is None, "minipilot requirements are not installed")
+class TestCopyFile(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.src = os.path.join(self.dir, 'src')
+        self.dst = os.path.join(self.dir, 'dst')
+        with open(self.src, 'wb') as f:
+            f.write(os.urandom(3 * 1024 * 1024 + 7))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def check_copy(self):
+        self.assertEqual(utility.copy_file(self.src, self.dst), 3 * 1024 * 1024 + 7)
+        with open(self.src, 'rb') as f_src, open(self.dst, 'rb') as f_dst:
+            self.assertEqual(f_src.read(), f_dst.read())
+
+    def test_copy(self):
+        """ File is copied completely """
+        self.check_copy()
+
+    def test_fallback(self):
+        """ Buffered copy is used without sendfile """
+        sendfile = utility._sendfile
+        utility._sendfile = None
+        try:
+            self.check_copy()
+        finally:
+            utility._sendfile = sendfile
+
+
+@skipIf(utility is None, "minipilot requirements are not installed")
+class TestParallelMap(TestCase):
+
+    def test_results(self):
+        """ Results are mapped to their items """
+        self.assertEqual(utility.parallel_map(lambda x: x * 2, [1, 2, 3], 2), {1: 2, 2: 4, 3: 6})
+        self.assertEqual(utility.parallel_map(lambda x: x * 2, [1, 2, 3], 1), {1: 2, 2: 4, 3: 6})
+
+    def test_concurrency(self):
+        """ Up to workers calls run at once """
+        start = time.time()
+        utility.parallel_map(time.sleep, [0.5] * 4, 4)
+        self.assertLess(time.time() - start, 1.5)
@@ -0,0 +1,114 @@
+#    copyright: European Organization for Nuclear Research (CERN)
+#    @license: Licensed under the Apache License, Version 2.0 (the "License");
+#    You may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at U{http://www.apache.org/licenses/LICENSE-2.0}
+"""
+Per-request latency of server queries with a new cURL handle per query against the pooled handles of Pilot.curl_query.
+
+Starts a local keep-alive HTTPS server with a self-signed certificate (made by the openssl command) standing in for the
+job server, and sends it updateJob-like POST queries with:
+    fresh       a new handle per query, connecting and handshaking every time (the former curl_query);
+    pooled      Pilot.curl_query, reusing connections and TLS sessions of the CurlPool.
+"""
+
+import BaseHTTPServer
+import SocketServer
+import optparse
+import os
+import shutil
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'lib', 'minipilot'))
+
+import pilot  # NOQA: E402
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    wbufsize = -1  # whole response in one write
+
+    def do_POST(self):  # NOQA: N802
+        self.rfile.read(int(self.headers['Content-Length']))
+        body = '{"StatusCode": 0}'
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+def start_server(directory):
+    cert = os.path.join(directory, 'server.pem')
+    subprocess.check_call(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+                           '-subj', '/CN=localhost', '-keyout', cert, '-out', cert],
+                          stdout=open(os.devnull, 'w'), stderr=subprocess.STDOUT)
+    server = Server(('localhost', 0), Handler)
+    server.socket = ssl.wrap_socket(server.socket, certfile=cert, server_side=True)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def query_fresh(p, url, body):
+    c = p.create_curl(ssl=True)
+    c.setopt(c.URL, url)
+    c.setopt(c.WRITEFUNCTION, lambda data: None)
+    c.setopt(c.POSTFIELDS, body)
+    c.perform()
+    c.close()
+
+
+def query_pooled(p, url, body):
+    p.curl_query(url, ssl=True, body=body)
+
+
+def run(name, query, p, url, number):
+    body = "node=localhost&state=running&jobId=1"
+    latencies = []
+    for _ in range(number):
+        start = time.time()
+        query(p, url, body)
+        latencies.append(time.time() - start)
+    latencies.sort()
+    print("%-8s %8.2f ms mean %8.2f ms median %8.2f ms max" % (name, sum(latencies) * 1000. / number,
+                                                               latencies[number // 2] * 1000., latencies[-1] * 1000.))
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option("-n", "--number", type="int", default=200, help="number of queries")
+    parser.add_option("-r", "--repeat", type="int", default=3, help="repetitions of every method")
+    options, args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="benchmark-")
+    server = start_server(directory)
+    try:
+        url = "https://localhost:%d/server/panda/updateJob" % server.server_address[1]
+        p = pilot.Pilot()
+        print("%d queries to %s" % (options.number, url))
+        for _ in range(options.repeat):
+            run("fresh", query_fresh, p, url, options.number)
+            run("pooled", query_pooled, p, url, options.number)
+        p.curl_engine.stop()
+        p.curl_engine.pool.close()
+    finally:
+        server.shutdown()
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
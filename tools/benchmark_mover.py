@@ -0,0 +1,92 @@
+#    copyright: European Organization for Nuclear Research (CERN)
+#    @license: Licensed under the Apache License, Version 2.0 (the "License");
+#    You may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at U{http://www.apache.org/licenses/LICENSE-2.0}
+"""
+Throughput benchmark of local storage copies against the per-file subprocess path.
+
+Creates a set of files in a temporary "storage" and stages them into a temporary "work directory" with:
+    sendfile    minipilot.utility.copy_file, as the local mover does;
+    buffered    the same with sendfile disabled;
+    subprocess  one child process per file, as the rucio command line mover does (cp stands in for rucio).
+"""
+
+import optparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'lib', 'minipilot'))
+
+import utility  # NOQA: E402
+
+
+def make_files(directory, number, size):
+    names = []
+    for i in range(number):
+        name = os.path.join(directory, 'file%04d' % i)
+        with open(name, 'wb') as f:
+            for _ in range(size // utility.COPY_BUFFER):
+                f.write(os.urandom(utility.COPY_BUFFER))
+            f.write(os.urandom(size % utility.COPY_BUFFER))
+        names.append(name)
+    return names
+
+
+def copy_sendfile(src, dst):
+    utility.copy_file(src, dst)
+
+
+def copy_buffered(src, dst):
+    sendfile = utility._sendfile
+    utility._sendfile = None
+    try:
+        utility.copy_file(src, dst)
+    finally:
+        utility._sendfile = sendfile
+
+
+def copy_subprocess(src, dst, u=utility.Utility()):
+    c, o, e = u.call(['cp', src, dst])
+    if c != 0:
+        raise RuntimeError(e)
+
+
+def run(name, copy, files, work):
+    start = time.time()
+    for f in files:
+        copy(f, os.path.join(work, os.path.basename(f)))
+    elapsed = time.time() - start
+    size = sum(os.path.getsize(f) for f in files)
+    print("%-12s %8.3f s %10.1f MB/s %8.2f ms/file" % (name, elapsed, size / elapsed / 1024. / 1024.,
+                                                       elapsed * 1000. / len(files)))
+    for f in files:
+        os.remove(os.path.join(work, os.path.basename(f)))
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option("-n", "--number", type="int", default=50, help="number of files")
+    parser.add_option("-s", "--size", type="int", default=8, help="file size, MB")
+    parser.add_option("-r", "--repeat", type="int", default=3, help="repetitions of every method")
+    options, args = parser.parse_args()
+
+    storage = tempfile.mkdtemp(prefix="storage-")
+    work = tempfile.mkdtemp(prefix="work-")
+    try:
+        files = make_files(storage, options.number, options.size * 1024 * 1024)
+        print("%d files of %d MB" % (options.number, options.size))
+        for _ in range(options.repeat):
+            run("sendfile", copy_sendfile, files, work)
+            run("buffered", copy_buffered, files, work)
+            run("subprocess", copy_subprocess, files, work)
+    finally:
+        shutil.rmtree(storage)
+        shutil.rmtree(work)
+
+
+if __name__ == '__main__':
+    main()